@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import json
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / "src"))
+
+from service import GroupingService
+from synthetic_chains import generate_rows
+
+CALCULATION = re.compile(r"<gadget.*?</output>", re.DOTALL)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+async def simulate_user(user, rows, port, latencies, errors):
+    """
+    Sends the calculations of `rows` one request at a time over its own JSON Lines connection, like a user typing a chain, then asks for the session's groups.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    session = f"user-{user}"
+
+    async def request(body):
+        start = time.perf_counter()
+        writer.write(f"{json.dumps(body)}\n".encode())
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies[body["op"]].append(time.perf_counter() - start)
+        if "error" in response:
+            errors.append(response["error"])
+        return response
+
+    for row in rows:
+        for calculation in CALCULATION.findall(row["chain"]):
+            await request({"op": "add", "session": session, "text": calculation})
+    await request({"op": "groups", "session": session})
+    writer.close()
+    await writer.wait_closed()
+
+async def run_load_test(users=50, calculations=200, workers=2, max_bytes=64 * 2**20, spill=True, seed=0):
+    """
+    Starts the service on a local port and runs `users` concurrent simulated users, each adding about `calculations` synthetic calculations to its own session. Returns the latency percentiles, throughput and memory counters.
+    """
+    with tempfile.TemporaryDirectory() as spill_dir:
+        service = GroupingService(num_workers=workers, max_bytes=max_bytes, spill_dir=spill_dir if spill else None)
+        servers = await service.start(port=0)
+        port = servers[0].sockets[0].getsockname()[1]
+
+        latencies = {"add": [], "groups": []}
+        errors = []
+        start = time.perf_counter()
+        await asyncio.gather(*[simulate_user(user, generate_rows(calculations, seed=seed + user), port, latencies, errors) for user in range(users)])
+        seconds = time.perf_counter() - start
+        stats = service.stats()
+        await service.close()
+
+    return {
+        "users": users,
+        "workers": workers,
+        "seconds": seconds,
+        "requests_per_second": sum(len(values) for values in latencies.values()) / seconds,
+        "calculations_per_second": stats["calculations"] / seconds,
+        "latency_ms": {op: {f"p{int(fraction * 100)}": percentile(values, fraction) * 1000 for fraction in (0.5, 0.9, 0.99)} for op, values in latencies.items() if values},
+        "errors": len(errors),
+        "stats": stats,
+    }
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Load test of the grouping service with concurrent simulated users.")
+    arg_parser.add_argument("--users", type=int, default=50)
+    arg_parser.add_argument("--calculations", type=int, default=200, help="Synthetic calculations per user")
+    arg_parser.add_argument("--workers", type=int, default=2, help="Parsing processes of the service, 0 for a background thread")
+    arg_parser.add_argument("--max-memory", type=float, default=64, help="Estimated session memory in MiB before evicting")
+    arg_parser.add_argument("--no-spill", action="store_true", help="Drops evicted sessions instead of spilling them to disk")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="Writes the results as JSON")
+    args = arg_parser.parse_args(argv)
+
+    results = asyncio.run(run_load_test(args.users, args.calculations, workers=args.workers, max_bytes=int(args.max_memory * 2**20), spill=not args.no_spill, seed=args.seed))
+    print(json.dumps(results, indent=1))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=1))
+    return 1 if results["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / "src"))
+
+from parser.calc_math_qa_parser import Calc_Math_QA_Processer, combine_dicts
+from structures import create_graph
+from logic import classify_groups, sort_groups, chain_groups
+from synthetic_chains import generate_rows
+
+FIXTURES_PATH = BENCHMARK_DIR / "fixtures" / "calc_math_qa_rows.json"
+STAGES = ("process_chain", "combine_dicts", "create_graph", "classify_groups", "sort_groups", "chain_groups")
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+
+def load_fixture_rows(num_nodes, path=FIXTURES_PATH):
+    """
+    Tiles the fixture rows (hand-written unless replaced by `record_fixtures`) until they hold at least `num_nodes` calculations, giving each copy its own id.
+    """
+    fixtures = json.loads(Path(path).read_text())
+    rows = []
+    num_calculations = 0
+    while num_calculations < num_nodes:
+        fixture = fixtures[len(rows) % len(fixtures)]
+        rows.append({"id": f"{fixture['id']}-{len(rows)}", "chain": fixture["chain"]})
+        num_calculations += fixture["chain"].count("</gadget>")
+    return rows
+
+def run_pipeline(rows, seed=0, match_values=False):
+    """
+    Runs every stage once over `rows` (as a single mix) and returns the seconds spent per stage.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    processor = Calc_Math_QA_Processer(special_func=set(), special_var=set())
+    samples = []
+    for row in rows:
+        sample = processor.process_chain(row)
+        sample["id"] = row["id"]
+        samples.append(sample)
+    timings["process_chain"] = time.perf_counter() - start
+
+    random.seed(seed)
+    start = time.perf_counter()
+    combined_dict = combine_dicts(samples)
+    timings["combine_dicts"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    adjacency_list = create_graph(combined_dict, match_values=match_values)
+    timings["create_graph"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    all_groups, reverse_adjacency = classify_groups(adjacency_list)
+    timings["classify_groups"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sort_groups(all_groups, adjacency_list, reverse_adjacency)
+    timings["sort_groups"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chain_groups(all_groups, adjacency_list, reverse_adjacency)
+    timings["chain_groups"] = time.perf_counter() - start
+
+    return timings, len(combined_dict["expressions"]), sum(len(node.get_neighbors_indices()) for node in adjacency_list.get_nodes())
+
+def measure_memory(rows, seed=0, match_values=False):
+    """
+    Runs the pipeline once under `tracemalloc` and returns the peak bytes allocated per stage.
+    """
+    peaks = {}
+    processor = Calc_Math_QA_Processer(special_func=set(), special_var=set())
+
+    def traced(stage, func, *args):
+        gc.collect()
+        tracemalloc.start()
+        result = func(*args)
+        peaks[stage] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result
+
+    samples = traced("process_chain", lambda: [dict(processor.process_chain(row), id=row["id"]) for row in rows])
+    random.seed(seed)
+    combined_dict = traced("combine_dicts", combine_dicts, samples)
+    adjacency_list = traced("create_graph", lambda: create_graph(combined_dict, match_values=match_values))
+    all_groups, reverse_adjacency = traced("classify_groups", classify_groups, adjacency_list)
+    traced("sort_groups", sort_groups, all_groups, adjacency_list, reverse_adjacency)
+    traced("chain_groups", chain_groups, all_groups, adjacency_list, reverse_adjacency)
+    return peaks
+
+def run_benchmarks(sizes=DEFAULT_SIZES, workload="synthetic", repeat=3, memory=True, seed=0, generator_options=None, match_values=False):
+    """
+    Benchmarks every stage at each size. Returns the machine-readable results, one record per (size, stage) with the best and mean seconds over `repeat` runs and the peak traced bytes.
+
+    :param sizes: Number of calculations (graph nodes) per mix
+    :param workload: `synthetic` chains from `generate_rows`, or the fixture rows (see `load_fixture_rows`)
+    :param repeat: Timed runs per size, each with a fresh processor and evaluation cache
+    :param memory: Whether to also measure peak memory in one extra traced run
+    :param generator_options: Keyword arguments for `generate_rows` (e.g. `{"depth": 5, "function_rate": 0.2}`)
+    :param match_values: Builds the graphs by joining on value IDs (`create_graph(..., match_values=True)`)
+    """
+    generator_options = generator_options or {}
+    records = []
+    for size in sizes:
+        if workload == "fixtures":
+            rows = load_fixture_rows(size)
+        else:
+            rows = generate_rows(size, seed=seed, **generator_options)
+
+        runs = []
+        for _ in range(repeat):
+            timings, num_nodes, num_edges = run_pipeline(rows, seed=seed, match_values=match_values)
+            runs.append(timings)
+        peaks = measure_memory(rows, seed=seed, match_values=match_values) if memory else {}
+
+        for stage in STAGES:
+            seconds = [run[stage] for run in runs]
+            records.append({
+                "stage": stage,
+                "size": size,
+                "nodes": num_nodes,
+                "edges": num_edges,
+                "best_seconds": min(seconds),
+                "mean_seconds": sum(seconds) / len(seconds),
+                "peak_bytes": peaks.get(stage),
+            })
+        print(f"size {size}: {num_nodes} nodes, {num_edges} edges, {sum(min(run[stage] for run in runs) for stage in STAGES):.3f}s", file=sys.stderr)
+
+    return {
+        "meta": {
+            "workload": workload,
+            "repeat": repeat,
+            "seed": seed,
+            "generator_options": generator_options,
+            "match_values": match_values,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": records,
+    }
+
+def compare_results(results, baseline, tolerance=0.25, min_seconds=0.001):
+    """
+    Compares the best timings and peak memory with a saved baseline. Returns the regressions, each a record slower (or larger) than the baseline by more than `tolerance`.
+    Timings below `min_seconds` in both runs are treated as noise.
+    """
+    baseline_records = {(record["stage"], record["size"]): record for record in baseline["results"]}
+    regressions = []
+    for record in results["results"]:
+        previous = baseline_records.get((record["stage"], record["size"]))
+        if previous is None:
+            continue
+        if max(record["best_seconds"], previous["best_seconds"]) >= min_seconds and record["best_seconds"] > previous["best_seconds"] * (1 + tolerance):
+            regressions.append({"stage": record["stage"], "size": record["size"], "metric": "best_seconds", "baseline": previous["best_seconds"], "current": record["best_seconds"]})
+        if record["peak_bytes"] and previous["peak_bytes"] and record["peak_bytes"] > previous["peak_bytes"] * (1 + tolerance):
+            regressions.append({"stage": record["stage"], "size": record["size"], "metric": "peak_bytes", "baseline": previous["peak_bytes"], "current": record["peak_bytes"]})
+    return regressions
+
+def print_table(results, file=sys.stdout):
+    print(f"{'stage':<16}{'size':>8}{'nodes':>8}{'edges':>10}{'best s':>12}{'mean s':>12}{'peak MiB':>10}", file=file)
+    for record in results["results"]:
+        peak = f"{record['peak_bytes'] / 2**20:.2f}" if record["peak_bytes"] is not None else "-"
+        print(f"{record['stage']:<16}{record['size']:>8}{record['nodes']:>8}{record['edges']:>10}{record['best_seconds']:>12.5f}{record['mean_seconds']:>12.5f}{peak:>10}", file=file)
+
+def record_fixtures(num_rows, path=FIXTURES_PATH):
+    """
+    Records the first `num_rows` training rows of `MU-NLPC/Calc-math_qa` as fixtures. Needs network access (or the HuggingFace cache) once.
+    """
+    from datasets import load_dataset
+    train = load_dataset("MU-NLPC/Calc-math_qa", "original-splits")["train"]
+    rows = [{"id": row["id"], "chain": row["chain"]} for row in train.select(range(num_rows))]
+    Path(path).write_text(json.dumps(rows, indent=1))
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Offline benchmarks of every grouping pipeline stage.")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Calculations (graph nodes) per mix")
+    arg_parser.add_argument("--workload", choices=("synthetic", "fixtures"), default="synthetic")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--no-memory", action="store_true", help="Skip the traced memory run")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--calculations", type=int, default=5, help="Synthetic calculations per chain")
+    arg_parser.add_argument("--depth", type=int, default=3, help="Synthetic dependency levels per chain")
+    arg_parser.add_argument("--function-rate", type=float, default=0.1)
+    arg_parser.add_argument("--collision-rate", type=float, default=0.05)
+    arg_parser.add_argument("--small-result-rate", type=float, default=0.0, help="Rate of small single function results, which grow the edges quadratically")
+    arg_parser.add_argument("--match-values", action="store_true", help="Joins on value IDs when building the graphs")
+    arg_parser.add_argument("--output", help="Writes the results as JSON")
+    arg_parser.add_argument("--baseline", help="Saved results to compare against, exits with 1 on a regression")
+    arg_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown (or memory growth) against the baseline")
+    arg_parser.add_argument("--record-fixtures", type=int, metavar="ROWS", help="Records ROWS dataset rows as fixtures and exits")
+    args = arg_parser.parse_args(argv)
+
+    if args.record_fixtures:
+        record_fixtures(args.record_fixtures)
+        return 0
+
+    generator_options = {"num_calculations": args.calculations, "depth": args.depth, "function_rate": args.function_rate, "collision_rate": args.collision_rate, "small_result_rate": args.small_result_rate}
+    results = run_benchmarks(args.sizes, workload=args.workload, repeat=args.repeat, memory=not args.no_memory, seed=args.seed, generator_options=generator_options if args.workload == "synthetic" else None, match_values=args.match_values)
+    print_table(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=1))
+
+    if args.baseline:
+        regressions = compare_results(results, json.loads(Path(args.baseline).read_text()), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['stage']} @ {regression['size']}: {regression['metric']} {regression['baseline']:.6g} -> {regression['current']:.6g}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import math
+import random
+
+GADGET_FORMAT = '<gadget id="calculator">{}</gadget>\n<output>{}</output>\n\n'
+VALUE_LIMIT = 10 ** 9
+
+class ChainGenerator():
+    """
+    Generates synthetic `MU-NLPC/Calc-math_qa` style chains (gadget/output tags) whose results are computed exactly, so they run through `process_chain` like real rows.
+    - `num_calculations`: Calculations per chain
+    - `depth`: Number of levels the calculations are spread over, every calculation above the first level consumes a result of the level below
+    - `function_rate`: Probability of a calculation using a special function (e.g. `lcm(12, 18)`, `log(8)` which needs Sympy)
+    - `collision_rate`: Probability of a fresh operand being drawn from the results of earlier chains instead of a random literal, creating edges between chains once they are mixed
+    - `small_result_rate`: Probability of a special function returning a small value (e.g. `gcd(35, 16)` = `1`), whose digits collide with most expressions and make the edge count grow quadratically
+    - `sub_expression_rate`: Probability of a calculation nesting a parenthesised sub-expression (e.g. `(36 + 4) / 2`)
+    - `shared_rate`: Probability of a calculation consuming a second earlier result, so results feed several later calculations
+    - `max_literal`: Largest random literal, a wider range keeps unrelated chains from sharing values by chance
+    """
+    def __init__(self, num_calculations=5, depth=3, function_rate=0.1, collision_rate=0.05, sub_expression_rate=0.3, shared_rate=0.2, small_result_rate=0.0, max_literal=999, seed=0):
+        self.num_calculations = num_calculations
+        self.depth = max(1, min(depth, num_calculations))
+        self.function_rate = function_rate
+        self.collision_rate = collision_rate
+        self.sub_expression_rate = sub_expression_rate
+        self.shared_rate = shared_rate
+        self.small_result_rate = small_result_rate
+        self.max_literal = max_literal
+        self.random = random.Random(seed)
+        self.previous_results = []
+
+    def generate_chain(self):
+        """
+        Returns a single gadget formatted chain ending with the final result like the dataset.
+        """
+        levels = [[] for _ in range(self.depth)]
+        parts = []
+        output = ""
+        for i in range(self.num_calculations):
+            level = i * self.depth // self.num_calculations
+            if level > 0 and levels[level-1]:
+                left = self.random.choice(levels[level-1])
+            else:
+                left = self.fresh_operand()
+
+            expression, result, output = self.generate_calculation(left, levels, level)
+            if result is not None:
+                levels[level].append(result)
+            parts.append(GADGET_FORMAT.format(expression, output))
+
+        self.previous_results.extend(result for results in levels for result in results[-1:])
+        if len(self.previous_results) > 4096:
+            del self.previous_results[:2048]
+        return "".join(parts) + f"Final result is {output}"
+
+    def generate_rows(self, num_rows, id_prefix="synthetic"):
+        """
+        Returns `num_rows` dataset rows with the `id` and `chain` columns read by `process_chain`.
+        """
+        return [{"id": f"{id_prefix}-{i}", "chain": self.generate_chain()} for i in range(num_rows)]
+
+    def generate_calculation(self, left, levels, level):
+        if self.random.random() < self.function_rate:
+            return self.function_calculation(left)
+
+        earlier = [result for results in levels[:level+1] for result in results]
+        if earlier and self.random.random() < self.shared_rate:
+            right = self.random.choice(earlier)
+        else:
+            right = self.fresh_operand()
+
+        if self.random.random() < self.sub_expression_rate:
+            inner = self.fresh_operand()
+            inner_op, inner_value = self.pick_operator(right, inner)
+            op, result = self.pick_operator(left, inner_value)
+            return f"{left} {op} ({right} {inner_op} {inner})", result, str(result)
+
+        op, result = self.pick_operator(left, right)
+        return f"{left} {op} {right}", result, str(result)
+
+    def function_calculation(self, left):
+        operand = abs(left) or 1
+        if self.random.random() < self.small_result_rate:
+            # A single function with a small result (e.g. `factorial(3)` = `6`) links to every expression containing its digits
+            if self.random.random() < 0.5:
+                n = self.random.randint(0, 5)
+                return f"factorial({n})", math.factorial(n), str(math.factorial(n))
+            other = self.random.randint(2, 24)
+            return f"gcd({left}, {other})", math.gcd(operand, other), str(math.gcd(operand, other))
+
+        if abs(left) < self.max_literal // 10:
+            # Results of single functions are matched as substrings, short ones would collide by chance
+            left = self.random.randint(self.max_literal // 10, self.max_literal)
+            operand = left
+        func = self.random.choice(("lcm", "gcd", "sqrt", "floor", "log"))
+        if func in ("lcm", "gcd"):
+            other = operand * self.random.randint(2, 9)
+            result = math.lcm(operand, other) if func == "lcm" else math.gcd(operand, other)
+            return f"{func}({left}, {other})", result, str(result)
+        if func == "sqrt":
+            return f"sqrt({left} * {left})", abs(left), str(abs(left))
+        if func == "floor":
+            divisor = self.random.randint(2, 9)
+            return f"floor({left} / {divisor})", left // divisor, str(left // divisor)
+        # Irrational results need Sympy and are reported like the dataset, e.g. `log(8) = around 2.079442`, later calculations only consume exact results
+        value = round(math.log(operand), 6)
+        return f"log({operand})", None, f"log({operand}) = around {value}"
+
+    def pick_operator(self, left, right):
+        op = self.random.choice("+-*/")
+        if op == "*" and abs(left * right) > VALUE_LIMIT:
+            op = "-"
+        if op == "/" and (right == 0 or left % right != 0):
+            op = "+"
+        result = {"+": left + right, "-": left - right, "*": left * right, "/": left // right if right else None}[op]
+        if abs(result) < 10 and op != "+":
+            # Keeps accidental small results (e.g. `x - x`) rare, see `small_result_rate`
+            op, result = "+", left + right
+        return op, result
+
+    def fresh_operand(self):
+        if self.previous_results and self.random.random() < self.collision_rate:
+            return self.random.choice(self.previous_results)
+        return self.random.randint(2, self.max_literal)
+
+def generate_rows(num_nodes, num_calculations=5, depth=3, function_rate=0.1, collision_rate=0.05, small_result_rate=0.0, seed=0):
+    """
+    Returns enough synthetic rows for `num_nodes` calculations in total (the last row is shortened to fit).
+    The literal range grows with `num_nodes`, so chance collisions stay proportional and `collision_rate` controls the shared values.
+
+    :param num_nodes: Total calculations across the rows
+    """
+    generator = ChainGenerator(num_calculations=num_calculations, depth=depth, function_rate=function_rate, collision_rate=collision_rate, small_result_rate=small_result_rate, max_literal=max(999, 10 * num_nodes), seed=seed)
+    rows = generator.generate_rows(num_nodes // num_calculations)
+    remainder = num_nodes % num_calculations
+    if remainder:
+        generator.num_calculations = remainder
+        generator.depth = min(generator.depth, remainder)
+        rows.append({"id": f"synthetic-{len(rows)}", "chain": generator.generate_chain()})
+    return rows
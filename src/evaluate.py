@@ -0,0 +1,33 @@
+import os
+import json
+import argparse
+from parser import load_feature_stores
+from evaluation import run_batches
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Groups random mixes of processed samples in parallel and scores them against the samples they came from")
+    arg_parser.add_argument("--data", default="./data", help="Processed dataset directory, processed first when missing")
+    arg_parser.add_argument("--split", choices=("train", "val"), default="train")
+    arg_parser.add_argument("--store", help="Feature store to mix instead of the split's, e.g. ./data/val.arrow")
+    arg_parser.add_argument("--mixes", type=int, default=1000, help="Number of random mixes")
+    arg_parser.add_argument("--mix-size", type=int, default=2, help="Number of samples per mix")
+    arg_parser.add_argument("--batch-size", type=int, default=64, help="Number of mixes per task")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--num-proc", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--match-values", action="store_true", help="Joins on value IDs when building the graphs")
+    arg_parser.add_argument("--cache", help="ResultCache file reusing the groupings of mixes drawn by earlier runs")
+    arg_parser.add_argument("--output", default="results.jsonl", help="A .jsonl file or .parquet directory, resumed when it already exists")
+    arg_parser.add_argument("--summary", help="Writes the summary as JSON")
+    args = arg_parser.parse_args()
+
+    if args.store is None:
+        train, val = load_feature_stores(args.data)
+        store_path = (train if args.split == "train" else val).path
+    else:
+        store_path = args.store
+
+    summary = run_batches(store_path, args.output, args.mixes, mix_size=args.mix_size, batch_size=args.batch_size, seed=args.seed, num_proc=args.num_proc, match_values=args.match_values, cache_path=args.cache)
+    print(json.dumps(summary, indent=4))
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=4)
@@ -0,0 +1,2 @@
+from .grouping_metrics import group_labels, purity, adjusted_rand_index, ordering_pairs, ordering_accuracy, valid_true_orders
+from .batch_runner import run_batches, score_mix, summarize
@@ -0,0 +1,256 @@
+import os
+import json
+import math
+import time
+from pathlib import Path
+from multiprocess import Pool
+import pyarrow as pa
+import pyarrow.parquet as pq
+from parser import FeatureStore, MixSampler, ResultCache
+from structures import create_graph
+from logic import classify_groups, sort_groups, chain_groups
+from .grouping_metrics import group_labels, purity, adjusted_rand_index, ordering_pairs, valid_true_orders
+
+# Columns of a mix's result, fixed so every batch writes the same Parquet schema
+RESULT_SCHEMA = pa.schema([
+    ("mix", pa.int64()),
+    ("batch", pa.int64()),
+    ("rows", pa.list_(pa.int64())),
+    ("sample_ids", pa.list_(pa.string())),
+    ("num_nodes", pa.int64()),
+    ("num_edges", pa.int64()),
+    ("num_groups", pa.int64()),
+    ("purity", pa.float64()),
+    ("adjusted_rand_index", pa.float64()),
+    ("ordering_accuracy", pa.float64()),
+    ("correct_pairs", pa.int64()),
+    ("ordered_pairs", pa.int64()),
+    ("valid_true_orders", pa.float64()),
+    ("seconds", pa.float64()),
+])
+
+# Sampler and settings of a pool worker, set once by `start_worker` as a memory-mapped store cannot be sent to the workers
+worker = {}
+
+def start_worker(store_path, mix_size, seed, batch_size, match_values, cache_path=None):
+    worker["sampler"] = MixSampler(FeatureStore(store_path), mix_size=mix_size)
+    worker["seed"] = seed
+    worker["batch_size"] = batch_size
+    worker["match_values"] = match_values
+    worker["result_cache"] = ResultCache(cache_path) if cache_path is not None else None
+
+def score_mix(mix, match_values=False, result_cache=None):
+    """
+    Runs `create_graph` -> `classify_groups` -> `sort_groups` -> `chain_groups` on a mix of `MixSampler` and scores the groups against the samples the calculations came from.
+    Returns the result fields of `RESULT_SCHEMA` other than `mix` and `batch`.
+
+    :param result_cache: Optional `ResultCache` reusing the grouping of a mix drawn by an earlier run (see `ResultCache.group_sampled_mix`), used when the store has an `id` column
+    """
+    start = time.perf_counter()
+    if result_cache is not None and "source_ids" in mix:
+        grouped = result_cache.group_sampled_mix(mix, match_values=match_values)
+        all_groups, orderings, reverse_adjacency, num_edges = grouped["groups"], grouped["orderings"], grouped["reverse_adjacency"], grouped["num_edges"]
+    else:
+        adjacency_list = create_graph(mix, match_values=match_values)
+        all_groups, reverse_adjacency = classify_groups(adjacency_list)
+        orderings = sort_groups(all_groups, adjacency_list, reverse_adjacency)
+        chain_groups(all_groups, adjacency_list, reverse_adjacency)
+        num_edges = sum(len(node.get_neighbors_indices()) for node in adjacency_list.get_nodes())
+    seconds = time.perf_counter() - start
+
+    true_labels = mix["source_rows"]
+    predicted_labels = group_labels(all_groups, len(true_labels))
+    correct, total = ordering_pairs(orderings, true_labels, mix["source_positions"])
+    rows = list(dict.fromkeys(true_labels))
+    sample_ids = list(dict.fromkeys(mix["source_ids"])) if "source_ids" in mix else [str(row) for row in rows]
+
+    return {
+        "rows": rows,
+        "sample_ids": sample_ids,
+        "num_nodes": len(true_labels),
+        "num_edges": num_edges,
+        "num_groups": len(all_groups),
+        "purity": purity(true_labels, predicted_labels),
+        "adjusted_rand_index": adjusted_rand_index(true_labels, predicted_labels),
+        "ordering_accuracy": correct / total if total else None,
+        "correct_pairs": correct,
+        "ordered_pairs": total,
+        "valid_true_orders": valid_true_orders(all_groups, reverse_adjacency, true_labels, mix["source_positions"]),
+        "seconds": seconds,
+    }
+
+def run_batch(task):
+    """
+    Draws and scores one batch of mixes in a worker. The generator is reseeded with the batch index, so a resumed run draws the same mixes.
+
+    :param task: `(batch_index, num_mixes)`
+    """
+    batch_index, num_mixes = task
+    sampler = worker["sampler"]
+    sampler.reseed((worker["seed"], batch_index))
+    records = []
+    for k, mix in enumerate(sampler.to_mixes(*sampler.take_batch(sampler.sample_rows(num_mixes)))):
+        record = {"mix": batch_index * worker["batch_size"] + k, "batch": batch_index}
+        record.update(score_mix(mix, worker["match_values"], worker["result_cache"]))
+        records.append(record)
+    return batch_index, records
+
+class JSONLResults():
+    """
+    Results streamed to a JSON Lines file, one line per mix. The lines of a batch are written and flushed together.
+    When resuming, batches an interruption cut short (including a half written last line) are dropped and drawn again.
+
+    :param path: File to write, e.g. `results.jsonl`
+    :param batch_sizes: Number of mixes of each batch, to tell complete batches apart
+    """
+    def __init__(self, path, batch_sizes):
+        self.path = Path(path)
+        self.completed = set()
+
+        if self.path.is_file():
+            batches = {}
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    batches.setdefault(record["batch"], []).append(line if line.endswith("\n") else f"{line}\n")
+            kept = {batch_index: lines for batch_index, lines in batches.items() if batch_index < len(batch_sizes) and len(lines) == batch_sizes[batch_index]}
+            self.completed = set(kept)
+            temporary = self.path.with_name(f"{self.path.name}.tmp")
+            with open(temporary, "w") as f:
+                for batch_index in sorted(kept):
+                    f.writelines(kept[batch_index])
+            os.replace(temporary, self.path)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.file = open(self.path, "a")
+
+    def write(self, batch_index, records):
+        self.file.write("".join(f"{json.dumps(record)}\n" for record in records))
+        self.file.flush()
+        self.completed.add(batch_index)
+
+    def read(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def close(self):
+        self.file.close()
+
+class ParquetResults():
+    """
+    Results streamed to a directory of Parquet files, one per batch (`batch-000012.parquet`). Each file is written under a temporary name and renamed once complete, so an interruption never leaves a partial batch behind.
+
+    :param path: Directory to write, e.g. `results.parquet`
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.completed = {int(file.stem.split("-")[1]) for file in self.path.glob("batch-*.parquet")}
+
+    def write(self, batch_index, records):
+        file = self.path / f"batch-{batch_index:06d}.parquet"
+        temporary = self.path / f"batch-{batch_index:06d}.tmp"
+        pq.write_table(pa.Table.from_pylist(records, schema=RESULT_SCHEMA), temporary)
+        os.replace(temporary, file)
+        self.completed.add(batch_index)
+
+    def read(self):
+        files = sorted(self.path.glob("batch-*.parquet"))
+        if not files:
+            return []
+        return pa.concat_tables(pq.read_table(file, schema=RESULT_SCHEMA) for file in files).to_pylist()
+
+    def close(self):
+        pass
+
+def summarize(records):
+    """
+    Returns the mean `purity`, `adjusted_rand_index` and `valid_true_orders` over the mixes, and the `ordering_accuracy` over every compared pair of calculations.
+    """
+    if not records:
+        return {"mixes": 0}
+    correct = sum(record["correct_pairs"] for record in records)
+    total = sum(record["ordered_pairs"] for record in records)
+    pipeline_seconds = sum(record["seconds"] for record in records)
+    # Results written before `valid_true_orders` existed have no value for it
+    true_orders = [record["valid_true_orders"] for record in records if record.get("valid_true_orders") is not None]
+    return {
+        "mixes": len(records),
+        "calculations": sum(record["num_nodes"] for record in records),
+        "purity": sum(record["purity"] for record in records) / len(records),
+        "adjusted_rand_index": sum(record["adjusted_rand_index"] for record in records) / len(records),
+        "exact_groupings": sum(record["adjusted_rand_index"] == 1.0 for record in records) / len(records),
+        "ordering_accuracy": correct / total if total else None,
+        "valid_true_orders": sum(true_orders) / len(true_orders) if true_orders else None,
+        "pipeline_mixes_per_second": len(records) / pipeline_seconds if pipeline_seconds else None,
+    }
+
+def run_batches(store_path, output, num_mixes, mix_size=2, batch_size=64, seed=0, num_proc=1, match_values=False, cache_path=None):
+    """
+    Groups `num_mixes` random mixes of a feature store in a process pool and streams the scored results to `output` as batches finish.
+    The settings are saved next to the output (`results.jsonl.run.json`), and running again with the same output resumes by skipping the batches already written.
+    Returns the summary of every result (see `summarize`) with the throughput of this run.
+
+    :param store_path: Path of a feature store, e.g. `./data/train.arrow`
+    :param output: `.jsonl` file or `.parquet` directory to write the results to
+    :param num_mixes: Number of random mixes to group
+    :param mix_size: Number of samples combined per mix
+    :param batch_size: Number of mixes drawn and scored per task
+    :param seed: Seed of the mixes, each batch is drawn with `(seed, batch_index)`
+    :param num_proc: Number of worker processes
+    :param match_values: Builds the graphs by joining on value IDs
+    :param cache_path: Optional `ResultCache` file, the groupings of mixes drawn by an earlier run (e.g. with another output or `num_mixes`) are read from it instead. The scores are the same with or without it
+    """
+    output = Path(output)
+    settings = {"store": str(Path(store_path).resolve()), "num_mixes": num_mixes, "mix_size": mix_size, "batch_size": batch_size, "seed": seed, "match_values": match_values}
+    settings_path = output.with_name(f"{output.name}.run.json")
+    if settings_path.is_file():
+        with open(settings_path) as f:
+            saved = json.load(f)
+        if saved != settings:
+            raise ValueError(f"{output} was written with different settings {saved}, resume with the same ones or choose another output")
+    else:
+        settings_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(settings_path, "w") as f:
+            json.dump(settings, f)
+
+    num_batches = math.ceil(num_mixes / batch_size)
+    batch_sizes = [min(batch_size, num_mixes - batch_index*batch_size) for batch_index in range(num_batches)]
+    results = ParquetResults(output) if output.suffix == ".parquet" else JSONLResults(output, batch_sizes)
+    resumed = len(results.completed)
+    tasks = [(batch_index, batch_sizes[batch_index]) for batch_index in range(num_batches) if batch_index not in results.completed]
+
+    start = time.perf_counter()
+    mixes = 0
+    calculations = 0
+    worker_args = (store_path, mix_size, seed, batch_size, match_values, cache_path)
+    try:
+        if num_proc > 1 and len(tasks) > 1:
+            with Pool(min(num_proc, len(tasks)), initializer=start_worker, initargs=worker_args) as pool:
+                for batch_index, records in pool.imap_unordered(run_batch, tasks):
+                    results.write(batch_index, records)
+                    mixes += len(records)
+                    calculations += sum(record["num_nodes"] for record in records)
+        else:
+            start_worker(*worker_args)
+            for task in tasks:
+                batch_index, records = run_batch(task)
+                results.write(batch_index, records)
+                mixes += len(records)
+                calculations += sum(record["num_nodes"] for record in records)
+    finally:
+        results.close()
+    seconds = time.perf_counter() - start
+
+    summary = summarize(results.read())
+    summary.update({
+        "resumed_batches": resumed,
+        "seconds": seconds,
+        "mixes_per_second": mixes / seconds if mixes else None,
+        "calculations_per_second": calculations / seconds if mixes else None,
+    })
+    return summary
@@ -0,0 +1,86 @@
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from logic import GroupOrder
+
+def group_labels(all_groups, num_nodes):
+    """
+    Returns the index of the group each node belongs to, as found by `classify_groups`.
+    """
+    labels = [-1] * num_nodes
+    for group_indice, group in enumerate(all_groups):
+        for node_indice in group:
+            labels[node_indice] = group_indice
+    return labels
+
+def purity(true_labels, predicted_labels):
+    """
+    Fraction of nodes that belong to the most common true group of their predicted group. A predicted group mixing calculations of several samples lowers it, splitting a sample into several groups does not.
+    """
+    if not true_labels:
+        return 1.0
+    overlaps = defaultdict(Counter)
+    for true_label, predicted_label in zip(true_labels, predicted_labels):
+        overlaps[predicted_label][true_label] += 1
+    return sum(max(counts.values()) for counts in overlaps.values()) / len(true_labels)
+
+def pairs(count):
+    return count * (count - 1) / 2
+
+def adjusted_rand_index(true_labels, predicted_labels):
+    """
+    Adjusted Rand index of the predicted groups against the true groups (Hubert and Arabie), 1.0 for identical groupings and around 0.0 for random ones.
+    Penalizes both merged and split samples. Groupings that leave nothing to compare (e.g. a single node) score 1.0.
+    """
+    contingency = Counter(zip(true_labels, predicted_labels))
+    index = sum(pairs(count) for count in contingency.values())
+    true_pairs = sum(pairs(count) for count in Counter(true_labels).values())
+    predicted_pairs = sum(pairs(count) for count in Counter(predicted_labels).values())
+    total_pairs = pairs(len(true_labels))
+
+    expected_index = true_pairs * predicted_pairs / total_pairs if total_pairs else 0.0
+    max_index = (true_pairs + predicted_pairs) / 2
+    if max_index == expected_index:
+        return 1.0
+    return (index - expected_index) / (max_index - expected_index)
+
+def ordering_pairs(orderings, true_labels, positions):
+    """
+    Compares the orderings of `sort_groups` against the original order of the chains. Returns the following:
+    - `correct`: Pairs of calculations from the same sample, placed in the same ordering, whose relative order matches their positions in the sample's chain
+    - `total`: Number of such pairs
+
+    :param orderings: Node indices of each group in calculation order
+    :param true_labels: Source sample of each node
+    :param positions: Index of each node within its source sample's chain
+    """
+    correct = 0
+    total = 0
+    for ordering in orderings:
+        seen = defaultdict(list)
+        for node_indice in ordering:
+            # Counts the earlier placed calculations of the same sample that also came earlier in its chain
+            earlier = seen[true_labels[node_indice]]
+            correct += bisect_left(earlier, positions[node_indice])
+            total += len(earlier)
+            insort(earlier, positions[node_indice])
+    return correct, total
+
+def ordering_accuracy(orderings, true_labels, positions):
+    """
+    Fraction of the pairs of `ordering_pairs` placed in their original order, `None` when no two calculations of a sample share an ordering.
+    """
+    correct, total = ordering_pairs(orderings, true_labels, positions)
+    return correct / total if total else None
+
+def valid_true_orders(all_groups, reverse_adjacency, true_labels, positions):
+    """
+    Fraction of the groups whose calculations, in their original order (by source sample, then position in its chain), form a valid ordering of the group. `sort_groups` picks one valid ordering, so this tells whether the original order was among those it could have picked.
+    Returns `None` when there are no groups.
+    """
+    if not all_groups:
+        return None
+    valid = 0
+    for group in all_groups:
+        group_order = GroupOrder(group, reverse_adjacency)
+        valid += group_order.is_valid(sorted(group_order.nodes, key=lambda node: (true_labels[node], positions[node])))
+    return valid / len(all_groups)
@@ -0,0 +1,30 @@
+import os
+import json
+import argparse
+from parser import load_feature_stores
+from gnn import export_graphs
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Exports random mixes of processed samples as batched GNN graphs with node features and ground truth groups")
+    arg_parser.add_argument("--data", default="./data", help="Processed dataset directory, processed first when missing")
+    arg_parser.add_argument("--split", choices=("train", "val"), default="train")
+    arg_parser.add_argument("--store", help="Feature store to mix instead of the split's, e.g. ./data/val.arrow")
+    arg_parser.add_argument("--graphs", type=int, default=100000, help="Number of random mixes")
+    arg_parser.add_argument("--mix-size", type=int, default=2, help="Number of samples per mix")
+    arg_parser.add_argument("--shard-size", type=int, default=10000, help="Number of graphs per shard")
+    arg_parser.add_argument("--batch-size", type=int, default=256, help="Number of mixes gathered at once")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--num-proc", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--match-values", action="store_true", help="Joins on value IDs when building the graphs")
+    arg_parser.add_argument("--compress", action="store_true", help="Writes compressed .npz shards, which are loaded instead of memory-mapped")
+    arg_parser.add_argument("--output", default="./data/graphs", help="Shard directory, resumed when it already exists")
+    args = arg_parser.parse_args()
+
+    if args.store is None:
+        train, val = load_feature_stores(args.data)
+        store_path = (train if args.split == "train" else val).path
+    else:
+        store_path = args.store
+
+    meta = export_graphs(store_path, args.output, args.graphs, mix_size=args.mix_size, shard_size=args.shard_size, batch_size=args.batch_size, seed=args.seed, num_proc=args.num_proc, match_values=args.match_values, compress=args.compress)
+    print(json.dumps({key: value for key, value in meta.items() if key != "shards"}, indent=4))
@@ -0,0 +1 @@
+from .graph_export import export_graphs, export_shard, node_features, operator_vocabulary, feature_names, GraphShards
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import shutil
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from instrumentation import instrumentation, instrumented
+from parser import FeatureStore, MixSampler, GRAPH_COLUMNS
+from structures import create_csr_graph
+
+SYMBOL_OPERATORS = ("+", "-", "*", "/", "**", "%")
+FLAG_COLUMNS = ("has_sub_expressions", "has_function_calls", "has_special_variables")
+COUNT_COLUMNS = ("operands", "main_operands", "sub_expressions")
+# Columns read from the store, the graph columns build the edges and the rest only the node features
+EXPORT_COLUMNS = tuple(dict.fromkeys(GRAPH_COLUMNS + FLAG_COLUMNS + COUNT_COLUMNS + ("main_operators", "main_operand_values")))
+# Arrays of a shard, one `.npy` file each (or one `.npz` when compressed)
+SHARD_ARRAYS = ("x", "edge_index", "node_offsets", "edge_offsets", "y", "positions", "source_rows")
+
+def operator_vocabulary(store):
+    """
+    Returns the main operators of the one-hot node features: the symbol operators followed by every function used as a main operator in the store, in alphabetical order.
+    """
+    table = store.read(["main_operators"]) if isinstance(store, FeatureStore) else store.select(["main_operators"])
+    used = pc.unique(table.column("main_operators").combine_chunks().flatten()).drop_null().to_pylist()
+    return list(SYMBOL_OPERATORS) + sorted(set(used) - set(SYMBOL_OPERATORS))
+
+def feature_names(operators):
+    """
+    Returns the name of every column of the node feature matrix `x`.
+    """
+    return [f"operator={operator}" for operator in operators] + [f"num_{column}" for column in COUNT_COLUMNS] + list(FLAG_COLUMNS) + ["is_single_func", "solution", "solution_is_number", "main_operand_0", "main_operand_0_is_number", "main_operand_1", "main_operand_1_is_number"]
+
+def signed_log(values):
+    # Values span many orders of magnitude, compressed to a range a network trains on while keeping the sign
+    return np.sign(values) * np.log1p(np.abs(values))
+
+def list_lengths(array):
+    return np.diff(array.offsets.to_numpy())
+
+def list_element(array, k):
+    """
+    Returns element `k` of each list of a numeric list array as float64, NaN where a list is shorter.
+    """
+    offsets = array.offsets.to_numpy()
+    values = array.values.to_numpy(zero_copy_only=False).astype(np.float64)
+    positions = offsets[:-1] + k
+    present = positions < offsets[1:]
+    return np.where(present, values[np.where(present, positions, 0)] if len(values) else np.nan, np.nan)
+
+def column(table, name):
+    chunked = table.column(name)
+    return chunked.combine_chunks() if chunked.num_chunks != 1 else chunked.chunk(0)
+
+def node_features(table, operators):
+    """
+    Returns the float32 feature matrix of every calculation (row) of a gathered batch, with the columns of `feature_names(operators)`:
+    - The main operator one-hot encoded, all zeros for an operator missing from `operators`
+    - The number of operands, main operands and sub-expressions
+    - The flags of `process_chain`
+    - The solution and the first two main operands as signed logarithms, 0 with an `_is_number` flag of 0 for text like `pi`
+    """
+    num_nodes = table.num_rows
+    operator_indices = pc.index_in(column(table, "main_operators"), value_set=pa.array(operators)).fill_null(-1).to_numpy()
+    one_hot = np.zeros((num_nodes, len(operators)), dtype=np.float32)
+    known = operator_indices >= 0
+    one_hot[np.flatnonzero(known), operator_indices[known]] = 1.0
+
+    counts = [list_lengths(column(table, name)) for name in COUNT_COLUMNS]
+    flags = [column(table, name).fill_null(False).to_numpy(zero_copy_only=False) for name in FLAG_COLUMNS]
+    flags.append(column(table, "is_single_func").is_valid().to_numpy(zero_copy_only=False))
+
+    numeric = []
+    solution = column(table, "solution_values").to_numpy(zero_copy_only=False).astype(np.float64)
+    main_operands = column(table, "main_operand_values")
+    for values in (solution, list_element(main_operands, 0), list_element(main_operands, 1)):
+        is_number = np.isfinite(values)
+        numeric.append(np.where(is_number, signed_log(np.where(is_number, values, 0.0)), 0.0))
+        numeric.append(is_number)
+
+    dense = np.column_stack(counts + flags + numeric).astype(np.float32) if num_nodes else np.zeros((0, len(counts) + len(flags) + len(numeric)), dtype=np.float32)
+    return np.hstack([one_hot, dense])
+
+# Sampler and settings of a pool worker, set once by `start_worker` as a memory-mapped store cannot be sent to the workers
+worker = {}
+
+def start_worker(store_path, settings):
+    worker["sampler"] = MixSampler(FeatureStore(store_path), mix_size=settings["mix_size"], columns=EXPORT_COLUMNS)
+    worker["settings"] = settings
+
+@instrumented("export_shard")
+def export_shard(task):
+    """
+    Draws the mixes of one shard, builds their graphs and writes the shard's arrays to `output`. The generator is reseeded with the shard index, so a shard is drawn the same regardless of the order shards are exported in.
+    Returns the shard's entry of `meta.json`.
+
+    :param task: `(shard_index, num_graphs)`
+    """
+    shard_index, num_graphs = task
+    sampler, settings = worker["sampler"], worker["settings"]
+    sampler.reseed((settings["seed"], shard_index))
+    start = time.perf_counter()
+
+    x, edge_index, node_offsets, edge_offsets, y, positions, source_rows = [], [], [0], [0], [], [], []
+    num_nodes = num_edges = 0
+    for drawn in range(0, num_graphs, settings["batch_size"]):
+        rows = sampler.sample_rows(min(settings["batch_size"], num_graphs - drawn))
+        table, offsets = sampler.take_batch(rows)
+        x.append(node_features(table, settings["operators"]))
+
+        # Ground truth group of every calculation: which sample of its mix it came from
+        mix_of_node = np.repeat(np.arange(len(rows)), np.diff(offsets))
+        batch_rows = table.column("source_rows").to_numpy()
+        y.append(np.argmax(rows[mix_of_node] == batch_rows[:, None], axis=1))
+        positions.append(table.column("source_positions").to_numpy())
+        source_rows.append(batch_rows)
+
+        graph_columns = [name for name in table.column_names if name in GRAPH_COLUMNS]
+        for mix, start_node in zip(sampler.to_mixes(table.select(graph_columns), offsets), offsets[:-1].tolist()):
+            graph = create_csr_graph(mix, match_values=settings["match_values"])
+            edge_index.append(np.stack([graph.edge_sources(), graph.indices]).astype(np.int64) + num_nodes + start_node)
+            num_edges += graph.num_edges()
+            edge_offsets.append(num_edges)
+        node_offsets.extend((offsets[1:] + num_nodes).tolist())
+        num_nodes += int(offsets[-1])
+
+    arrays = {
+        "x": np.concatenate(x) if x else np.zeros((0, len(feature_names(settings["operators"]))), dtype=np.float32),
+        "edge_index": np.concatenate(edge_index, axis=1) if edge_index else np.zeros((2, 0), dtype=np.int64),
+        "node_offsets": np.asarray(node_offsets, dtype=np.int64),
+        "edge_offsets": np.asarray(edge_offsets, dtype=np.int64),
+        "y": np.concatenate(y).astype(np.int64) if y else np.zeros(0, dtype=np.int64),
+        "positions": np.concatenate(positions).astype(np.int32) if positions else np.zeros(0, dtype=np.int32),
+        "source_rows": np.concatenate(source_rows).astype(np.int64) if source_rows else np.zeros(0, dtype=np.int64),
+    }
+    name = write_shard(Path(settings["output"]), shard_index, arrays, settings["compress"])
+    if instrumentation.enabled:
+        instrumentation.count("export_shard.graphs", num_graphs)
+        instrumentation.count("export_shard.edges", num_edges)
+    return {"index": shard_index, "name": name, "graphs": num_graphs, "nodes": num_nodes, "edges": num_edges, "seconds": time.perf_counter() - start}
+
+def shard_name(shard_index, compress):
+    return f"shard-{shard_index:05d}.npz" if compress else f"shard-{shard_index:05d}"
+
+def write_shard(output, shard_index, arrays, compress):
+    """
+    Writes a shard as a directory of `.npy` files, which `np.load(..., mmap_mode="r")` maps without reading, or as one compressed `.npz` file. Written under a temporary name and renamed, so a shard that exists is complete.
+    """
+    name = shard_name(shard_index, compress)
+    path = output / name
+    temporary = output / f"{name}.tmp"
+    if compress:
+        with open(temporary, "wb") as f:
+            np.savez_compressed(f, **arrays)
+    else:
+        shutil.rmtree(temporary, ignore_errors=True)
+        temporary.mkdir()
+        for key, array in arrays.items():
+            np.save(temporary / f"{key}.npy", array)
+        # Left by a run interrupted before recording the shard in `meta.json`, a directory cannot be replaced by renaming
+        shutil.rmtree(path, ignore_errors=True)
+    os.replace(temporary, path)
+    return name
+
+@instrumented()
+def export_graphs(store_path, output, num_graphs, mix_size=2, shard_size=10000, batch_size=256, seed=0, num_proc=1, match_values=False, compress=False):
+    """
+    Exports `num_graphs` random mixes of a feature store as GNN-ready graph shards, batched like PyTorch Geometric batches: the graphs of a shard are concatenated and sliced by offsets.
+    Every shard holds the following arrays:
+    - `x`: `(nodes, features)` float32 node features (see `node_features`, with the column names in `meta.json`)
+    - `edge_index`: `(2, edges)` int64 source and target nodes, numbered across the shard
+    - `node_offsets`/`edge_offsets`: The nodes and edges of graph `k` are `node_offsets[k]` to `node_offsets[k+1]` and `edge_offsets[k]` to `edge_offsets[k+1]`
+    - `y`: Ground truth group of every node, the index of the sample within its mix that the calculation came from
+    - `positions`/`source_rows`: Index of each calculation within its sample's chain (the true order) and the store row of that sample
+    `meta.json` in `output` records the settings, feature names and shards. Shards already written by a run with the same settings are kept, so an interrupted export resumes. Returns the contents of `meta.json` with the throughput of this run.
+
+    :param store_path: Path of a feature store, e.g. `./data/train.arrow`
+    :param output: Directory to write the shards to
+    :param num_graphs: Number of random mixes to export
+    :param mix_size: Number of samples combined per mix
+    :param shard_size: Number of graphs per shard
+    :param batch_size: Number of mixes gathered at once
+    :param seed: Seed of the mixes, each shard is drawn with `(seed, shard_index)`
+    :param num_proc: Number of processes exporting shards
+    :param match_values: Joins on value IDs when building the graphs
+    :param compress: Writes every shard as one compressed `.npz` file, smaller on disk but read into memory instead of memory-mapped
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    operators = operator_vocabulary(FeatureStore(store_path))
+    settings = {
+        "store": str(store_path),
+        "output": str(output),
+        "num_graphs": num_graphs,
+        "mix_size": mix_size,
+        "shard_size": shard_size,
+        "batch_size": batch_size,
+        "seed": seed,
+        "match_values": match_values,
+        "compress": compress,
+        "operators": operators,
+    }
+    meta_path = output / "meta.json"
+    shards = {}
+    if meta_path.is_file():
+        meta = json.loads(meta_path.read_text())
+        if meta["settings"] != settings:
+            raise ValueError(f"{output} was exported with different settings {meta['settings']}, use another output to export with {settings}")
+        shards = {shard["index"]: shard for shard in meta["shards"] if (output / shard["name"]).exists()}
+
+    tasks = [(index, min(shard_size, num_graphs - index * shard_size)) for index in range((num_graphs + shard_size - 1) // shard_size) if index not in shards]
+
+    def save():
+        meta = {"settings": settings, "features": feature_names(operators), "arrays": list(SHARD_ARRAYS), "shards": [shards[index] for index in sorted(shards)]}
+        temporary = meta_path.with_name("meta.json.tmp")
+        temporary.write_text(json.dumps(meta, indent=1))
+        os.replace(temporary, meta_path)
+        return meta
+
+    save()
+    start = time.perf_counter()
+    if num_proc > 1 and len(tasks) > 1:
+        from multiprocess import Pool
+        with Pool(min(num_proc, len(tasks)), initializer=start_worker, initargs=(store_path, settings)) as pool:
+            for shard in pool.imap_unordered(export_shard, tasks):
+                shards[shard["index"]] = shard
+                save()
+    else:
+        start_worker(store_path, settings)
+        for task in tasks:
+            shard = export_shard(task)
+            shards[shard["index"]] = shard
+            save()
+    seconds = time.perf_counter() - start
+
+    exported = sum(shards[index]["graphs"] for index, _ in tasks)
+    return {**save(), "resumed_shards": len(shards) - len(tasks), "seconds": seconds, "graphs_per_minute": exported / seconds * 60 if seconds else None}
+
+class GraphShards():
+    """
+    Reader of an `export_graphs` output for a training loop. Uncompressed shards are memory-mapped, so only the pages of the graphs actually read are loaded.
+    - `features`: Name of every column of `x`
+    - `shard(i)`: The arrays of shard `i`
+    - `graph(k)`: Graph `k` of the whole export, with `edge_index` numbered within the graph
+    - `batches()`: Every shard's arrays in order, each already a batch of concatenated graphs
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text())
+        self.features = self.meta["features"]
+        self.shards = self.meta["shards"]
+        self.graph_offsets = np.cumsum([0] + [shard["graphs"] for shard in self.shards])
+        self.loaded = {}
+
+    def shard(self, i):
+        if i not in self.loaded:
+            path = self.path / self.shards[i]["name"]
+            if path.is_dir():
+                self.loaded[i] = {key: np.load(path / f"{key}.npy", mmap_mode="r") for key in self.meta["arrays"]}
+            else:
+                with np.load(path) as arrays:
+                    self.loaded[i] = {key: arrays[key] for key in self.meta["arrays"]}
+        return self.loaded[i]
+
+    def graph(self, k):
+        i = int(np.searchsorted(self.graph_offsets, k, side="right")) - 1
+        if k < 0 or i >= len(self.shards):
+            raise IndexError(f"Graph {k} out of range for {len(self)} graphs")
+        arrays = self.shard(i)
+        local = k - self.graph_offsets[i]
+        node_start, node_stop = arrays["node_offsets"][local], arrays["node_offsets"][local+1]
+        edge_start, edge_stop = arrays["edge_offsets"][local], arrays["edge_offsets"][local+1]
+        return {
+            "x": arrays["x"][node_start:node_stop],
+            "edge_index": arrays["edge_index"][:, edge_start:edge_stop] - node_start,
+            "y": arrays["y"][node_start:node_stop],
+            "positions": arrays["positions"][node_start:node_stop],
+            "source_rows": arrays["source_rows"][node_start:node_stop],
+        }
+
+    def batches(self):
+        for i in range(len(self.shards)):
+            yield self.shard(i)
+
+    def __len__(self):
+        return int(self.graph_offsets[-1])
+
+    def __repr__(self):
+        return f"GraphShards({str(self.path)!r}, graphs={len(self)}, shards={len(self.shards)}, features={len(self.features)})"
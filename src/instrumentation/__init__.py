@@ -0,0 +1 @@
+from .pipeline_instrumentation import instrumentation, instrumented, Instrumentation
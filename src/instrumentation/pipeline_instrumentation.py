@@ -0,0 +1,115 @@
+import functools
+import json
+import time
+from collections import defaultdict
+
+class Instrumentation():
+    """
+    Opt-in counters and nested stage timings for the grouping pipeline. Everything is skipped behind a single `enabled` check while it is off.
+    - `counters`: Event name -> count (e.g. `sympy.calls`, `create_graph.edges`)
+    - `timings`: Stage path (e.g. `process_chain;build_calculations;sympy`) -> calls, total and self seconds
+    Only the current process is recorded, so parallel processing (`num_proc > 1`) reports the parent process alone.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.counters = defaultdict(int)
+        self.timings = {}
+        self.stack = []
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def timer(self, name):
+        """
+        Returns a context manager timing `name` as a stage nested under the stages currently running.
+        """
+        return StageTimer(self, name) if self.enabled else NULL_TIMER
+
+    def report(self):
+        """
+        Returns the following: \n
+        - `counters`: Every counter, sorted by name
+        - `timings`: Per stage path, the `calls`, `total_seconds` and `self_seconds` (excluding nested stages)
+        """
+        return {
+            "counters": dict(sorted(self.counters.items())),
+            "timings": {
+                path: {"calls": calls, "total_seconds": total, "self_seconds": total - nested}
+                for path, (calls, total, nested) in sorted(self.timings.items())
+            },
+        }
+
+    def write_json(self, writer):
+        json.dump(self.report(), writer, indent=1)
+        writer.write("\n")
+
+    def write_folded(self, writer):
+        """
+        Writes the self time of every stage path in microseconds as folded stacks (`a;b;c 1200`), the input format of flamegraph.pl and speedscope.
+        """
+        for path, (_, total, nested) in sorted(self.timings.items()):
+            writer.write(f"{path} {max(0, round((total - nested) * 1e6))}\n")
+
+class StageTimer():
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.instrumentation.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stack = self.instrumentation.stack
+        path = ";".join(stack)
+        stats = self.instrumentation.timings.setdefault(path, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stack.pop()
+        if stack:
+            # Nested time is subtracted from the parent's self time
+            self.instrumentation.timings.setdefault(";".join(stack), [0, 0.0, 0.0])[2] += elapsed
+        return False
+
+class NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+# Process-wide instance used by the pipeline
+instrumentation = Instrumentation()
+
+def instrumented(name=None):
+    """
+    Decorator timing every call of a function as the stage `name` (defaults to the function name) while instrumentation is enabled.
+    """
+    def decorate(func):
+        stage = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return func(*args, **kwargs)
+            with StageTimer(instrumentation, stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
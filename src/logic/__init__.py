@@ -1 +1,16 @@
-from .graph_rules import classify_groups, sort_groups, chain_groups, print_chain
\ No newline at end of file
+import importlib
+from .graph_rules import classify_groups, sort_groups, chain_groups, Chain
+from .chain_renderer import ChainRenderer, print_chain, chain_record
+from .incremental_grouping import IncrementalGrouper
+from .group_orderings import GroupOrder, group_orderings, count_orderings, is_valid_ordering, count_group_orderings
+
+# The vectorized rules for a `CSRGraph` need NumPy, imported on first use
+LAZY_EXPORTS = {
+    "classify_groups_csr": ".csr_rules",
+    "sort_groups_csr": ".csr_rules",
+}
+
+def __getattr__(name):
+    if name in LAZY_EXPORTS:
+        return getattr(importlib.import_module(LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
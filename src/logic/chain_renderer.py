@@ -0,0 +1,97 @@
+import json
+import sys
+from instrumentation import instrumentation, instrumented
+
+class ChainRenderer():
+    """
+    Buffered renderer streaming the chains of `chain_groups` to any writer with a `write` method (e.g. `sys.stdout`, an open file, `io.StringIO`).
+    Every node of a chain is written once, so the output grows linearly with the group instead of with the number of paths through it.
+    - `text`: Indented tree like `print_chain`, a result that was already written is referenced with `(see above)` instead of being expanded again
+    - `json`: One JSON object per chain and line, `{"roots": [...], "nodes": [{"id": 0, "val": "...", "parents": [...]}, ...]}`
+    - `dot`: One Graphviz digraph per chain with edges pointing from a result to the calculations consuming it
+    """
+    FORMATS = ("text", "json", "dot")
+
+    def __init__(self, writer, format="text", buffer_size=65536):
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown chain format {format!r}, expected one of {self.FORMATS}")
+        self.writer = writer
+        self.format = format
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.rendered = 0
+
+    def render(self, chain, adjacency_list):
+        if self.format == "text":
+            self.render_text(chain, adjacency_list)
+        elif self.format == "json":
+            self.render_json(chain, adjacency_list)
+        else:
+            self.render_dot(chain, adjacency_list)
+        self.rendered += 1
+        if instrumentation.enabled:
+            instrumentation.count("chain_renderer.nodes_written", len(chain))
+
+    @instrumented("render_chains")
+    def render_all(self, chains, adjacency_list):
+        for chain in chains:
+            self.render(chain, adjacency_list)
+        self.flush()
+
+    def render_text(self, chain, adjacency_list):
+        written = set()
+        stack = [(root, 0) for root in reversed(chain.roots)]
+        while stack:
+            node, depth = stack.pop()
+            tabs = "\t" * depth
+            line = f"{tabs}{node}: {adjacency_list.get_node(node).get_val()}"
+            if node in written:
+                self.write(f"{line} (see above)\n")
+                continue
+            written.add(node)
+            self.write(f"{line}\n")
+            stack.extend((parent, depth+1) for parent in reversed(chain.parents[node]))
+
+    def render_json(self, chain, adjacency_list):
+        self.write(f'{{"roots": {json.dumps(chain.roots)}, "nodes": [')
+        for i, (node, parents) in enumerate(chain.parents.items()):
+            record = json.dumps({"id": node, "val": adjacency_list.get_node(node).get_val(), "parents": parents})
+            self.write(f", {record}" if i else record)
+        self.write("]}\n")
+
+    def render_dot(self, chain, adjacency_list):
+        self.write(f"digraph chain_{self.rendered} {{\n")
+        for node in chain.parents:
+            label = json.dumps(f"{node}: {adjacency_list.get_node(node).get_val()}", ensure_ascii=False)
+            self.write(f"\t{node} [label={label}];\n")
+        for node, parents in chain.parents.items():
+            for parent in parents:
+                self.write(f"\t{parent} -> {node};\n")
+        self.write("}\n")
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write("".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+def chain_record(chain, adjacency_list):
+    """
+    Returns a chain as the object of one `json` line of `ChainRenderer`, `{"roots": [...], "nodes": [{"id": 0, "val": "...", "parents": [...]}, ...]}`.
+    """
+    return {
+        "roots": list(chain.roots),
+        "nodes": [{"id": node, "val": adjacency_list.get_node(node).get_val(), "parents": list(parents)} for node, parents in chain.parents.items()],
+    }
+
+def print_chain(chained_group, adjacency_list, writer=None, format="text"):
+    renderer = ChainRenderer(sys.stdout if writer is None else writer, format=format)
+    renderer.render(chained_group, adjacency_list)
+    renderer.flush()
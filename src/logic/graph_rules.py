@@ -1,5 +1,7 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+from instrumentation import instrumentation, instrumented
 
+@instrumented()
 def classify_groups(adjacency_list):
     visited = set()
     all_groups = []
@@ -14,10 +16,10 @@ def classify_groups(adjacency_list):
     for i in range(len(node_list)):
         if i not in visited:
             current_group = []
-            queue = [i]
+            queue = deque([i])
 
             while len(queue) > 0:
-                current = queue.pop(0)
+                current = queue.popleft()
 
                 if current in visited:
                     continue
@@ -32,9 +34,14 @@ def classify_groups(adjacency_list):
                         queue.append(neighbor_indice)
             
             all_groups.append(current_group)
+
+    if instrumentation.enabled:
+        instrumentation.count("classify_groups.bfs_visits", len(visited))
+        instrumentation.count("classify_groups.groups", len(all_groups))
     
     return all_groups, reverse_adjacency
 
+@instrumented()
 def sort_groups(all_groups, adjacency_list, reverse_adjacency):
     # Kahn's Algorithm
     possible_combos = []
@@ -44,14 +51,14 @@ def sort_groups(all_groups, adjacency_list, reverse_adjacency):
         for node_indice in group:
             in_degree[node_indice] = len(reverse_adjacency[(node_indice)])
 
-        queue = []
+        queue = deque()
         for i, num_in in in_degree.items():
             if num_in == 0:
                 queue.append(i)
         
         ordering = []
         while queue:
-            node_indice = queue.pop(0)
+            node_indice = queue.popleft()
             ordering.append(node_indice)
 
             for neighbor_indice in adjacency_list.get_node(node_indice).get_neighbors_indices():
@@ -60,41 +67,84 @@ def sort_groups(all_groups, adjacency_list, reverse_adjacency):
                     queue.append(neighbor_indice)
         
         possible_combos.append(ordering)
+
+    if instrumentation.enabled:
+        instrumentation.count("sort_groups.kahn_visits", sum(len(ordering) for ordering in possible_combos))
+        instrumentation.count("sort_groups.cycle_nodes", sum(len(group) for group in all_groups) - sum(len(ordering) for ordering in possible_combos))
     
     return possible_combos
 
-def chain_groups(all_groups, adjacency_list, reverse_adjacency): 
+class Chain():
+    """
+    Calculation chain of a group as a DAG that shares subtrees by node indice, so a result feeding several later calculations is stored once.
+    - `roots`: Every terminal calculation of the group (no outgoing edge), followed by one node of each cycle that feeds none of them
+    - `parents`: Node indice -> the node indices whose results it consumes, in the order the nodes were reached from `roots`
+    """
+    def __init__(self, roots, parents):
+        self.roots = roots
+        self.parents = parents
+
+    def get_nodes(self):
+        return list(self.parents.keys())
+
+    def to_nested(self):
+        """
+        Returns the chain in the nested `{node: [{parent: [...]}, ...]}` form with one key per root. Shared parents reuse the same dict and edges closing a cycle are left out.
+        """
+        nested = {}
+        on_path = set()
+        for root in self.roots:
+            stack = [(root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    on_path.discard(node)
+                    nested[node] = {node: [nested[parent] for parent in self.parents[node] if parent in nested]}
+                    continue
+                if node in nested or node in on_path:
+                    continue
+                on_path.add(node)
+                stack.append((node, True))
+                stack.extend((parent, False) for parent in reversed(self.parents[node]) if parent not in nested and parent not in on_path)
+
+        return {root: nested[root][root] for root in self.roots}
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __repr__(self):
+        return f"Chain(roots={self.roots}, parents={self.parents})"
+
+@instrumented()
+def chain_groups(all_groups, adjacency_list, reverse_adjacency):
     chained_representations = []
 
     for group in all_groups:
-        terminal_node = 0
-        seen = set()
+        roots = [node_indice for node_indice in group if not adjacency_list.get_node(node_indice).get_neighbors_indices()]
+        parents = {}
+
+        def visit(root):
+            # Iterative depth-first walk up the reverse adjacency, each node is expanded once
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                if node in parents:
+                    continue
+                parents[node] = list(reverse_adjacency[node])
+                stack.extend(parent for parent in reversed(parents[node]) if parent not in parents)
+
+        for root in roots:
+            visit(root)
         for node_indice in group:
-            if not adjacency_list.get_node(node_indice).get_neighbors_indices():
-                terminal_node = node_indice
-                seen.add(terminal_node)
-                break
-
-        def build_chain(node, reverse_adjacency):
-            return {
-                node: [
-                    build_chain(parent, reverse_adjacency) for parent in reverse_adjacency[node]
-                ]
-            }
-        
-        chain = build_chain(terminal_node, reverse_adjacency)
-        chained_representations.append(chain)
-    
-    return chained_representations
+            if node_indice not in parents:
+                # Part of a cycle that feeds no terminal calculation
+                roots.append(node_indice)
+                visit(node_indice)
 
-def print_chain(chained_group, adjacency_list):
-    def print_seg(part, num_tabs):
-        for dict in part:
-            for key, values in dict.items():
-                print(f"{num_tabs * '\t'}{key}: {adjacency_list.get_node(key).get_val()}")
-                if values:
-                    print_seg(values, num_tabs=num_tabs+1)
-    
-    for key, _ in chained_group.items():
-        print(f"{key}: {adjacency_list.get_node(key).get_val()}")
-        print_seg(chained_group[key], num_tabs=1)
\ No newline at end of file
+        chained_representations.append(Chain(roots, parents))
+
+    if instrumentation.enabled:
+        instrumentation.count("chain_groups.chain_nodes", sum(len(chain) for chain in chained_representations))
+        instrumentation.count("chain_groups.chain_edges", sum(len(parents) for chain in chained_representations for parents in chain.parents.values()))
+
+    return chained_representations
@@ -0,0 +1,300 @@
+from math import comb
+from instrumentation import instrumentation, instrumented
+
+class GroupOrder():
+    """
+    Precedence constraints of a group from `classify_groups`, the calculations each node consumes within the group.
+    As with `sort_groups`, nodes on a cycle (or fed by one) never become free to place and are left out, so `nodes` holds exactly the nodes `sort_groups` orders.
+    - `nodes`: Orderable node indices in ascending order
+    - `predecessors`: Node indice -> the set of orderable node indices it consumes
+    - `successors`: Node indice -> the orderable node indices consuming it, in ascending order
+    """
+    def __init__(self, group, reverse_adjacency):
+        members = set(group)
+        predecessors = {node: {parent for parent in reverse_adjacency[node] if parent in members} for node in members}
+        successors = {node: [] for node in members}
+        for node, parents in predecessors.items():
+            for parent in parents:
+                successors[parent].append(node)
+
+        # One pass of Kahn's Algorithm finds the nodes that can be placed at all
+        in_degree = {node: len(parents) for node, parents in predecessors.items()}
+        stack = [node for node, count in in_degree.items() if count == 0]
+        orderable = set()
+        while stack:
+            node = stack.pop()
+            orderable.add(node)
+            for successor in successors[node]:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    stack.append(successor)
+
+        self.nodes = sorted(orderable)
+        self.predecessors = {node: predecessors[node] for node in self.nodes}
+        self.successors = {node: sorted(successor for successor in successors[node] if successor in orderable) for node in self.nodes}
+
+    def is_valid(self, ordering):
+        """
+        Returns whether `ordering` places every orderable node exactly once and after every calculation it consumes, in O(nodes + edges).
+        """
+        if len(ordering) != len(self.nodes):
+            return False
+        position = {}
+        for i, node in enumerate(ordering):
+            if node not in self.predecessors or node in position:
+                return False
+            position[node] = i
+        return all(position[parent] < position[node] for node, parents in self.predecessors.items() for parent in parents)
+
+    def orderings(self, limit=None):
+        """
+        Lazily generates every valid ordering, in lexicographic order of node indices, stopping after `limit` orderings when given.
+        Backtracks over the nodes free to place with an explicit stack, so large groups do not hit the recursion limit, and yields a new list per ordering.
+        """
+        if limit is not None and limit <= 0:
+            return
+        in_degree = {node: len(parents) for node, parents in self.predecessors.items()}
+        ordering = []
+        # Each frame holds the nodes free to place at its depth and the position of the next one to try
+        stack = [[[node for node in self.nodes if in_degree[node] == 0], 0]]
+        yielded = 0
+        while stack:
+            frame = stack[-1]
+            free, next_choice = frame
+            if next_choice > 0:
+                # Undoes the node placed from this frame before trying the next one
+                for successor in self.successors[ordering.pop()]:
+                    in_degree[successor] += 1
+            if len(ordering) == len(self.nodes):
+                yield list(ordering)
+                yielded += 1
+                if limit is not None and yielded >= limit:
+                    return
+                stack.pop()
+                continue
+            if next_choice == len(free):
+                stack.pop()
+                continue
+
+            node = free[next_choice]
+            frame[1] += 1
+            ordering.append(node)
+            freed = []
+            for successor in self.successors[node]:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    freed.append(successor)
+            stack.append([sorted(free[:next_choice] + free[next_choice+1:] + freed), 0])
+            if instrumentation.enabled:
+                instrumentation.count("group_orderings.placements")
+
+    def count(self, max_states=None):
+        """
+        Returns the number of valid orderings without enumerating them.
+        The constraints are split wherever they decompose: unconnected parts are counted separately and interleaved (a multinomial coefficient), and a node every other node must come before or after cuts the order into the parts before and after it.
+        What remains is counted by a memoized dynamic program over the sets of calculations left to place (see `count_remaining`).
+        Counting is exponential in the width of the remaining parts at worst (e.g. a large mixed group with hundreds of independent starting calculations), so a `ValueError` is raised once more than `max_states` sets were counted.
+        """
+        return self.count_nodes(self.nodes, max_states)
+
+    def count_nodes(self, nodes, max_states=None):
+        if len(nodes) <= 1:
+            return 1
+
+        components = self.components(nodes)
+        if len(components) > 1:
+            total, placed = 1, 0
+            for component in components:
+                placed += len(component)
+                total *= comb(placed, len(component)) * self.count_nodes(component, max_states)
+            return total
+
+        bits = {node: 1 << i for i, node in enumerate(nodes)}
+        ancestors, descendants = self.closure(nodes, bits)
+        everything = (1 << len(nodes)) - 1
+        cuts = [node for node in nodes if ancestors[node] | descendants[node] | bits[node] == everything]
+        if cuts:
+            # Cut nodes are totally ordered among themselves, the rest of the nodes fall between consecutive cuts
+            cuts.sort(key=lambda node: bin(ancestors[node]).count("1"))
+            total = 1
+            previous = 0
+            for node in cuts + [None]:
+                boundary = ancestors[node] if node is not None else everything
+                between = [other for other in nodes if boundary & ~previous & bits[other] and other not in cuts]
+                total *= self.count_nodes(between, max_states)
+                if node is not None:
+                    previous = ancestors[node] | bits[node]
+            return total
+
+        return self.count_remaining(nodes, bits, ancestors, max_states)
+
+    def components(self, nodes):
+        """
+        Returns the weakly connected components of the constraints restricted to `nodes`.
+        """
+        remaining = set(nodes)
+        components = []
+        for start in nodes:
+            if start not in remaining:
+                continue
+            remaining.discard(start)
+            component = [start]
+            stack = [start]
+            while stack:
+                node = stack.pop()
+                for neighbor in (*self.predecessors[node], *self.successors[node]):
+                    if neighbor in remaining:
+                        remaining.discard(neighbor)
+                        component.append(neighbor)
+                        stack.append(neighbor)
+            components.append(sorted(component))
+        return components
+
+    def closure(self, nodes, bits):
+        """
+        Returns the ancestors and descendants of every node within `nodes` as bitmasks.
+        """
+        members = set(nodes)
+        in_degree = {node: sum(1 for parent in self.predecessors[node] if parent in members) for node in nodes}
+        stack = [node for node in nodes if in_degree[node] == 0]
+        topological = []
+        while stack:
+            node = stack.pop()
+            topological.append(node)
+            for successor in self.successors[node]:
+                if successor in members:
+                    in_degree[successor] -= 1
+                    if in_degree[successor] == 0:
+                        stack.append(successor)
+
+        ancestors = {}
+        for node in topological:
+            mask = 0
+            for parent in self.predecessors[node]:
+                if parent in members:
+                    mask |= ancestors[parent] | bits[parent]
+            ancestors[node] = mask
+        descendants = {}
+        for node in reversed(topological):
+            mask = 0
+            for successor in self.successors[node]:
+                if successor in members:
+                    mask |= descendants[successor] | bits[successor]
+            descendants[node] = mask
+        return ancestors, descendants
+
+    def count_remaining(self, nodes, bits, ancestors, max_states=None):
+        """
+        Counts the orderings of `nodes` by the calculations left to place, as bitmasks: the orderings of a remaining set sum those of the set without each node that is free to go first.
+        Placing calculations often disconnects what is left, so every remaining set is split into its unconnected parts again and each part is counted (and memoized) on its own.
+        """
+        index = {node: i for i, node in enumerate(nodes)}
+        neighbors = [0] * len(nodes)
+        for node in nodes:
+            for parent in self.predecessors[node]:
+                if parent in index:
+                    neighbors[index[node]] |= bits[parent]
+                    neighbors[index[parent]] |= bits[node]
+        required = [ancestors[node] for node in nodes]
+
+        def split(remaining):
+            parts = []
+            while remaining:
+                part = frontier = remaining & -remaining
+                while frontier:
+                    bit = frontier & -frontier
+                    frontier ^= bit
+                    reached = neighbors[bit.bit_length() - 1] & remaining & ~part
+                    part |= reached
+                    frontier |= reached
+                parts.append(part)
+                remaining &= ~part
+            return parts
+
+        def subproblems(remaining):
+            parts = split(remaining)
+            if len(parts) > 1:
+                return True, parts
+            firsts = []
+            candidates = remaining
+            while candidates:
+                bit = candidates & -candidates
+                candidates ^= bit
+                if not required[bit.bit_length() - 1] & remaining:
+                    firsts.append(remaining ^ bit)
+            return False, firsts
+
+        # Iterative depth-first evaluation, so long chains of placements do not hit the recursion limit
+        counts = {}
+        pending = {}
+        everything = (1 << len(nodes)) - 1
+        stack = [everything]
+        while stack:
+            remaining = stack[-1]
+            if remaining in counts:
+                stack.pop()
+                continue
+            if remaining not in pending:
+                pending[remaining] = subproblems(remaining)
+            interleaved, parts = pending[remaining]
+            missing = [part for part in parts if part & (part - 1) and part not in counts]
+            if missing:
+                stack.extend(missing)
+                continue
+
+            if interleaved:
+                total, placed = 1, 0
+                for part in parts:
+                    size = part.bit_count()
+                    placed += size
+                    total *= comb(placed, size) * counts.get(part, 1)
+            else:
+                total = sum(counts.get(part, 1) for part in parts)
+            counts[remaining] = total
+            del pending[remaining]
+            stack.pop()
+            if max_states is not None and len(counts) > max_states:
+                raise ValueError(f"Counting the orderings of {len(nodes)} nodes needs more than {max_states} states")
+
+        if instrumentation.enabled:
+            instrumentation.count("group_orderings.count_states", len(counts))
+        return counts[everything]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __repr__(self):
+        return f"GroupOrder(nodes={self.nodes}, predecessors={self.predecessors})"
+
+def group_orderings(group, reverse_adjacency, limit=None):
+    """
+    Lazily generates every valid calculation ordering of a group of `classify_groups`, at most `limit` when given. `sort_groups` returns one of them.
+    """
+    return GroupOrder(group, reverse_adjacency).orderings(limit)
+
+def count_orderings(group, reverse_adjacency, max_states=None):
+    """
+    Returns the number of valid calculation orderings of a group of `classify_groups` without enumerating them, raising a `ValueError` when it needs more than `max_states` states (see `GroupOrder.count`).
+    """
+    return GroupOrder(group, reverse_adjacency).count(max_states)
+
+def is_valid_ordering(ordering, group, reverse_adjacency):
+    """
+    Returns whether `ordering` is a valid calculation ordering of a group of `classify_groups`.
+    """
+    return GroupOrder(group, reverse_adjacency).is_valid(ordering)
+
+@instrumented()
+def count_group_orderings(all_groups, reverse_adjacency, max_states=2**14):
+    """
+    Returns the number of valid orderings of each group of `classify_groups`, in the order of `all_groups`. Groups needing more than `max_states` states to count get `None`.
+    """
+    counts = []
+    for group in all_groups:
+        try:
+            counts.append(count_orderings(group, reverse_adjacency, max_states))
+        except ValueError:
+            counts.append(None)
+            if instrumentation.enabled:
+                instrumentation.count("group_orderings.uncounted_groups")
+    return counts
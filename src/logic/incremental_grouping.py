@@ -0,0 +1,255 @@
+from collections import defaultdict
+from structures.graph_structures import AdjacencyList, to_float
+
+# Substrings up to this length are indexed per expression, so the index grows linearly with the expression instead of with all its substrings
+GRAM_SIZE = 3
+
+def grams(text):
+    """
+    Returns every distinct substring of `text` of 1 to `GRAM_SIZE` characters.
+    """
+    return {text[start:start+size] for size in range(1, GRAM_SIZE+1) for start in range(len(text)-size+1)}
+
+class IncrementalGrouper():
+    """
+    Groups a live stream of calculations without rebuilding the graph for every new entry.
+    `add_calculation` inserts one node, adds only the edges it creates through value indices of the existing calculations, merges groups with union-find and repairs the topological order locally (Pearce-Kelly).
+    The edges and groups match `create_graph` + `classify_groups` over the same calculations, and `get_orderings` gives a valid calculation order per group.
+    """
+    def __init__(self):
+        self.adjacency_list = AdjacencyList()
+        self.reverse_adjacency = defaultdict(list)
+
+        # Per node fields used by the linking rules
+        self.expressions = []
+        self.solutions = []
+        self.solution_values = []
+        self.is_single_func = []
+        self.has_sub_expressions = []
+        self.operands = []
+        self.main_operands = []
+        self.sub_expression_values = []
+
+        # Value indices over the existing calculations
+        self.solution_index = defaultdict(set)
+        self.solution_value_index = defaultdict(set)
+        self.single_func_index = defaultdict(set)
+        self.single_func_lengths = set() # Lengths of the `single_func_index` keys, the only substrings worth looking up
+        self.main_operand_index = defaultdict(set)
+        self.sub_expression_index = defaultdict(set)
+        self.gram_index = defaultdict(set) # Substring of at most `GRAM_SIZE` characters -> expressions containing it
+
+        # Union-find over groups, with the members of each root
+        self.parent = []
+        self.members = []
+
+        # Global topological position of each node, each group's order is its members sorted by position
+        self.position = []
+        self.cycle_edges = set()
+
+    def add_calculation(self, calculation):
+        """
+        Adds a single calculation and returns its node indice.
+
+        :param calculation: One calculation of a processed sample, with the same keys as `process_chain` (e.g. `{"expressions": "100/2", "solutions": "50", ...}`)
+        """
+        k = len(self.adjacency_list)
+        self.adjacency_list.add_node(calculation["full_equations"])
+
+        self.expressions.append(calculation["expressions"])
+        self.solutions.append(calculation["solutions"])
+        self.solution_values.append(to_float(calculation["solutions"]))
+        self.is_single_func.append(calculation["is_single_func"])
+        self.has_sub_expressions.append(calculation["has_sub_expressions"])
+        self.operands.append(set(calculation["operands"]))
+        self.main_operands.append(set(calculation["main_operands"]))
+        sub_expression_values = set()
+        if calculation["has_sub_expressions"]:
+            for sub_express_result in calculation["sub_expression_results"]:
+                value = to_float(sub_express_result)
+                if value is not None:
+                    sub_expression_values.add(value)
+        self.sub_expression_values.append(sub_expression_values)
+
+        self.parent.append(k)
+        self.members.append([k])
+        self.position.append(k)
+
+        producers = sorted(i for i in self.candidate_producers(k) if self.links(i, k))
+        consumers = sorted(j for j in self.candidate_consumers(k) if self.links(k, j))
+
+        for i in producers:
+            self.adjacency_list.get_node(i).add_neighbor(k, 1.0)
+            self.reverse_adjacency[k].append(i)
+            self.union(i, k)
+        for j in consumers:
+            self.adjacency_list.get_node(k).add_neighbor(j, 1.0)
+            self.reverse_adjacency[j].append(k)
+            self.union(k, j)
+            self.reorder(k, j)
+
+        self.index(k)
+        return k
+
+    def add_sample(self, sample):
+        """
+        Adds every calculation of a processed (e.g. combined) sample in order. Returns the node indices.
+        """
+        keys = [key for key in sample.keys() if key not in ("id", "value_table")]
+        return [self.add_calculation({key: sample[key][i] for key in keys}) for i in range(len(sample["full_equations"]))]
+
+    def add_stream(self, calculations):
+        """
+        Adds calculations as they arrive from an iterable (e.g. `ChainStream.calculations`) and generates each node indice once it is linked.
+        """
+        for calculation in calculations:
+            yield self.add_calculation(calculation)
+
+    def links(self, i, j):
+        """
+        Whether the solution of node `i` is consumed by node `j`, with the same rules as `create_graph`.
+        """
+        solution = self.solutions[i]
+        if i == j or solution == self.solutions[j]: # If a number is redefined, ignore the case
+            return False
+        if solution in self.operands[j]:
+            return solution in self.main_operands[j]
+        if self.is_single_func[i]:
+            return self.expressions[i] in self.expressions[j] or solution in self.expressions[j]
+        if self.has_sub_expressions[j]:
+            return self.solution_values[i] is not None and self.solution_values[i] in self.sub_expression_values[j]
+        return False
+
+    def candidate_producers(self, k):
+        candidates = set()
+        for main_operand in self.main_operands[k]:
+            candidates |= self.solution_index.get(main_operand, set())
+        expression = self.expressions[k]
+        for length in self.single_func_lengths:
+            for start in range(len(expression)-length+1):
+                candidates |= self.single_func_index.get(expression[start:start+length], set())
+        candidates |= self.single_func_index.get("", set())
+        for value in self.sub_expression_values[k]:
+            candidates |= self.solution_value_index.get(value, set())
+        return candidates
+
+    def candidate_consumers(self, k):
+        solution = self.solutions[k]
+        candidates = set(self.main_operand_index.get(solution, set()))
+        if self.is_single_func[k]:
+            for value in (self.expressions[k], solution):
+                candidates |= set(range(k)) if not value else self.containing(value)
+        elif self.solution_values[k] is not None:
+            candidates |= self.sub_expression_index.get(self.solution_values[k], set())
+        return candidates
+
+    def containing(self, value):
+        """
+        Returns the existing expressions that may contain `value`, a superset that `links` narrows down. Exact for values of up to `GRAM_SIZE` characters, longer values get the expressions holding every one of their grams.
+        """
+        if len(value) <= GRAM_SIZE:
+            return self.gram_index.get(value, set())
+        postings = sorted((self.gram_index.get(value[start:start+GRAM_SIZE], set()) for start in range(len(value)-GRAM_SIZE+1)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        return candidates
+
+    def index(self, k):
+        self.solution_index[self.solutions[k]].add(k)
+        if self.solution_values[k] is not None:
+            self.solution_value_index[self.solution_values[k]].add(k)
+        if self.is_single_func[k]:
+            for value in (self.expressions[k], self.solutions[k]):
+                self.single_func_index[value].add(k)
+                if value:
+                    self.single_func_lengths.add(len(value))
+        for main_operand in self.main_operands[k]:
+            self.main_operand_index[main_operand].add(k)
+        for value in self.sub_expression_values[k]:
+            self.sub_expression_index[value].add(k)
+        for gram in grams(self.expressions[k]):
+            self.gram_index[gram].add(k)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return
+        if len(self.members[root_i]) < len(self.members[root_j]):
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.members[root_i].extend(self.members[root_j])
+        self.members[root_j] = []
+
+    def reorder(self, x, y):
+        """
+        Restores the topological order after adding the edge `x -> y` by only moving the nodes positioned between `y` and `x`.
+        """
+        lower, upper = self.position[y], self.position[x]
+        if upper < lower:
+            return
+
+        forward, stack = set(), [y]
+        while stack:
+            node = stack.pop()
+            if node in forward:
+                continue
+            forward.add(node)
+            for neighbor_indice in self.adjacency_list.get_node(node).get_neighbors_indices():
+                if (node, neighbor_indice) in self.cycle_edges:
+                    continue
+                if neighbor_indice == x:
+                    # The edge closes a cycle, which has no valid order, so it is left out of the ordering
+                    self.cycle_edges.add((x, y))
+                    return
+                if neighbor_indice not in forward and self.position[neighbor_indice] < upper:
+                    stack.append(neighbor_indice)
+
+        backward, stack = set(), [x]
+        while stack:
+            node = stack.pop()
+            if node in backward:
+                continue
+            backward.add(node)
+            for parent in self.reverse_adjacency[node]:
+                if parent not in backward and self.position[parent] > lower and (parent, node) not in self.cycle_edges:
+                    stack.append(parent)
+
+        moved = sorted(backward, key=self.position.__getitem__) + sorted(forward, key=self.position.__getitem__)
+        slots = sorted(self.position[node] for node in moved)
+        for node, slot in zip(moved, slots):
+            self.position[node] = slot
+
+    def get_group(self, i):
+        """
+        Returns the members of the group containing node `i` in calculation order.
+        """
+        return sorted(self.members[self.find(i)], key=self.position.__getitem__)
+
+    def get_groups(self):
+        """
+        Returns every group as a list of node indices, ordered by their first node, like `classify_groups`.
+        """
+        return [sorted(self.members[root]) for root in sorted(self.members_roots(), key=lambda root: min(self.members[root]))]
+
+    def get_orderings(self):
+        """
+        Returns the calculation order of every group, aligned with `get_groups`.
+        """
+        return [sorted(self.members[root], key=self.position.__getitem__) for root in sorted(self.members_roots(), key=lambda root: min(self.members[root]))]
+
+    def members_roots(self):
+        return [root for root in range(len(self.parent)) if self.parent[root] == root]
+
+    def __len__(self):
+        return len(self.adjacency_list)
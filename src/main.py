@@ -1,16 +1,70 @@
-from parser import process_dataset, combine_dicts
+import sys
+import argparse
+from contextlib import nullcontext
+from parser import load_feature_stores, process_text, ChainStream, read_chunks
+from parser.calc_math_qa_parser import Calc_Math_QA_Processer
 from structures import create_graph
-from logic import classify_groups, sort_groups, chain_groups, print_chain
+from logic import classify_groups, sort_groups, chain_groups, ChainRenderer, IncrementalGrouper
+from instrumentation import instrumentation
 
 if __name__ == "__main__":
-    train, test = process_dataset("./data")
-    combined_dict = combine_dicts([train[57], train[58]])
-    adjacency_list = create_graph(combined_dict)
-    all_groups, reverse_adjacency = classify_groups(adjacency_list)
-    ordering = sort_groups(all_groups, adjacency_list, reverse_adjacency)
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--input", help="Groups gadget formatted chain text or expr=result lines from a file (- for stdin) instead of the dataset")
+    arg_parser.add_argument("--stream", action="store_true", help="Reads gadget formatted --input in chunks and links each calculation as soon as its output tag closes, reporting malformed tags and calculations failing to process on stderr")
+    arg_parser.add_argument("--cache", help="ResultCache file reusing the --input chains processed by earlier runs")
+    arg_parser.add_argument("--evaluation-snapshot", help="EvaluationCache JSON snapshot of evaluated expressions, loaded before processing and saved with the new evaluations after it")
+    arg_parser.add_argument("--format", choices=ChainRenderer.FORMATS, default="text", help="Output format of the chains")
+    arg_parser.add_argument("--profile-json", help="Writes the instrumentation counters and stage timings as JSON")
+    arg_parser.add_argument("--profile-folded", help="Writes the stage timings as folded stacks for flamegraph.pl or speedscope")
+    args = arg_parser.parse_args()
+    if args.profile_json or args.profile_folded:
+        instrumentation.enable()
+
+    if args.input is not None and args.stream:
+        # The log is never held in memory, every calculation joins the graph once its output is read. Malformed tags and calculations failing to process are reported and skipped
+        stream = ChainStream(on_malformed=lambda report: print(f"Skipped chain text at {report['offset']} ({report['kind']}): {report['text']!r}", file=sys.stderr))
+        grouper = IncrementalGrouper()
+        with (nullcontext(sys.stdin.buffer) if args.input == "-" else open(args.input, "rb")) as source:
+            for _ in grouper.add_stream(stream.calculations(read_chunks(source))):
+                pass
+        adjacency_list, reverse_adjacency = grouper.adjacency_list, grouper.reverse_adjacency
+        all_groups, ordering = grouper.get_groups(), grouper.get_orderings()
+    else:
+        if args.input is not None:
+            # Raw text is processed directly, the dataset and its dependencies are never loaded
+            if args.input == "-":
+                text = sys.stdin.read()
+            else:
+                with open(args.input) as f:
+                    text = f.read()
+            processor = None
+            if args.cache is not None or args.evaluation_snapshot is not None:
+                from parser import ResultCache
+                result_cache = ResultCache(args.cache) if args.cache is not None else None
+                processor = Calc_Math_QA_Processer(special_func=set(), special_var=set(), result_cache=result_cache, evaluation_snapshot=args.evaluation_snapshot)
+            adjacency_list = create_graph(process_text(text, processor))
+            if args.evaluation_snapshot is not None:
+                processor.evaluation_cache.save()
+        else:
+            # The mix is gathered from the memory-mapped columns `create_graph` needs and joined on them, without converting the rows to Python
+            from parser import MixSampler, GRAPH_COLUMNS
+            from parser.value_table import VALUE_ID_COLUMNS
+            from structures import create_arrow_graph
+            train, test = load_feature_stores("./data", evaluation_snapshot=args.evaluation_snapshot)
+            sampler = MixSampler(train, mix_size=2, columns=[column for column in GRAPH_COLUMNS if column not in VALUE_ID_COLUMNS])
+            table, _ = sampler.take_batch([[57, 58]])
+            adjacency_list = create_arrow_graph(table)
+        all_groups, reverse_adjacency = classify_groups(adjacency_list)
+        ordering = sort_groups(all_groups, adjacency_list, reverse_adjacency)
     chained_groups = chain_groups(all_groups, adjacency_list, reverse_adjacency)
-    for chain in chained_groups:
-        print_chain(chain, adjacency_list)
+    ChainRenderer(sys.stdout, format=args.format).render_all(chained_groups, adjacency_list)
+
+    if args.profile_json:
+        with open(args.profile_json, "w") as f:
+            instrumentation.write_json(f)
+    if args.profile_folded:
+        with open(args.profile_folded, "w") as f:
+            instrumentation.write_folded(f)
     
     '''
     for i, node in enumerate(adjacency_list.get_nodes()):
@@ -1 +1,24 @@
-from .calc_math_qa_parser import process_dataset, combine_dicts
\ No newline at end of file
+import importlib
+from .calc_math_qa_parser import process_dataset, process_text, chain_from_text, combine_dicts, load_feature_stores
+from .evaluation_cache import EvaluationCache
+from .arithmetic_evaluator import ArithmeticEvaluator
+from .vocabulary import VocabularyMatchers
+from .value_table import ValueTable, remap_ids
+from .chain_stream import ChainStream, read_chunks
+
+# Exports backed by pyarrow, imported on first use so grouping raw text starts without loading it
+LAZY_EXPORTS = {
+    "FeatureStore": ".feature_store",
+    "write_feature_store": ".feature_store",
+    "GRAPH_COLUMNS": ".feature_store",
+    "MixSampler": ".mix_sampler",
+    "process_split_shards": ".dataset_shards",
+    # The result cache imports SQLite, only needed once caching is asked for
+    "ResultCache": ".result_cache",
+    "code_version": ".result_cache",
+}
+
+def __getattr__(name):
+    if name in LAZY_EXPORTS:
+        return getattr(importlib.import_module(LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
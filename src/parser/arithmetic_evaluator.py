@@ -0,0 +1,249 @@
+import ast
+import math
+from decimal import Decimal
+from fractions import Fraction
+from mpmath.libmp import (
+    from_int, from_rational, from_str, mpf_add, mpf_sub, mpf_mul, mpf_div, mpf_neg, mpf_pow, mpf_pow_int,
+    normalize, to_str, round_nearest, fzero, fone, ComplexResult,
+)
+
+# Sympy evaluates with 15 digits (53 bits) and `evalf` works with 4 guard bits before rounding back
+PRECISION = 53
+GUARD_PRECISION = PRECISION + 4
+DIGITS = 15
+
+class Unsupported(Exception):
+    """
+    Raised when an expression needs Sympy (e.g. symbols, irrational results, infinities).
+    """
+
+class FloatValue():
+    """
+    A Sympy `Float` at the default 53 bit precision, stored as a raw mpmath mpf tuple.
+    """
+    __slots__ = ("mpf",)
+
+    def __init__(self, mpf):
+        self.mpf = mpf
+
+def float_result(mpf):
+    # Sympy's `Float._new` turns a zero result into the exact `S.Zero`, only literals like `0.0` stay a zero float
+    if mpf == fzero:
+        return Fraction(0)
+    if not mpf[1]:
+        raise Unsupported("inf/nan")
+    return FloatValue(mpf)
+
+def as_mpf(value):
+    if isinstance(value, FloatValue):
+        return value.mpf
+    if value.denominator == 1:
+        return from_int(value.numerator, PRECISION, round_nearest)
+    return from_rational(value.numerator, value.denominator, PRECISION, round_nearest)
+
+def add(left, right):
+    if isinstance(left, Fraction) and isinstance(right, Fraction):
+        return left + right
+    return float_result(mpf_add(as_mpf(left), as_mpf(right), PRECISION, round_nearest))
+
+def sub(left, right):
+    if isinstance(left, Fraction) and isinstance(right, Fraction):
+        return left - right
+    return float_result(mpf_sub(as_mpf(left), as_mpf(right), PRECISION, round_nearest))
+
+def mul(left, right):
+    if isinstance(left, Fraction) and isinstance(right, Fraction):
+        return left * right
+    return float_result(mpf_mul(as_mpf(left), as_mpf(right), PRECISION, round_nearest))
+
+def div(left, right):
+    if (isinstance(right, Fraction) and right == 0) or (isinstance(right, FloatValue) and right.mpf == fzero):
+        raise Unsupported("division by zero")
+    if isinstance(left, Fraction) and isinstance(right, Fraction):
+        return left / right
+    if isinstance(left, Fraction):
+        # Sympy computes `Rational/Float` as `Rational*(1/Float)`
+        reciprocal = float_result(mpf_div(fone, right.mpf, PRECISION, round_nearest))
+        return mul(reciprocal, left)
+    return float_result(mpf_div(left.mpf, as_mpf(right), PRECISION, round_nearest))
+
+def mod(left, right):
+    if not (isinstance(left, Fraction) and isinstance(right, Fraction)) or right == 0:
+        raise Unsupported("float or zero modulo")
+    return left % right
+
+def power(base, expt):
+    if isinstance(expt, Fraction):
+        if expt == 0:
+            return Fraction(1)
+        if expt == 1:
+            return base
+        if isinstance(base, Fraction) and base == 1:
+            return base
+        if expt.denominator != 1 or abs(expt.numerator) > 1024:
+            raise Unsupported("irrational or oversized power")
+        if isinstance(base, Fraction):
+            if base == 0 and expt < 0:
+                raise Unsupported("division by zero")
+            return base ** expt.numerator
+        if base.mpf == fzero:
+            raise Unsupported("zero float power")
+        return float_result(mpf_pow_int(base.mpf, expt.numerator, PRECISION, round_nearest))
+
+    if isinstance(base, Fraction) and base == 1:
+        return base
+    base_mpf = as_mpf(base)
+    if base_mpf[0] or base_mpf == fzero:
+        raise Unsupported("complex or zero power")
+    try:
+        return float_result(mpf_pow(base_mpf, expt.mpf, PRECISION, round_nearest))
+    except ComplexResult:
+        raise Unsupported("complex power")
+
+def exact_integer(value):
+    if not isinstance(value, Fraction) or value.denominator != 1:
+        raise Unsupported("non-integer argument")
+    return value.numerator
+
+def exact_sqrt(value):
+    if not isinstance(value, Fraction) or value < 0:
+        raise Unsupported("non-exact square root")
+    numerator, denominator = math.isqrt(value.numerator), math.isqrt(value.denominator)
+    if numerator * numerator != value.numerator or denominator * denominator != value.denominator:
+        raise Unsupported("irrational square root")
+    return Fraction(numerator, denominator)
+
+def exact_factorial(value):
+    n = exact_integer(value)
+    if n < 0 or n > 10000:
+        raise Unsupported("factorial out of range")
+    return Fraction(math.factorial(n))
+
+def floor_value(value):
+    if isinstance(value, FloatValue):
+        return Fraction(math.floor(Fraction(*to_fraction_parts(value.mpf))))
+    return Fraction(math.floor(value))
+
+def ceiling_value(value):
+    if isinstance(value, FloatValue):
+        return Fraction(math.ceil(Fraction(*to_fraction_parts(value.mpf))))
+    return Fraction(math.ceil(value))
+
+def to_fraction_parts(mpf):
+    sign, man, expt, _ = mpf
+    man = -man if sign else man
+    return (man * 2**expt, 1) if expt >= 0 else (man, 2**-expt)
+
+def abs_value(value):
+    if isinstance(value, FloatValue):
+        return FloatValue((0,) + value.mpf[1:])
+    return abs(value)
+
+# Functions whose Sympy result is exact for exact (or any, for floor/ceiling/Abs) arguments
+FUNCTIONS = {
+    "gcd": (2, lambda a, b: Fraction(math.gcd(exact_integer(a), exact_integer(b)))),
+    "lcm": (2, lambda a, b: Fraction(math.lcm(exact_integer(a), exact_integer(b)))),
+    "factorial": (1, exact_factorial),
+    "sqrt": (1, exact_sqrt),
+    "floor": (1, floor_value),
+    "ceiling": (1, ceiling_value),
+    "Abs": (1, abs_value),
+}
+
+BINARY_OPERATORS = {
+    ast.Add: add,
+    ast.Sub: sub,
+    ast.Mult: mul,
+    ast.Div: div,
+    ast.Mod: mod,
+    ast.Pow: power,
+}
+
+class ArithmeticEvaluator():
+    """
+    Evaluates plain `+ - * / % **` arithmetic on literals, and the exact functions in `FUNCTIONS`, without Sympy.
+    Follows Sympy's number semantics (exact rationals, 53 bit floats rounded per operation) so `evaluate` returns the same string as `str(sympy.sympify(expr).evalf())`.
+    Anything else (symbols, constants like `pi`, irrational results) returns `None` for the caller to fall back on Sympy.
+    """
+    def __init__(self, functions=FUNCTIONS):
+        self.functions = functions
+        self.evaluated = 0
+        self.unsupported = 0
+
+    def evaluate(self, expr):
+        try:
+            tree = ast.parse(expr, mode="eval")
+            value = self.evaluate_node(tree.body, expr)
+        except (Unsupported, SyntaxError, ValueError, OverflowError, RecursionError):
+            self.unsupported += 1
+            return None
+        self.evaluated += 1
+        return self.format(value)
+
+    def evaluate_many(self, exprs):
+        """
+        Evaluates a batch of expressions, returning `None` in place of each expression that needs Sympy.
+        """
+        return [self.evaluate(expr) for expr in exprs]
+
+    def evaluate_node(self, node, source):
+        if isinstance(node, ast.BinOp):
+            operator = BINARY_OPERATORS.get(type(node.op))
+            if operator is None:
+                raise Unsupported(type(node.op).__name__)
+            return operator(self.evaluate_node(node.left, source), self.evaluate_node(node.right, source))
+
+        if isinstance(node, ast.UnaryOp):
+            operand = self.evaluate_node(node.operand, source)
+            if isinstance(node.op, ast.USub):
+                if isinstance(operand, FloatValue):
+                    return FloatValue(mpf_neg(operand.mpf))
+                return -operand
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            raise Unsupported(type(node.op).__name__)
+
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            if isinstance(node.value, int):
+                return Fraction(node.value)
+            return self.parse_float(ast.get_source_segment(source, node))
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            function = self.functions.get(node.func.id)
+            if function is None or len(node.args) != function[0]:
+                raise Unsupported(node.func.id)
+            return function[1](*[self.evaluate_node(arg, source) for arg in node.args])
+
+        raise Unsupported(type(node).__name__)
+
+    @staticmethod
+    def parse_float(literal):
+        # Sympy raises the precision of literals with more than 15 significant digits
+        if literal is None or len(Decimal(literal).as_tuple().digits) > DIGITS:
+            raise Unsupported("high precision literal")
+        return FloatValue(from_str(literal, PRECISION, round_nearest))
+
+    @staticmethod
+    def format(value):
+        """
+        Formats a value like `str(value.evalf())` in Sympy.
+        """
+        if isinstance(value, FloatValue):
+            if value.mpf == fzero:
+                return "0"
+            mpf = value.mpf
+        elif value == 0:
+            return "0"
+        elif value.denominator == 1:
+            mpf = from_int(value.numerator, GUARD_PRECISION)
+        else:
+            mpf = from_rational(value.numerator, value.denominator, GUARD_PRECISION)
+        sign, man, expt, bc = mpf
+        mpf = normalize(sign, man, expt, bc, PRECISION, round_nearest)
+
+        result = to_str(mpf, DIGITS, strip_zeros=False)
+        if result.startswith("-.0"):
+            result = "-0." + result[3:]
+        elif result.startswith(".0"):
+            result = "0." + result[2:]
+        return result.removeprefix("+")
@@ -1,22 +1,94 @@
 import re
-import copy
-import sympy
-import ast
+import os
 from pathlib import Path
-from datasets import load_dataset, load_from_disk
 import random
+from instrumentation import instrumentation, instrumented
+from .evaluation_cache import EvaluationCache
+from .calculation import Calculation, correct_paren
+from .vocabulary import VocabularyMatchers
+from .value_table import ValueTable, remap_ids, VALUE_ID_COLUMNS
+
+EXPRESSION_CLEANUP = re.compile(r'\s+|_')
+SOLUTION_CLEANUP = re.compile(r'_|around|^.*=\s*| ')
+FUNCTION_NAME = re.compile(r'[a-zA-Z]+')
+
+def processed_features():
+    """
+    Returns the column types of `process_chain`, fixed so every parallel shard writes the same schema.
+    """
+    from datasets import List, Value
+    return {
+        "expressions": List(Value("string")),
+        "solutions": List(Value("string")),
+        "full_equations": List(Value("string")),
+        "has_sub_expressions": List(Value("bool")),
+        "has_function_calls": List(Value("bool")),
+        "has_special_variables": List(Value("bool")),
+        "is_single_func": List(Value("string")),
+        "sub_expressions": List(List(Value("string"))),
+        "sub_expression_results": List(List(Value("string"))),
+        "operands": List(List(Value("string"))),
+        "main_operands": List(List(Value("string"))),
+        "simplified_expressions": List(Value("string")),
+        "all_numbers": List(List(Value("string"))),
+        "operators": List(List(Value("string"))),
+        "main_operators": List(Value("string")),
+        "value_table": List(Value("float64")),
+        "solution_ids": List(Value("int32")),
+        "operand_ids": List(List(Value("int32"))),
+        "main_operand_ids": List(List(Value("int32"))),
+        "sub_expression_result_ids": List(List(Value("int32"))),
+    }
 
 class Calc_Math_QA_Processer():
-    def __init__(self, special_func=set(), special_var=set()):
+    def __init__(self, special_func=set(), special_var=set(), cache_size=65536, evaluation_snapshot=None, frozen_vocabulary=False, result_cache=None):
+        self.vocabulary_version = 0
+        self.vocabulary_digest = None
+        self.frozen_vocabulary = frozen_vocabulary
+        self.matchers = None
         self.special_func = special_func
         special_var.add("pi")
         self.special_var = special_var
+        # Optional JSON snapshot of the `EvaluationCache`, loaded here and written by `evaluation_cache.save()`
+        self.evaluation_cache = EvaluationCache(max_size=cache_size, snapshot_path=evaluation_snapshot)
+        # Optional `ResultCache` returning the output of chains processed before, also by earlier runs
+        self.result_cache = result_cache
 
         self.calc_start = '<gadget id="calculator">'
         self.calc_end = '</gadget>'
         self.out_start = '<output>'
         self.out_end = '</output>'
+        self.calc_pattern = re.compile(rf"\{self.calc_start}(.*?)\{self.calc_end}")
+        self.out_pattern = re.compile(rf"\{self.out_start}(.*?)\{self.out_end}")
+
+    @property
+    def special_func(self):
+        return self._special_func
+
+    @special_func.setter
+    def special_func(self, special_func):
+        # Any change to the vocabulary invalidates the compiled matchers
+        self._special_func = special_func
+        self.vocabulary_version += 1
+
+    def get_matchers(self):
+        """
+        Returns the compiled `VocabularyMatchers` for the current vocabulary, rebuilding them only when `special_func` changed since the last call.
+        """
+        if self.matchers is None or self.matchers.version != self.vocabulary_version:
+            self.matchers = VocabularyMatchers(self.special_func, self.special_var, self.vocabulary_version)
+        return self.matchers
+
+    def vocabulary_key(self):
+        """
+        Returns an xxhash of the special functions and variables, which together with a chain's text decide its `process_chain` output.
+        """
+        if self.vocabulary_digest is None or self.vocabulary_digest[0] != self.vocabulary_version:
+            import xxhash
+            self.vocabulary_digest = (self.vocabulary_version, xxhash.xxh3_64(("\0".join(sorted(self.special_func)) + "\n" + "\0".join(sorted(self.special_var))).encode()).hexdigest())
+        return self.vocabulary_digest[1]
     
+    @instrumented()
     def process_chain(self, ds):
         """
         Combines outputs of the following methods: [`extract_formatted`, `find_sub_expressions_simplified_expressions`, `find_operands_all_numbers`, `find_operators`, `update_special_func`]
@@ -36,12 +108,26 @@ class Calc_Math_QA_Processer():
         - `all_numbers`: All numbers including the operands, sub expression results, and answers
         - `operators`: All symbols, [-+/*%**] and/or special functions, involved in the expression
         - `main_operators`: Single primary operator involved in the expression
+        - `value_table`, `solution_ids`, `operand_ids`, `main_operand_ids`, `sub_expression_result_ids`: See `find_value_ids`
         """
         sample = ds["chain"]
+        if self.result_cache is not None:
+            return self.result_cache.process_chain(self, sample)
 
         extracted_formatted = self.extract_formatted(sample)
-        expressions, solutions, full_equations = extracted_formatted["expressions"], extracted_formatted["solutions"], extracted_formatted["full_equations"]
+        return self.process_calculations(extracted_formatted["expressions"], extracted_formatted["solutions"], extracted_formatted["full_equations"])
+
+    def process_calculation(self, expression, solution):
+        """
+        Processes a single calculation, e.g. a record of `ChainStream`. Returns the fields of `process_chain` for this one calculation (`{"expressions": "100/2", "solutions": "50", ...}`).
+        """
+        processed = self.process_calculations([expression], [solution], [f"{expression}={solution}"])
+        return {key: values[0] if key != "value_table" else values for key, values in processed.items()}
 
+    def process_calculations(self, expressions, solutions, full_equations):
+        """
+        Returns the fields of `process_chain` for already extracted expressions and solutions.
+        """
         self.update_special_func(full_equations)
         
         find_sub_expressions_simplified_expressions = self.find_sub_expressions_simplified_expressions(expressions)
@@ -53,6 +139,8 @@ class Calc_Math_QA_Processer():
         find_operators = self.find_operators(expressions, simplified_expressions, is_single_func)
         operators, main_operators = find_operators["operaters"], find_operators["main_operators"]
 
+        value_ids = self.find_value_ids(solutions, operands, main_operands, sub_express_results)
+
         return {
             "expressions": expressions,
             "solutions": solutions,
@@ -69,8 +157,10 @@ class Calc_Math_QA_Processer():
             "all_numbers": all_numbers,
             "operators": operators,
             "main_operators": main_operators,
+            **value_ids,
         }
     
+    @instrumented()
     def extract_formatted(self, sample):
         '''
         Formats and compresses the equations while parsing the expressions and solutions.
@@ -79,9 +169,11 @@ class Calc_Math_QA_Processer():
         - `solutions`: The solutions to the expressions
         - `full_equations`: The formatted and compressed expressions and solutions put together
         '''
-        expressions = [re.sub(rf'\s+|_', '', expression) for expression in re.findall(rf"\{self.calc_start}(.*?)\{self.calc_end}", sample)]
-        solutions = [re.sub(r'_|around|^.*=\s*| ', "", solution) for solution in re.findall(rf"\{self.out_start}(.*?)\{self.out_end}", sample)]
+        expressions = [EXPRESSION_CLEANUP.sub('', expression) for expression in self.calc_pattern.findall(sample)]
+        solutions = [SOLUTION_CLEANUP.sub("", solution) for solution in self.out_pattern.findall(sample)]
         full_equations = [f"{expression}={solution}" for expression, solution in zip(expressions, solutions)]
+        if instrumentation.enabled:
+            instrumentation.count("regex_passes", 2 + len(expressions) + len(solutions))
 
         return {
             "expressions": expressions,
@@ -102,115 +194,78 @@ class Calc_Math_QA_Processer():
         - `sub_expression_results`: The result of the actual sub-expressions, if any
         - `simplified_expressions`: The simplified expression consisting only of floats/integers with a single operator (e.g. (2*3)+5 -> 6+5)
         """
+        calculations = self.build_calculations(expressions)
 
-        has_function_calls = [False for _ in range(len(expressions))]
-        has_special_vars = [False for _ in range(len(expressions))]
-        is_single_func = [None for _ in range(len(expressions))]
-        simplified_expressions = copy.deepcopy(expressions)
-
-        sub_express = [[] for _ in range(len(expressions))]
-        has_sub_express = [False for _ in sub_express]
-        sub_express_results = [[] for _ in sub_express]
-        for i in range(len(expressions)):
-            temp_express = expressions[i]
+        return {
+            "has_sub_expressions": [bool(calculation.sub_expressions) for calculation in calculations],
+            "has_function_calls": [calculation.has_function_calls for calculation in calculations],
+            "has_special_variables": [calculation.has_special_variables for calculation in calculations],
+            "single_func": [calculation.single_func for calculation in calculations],
+            "sub_expressions": [calculation.sub_expressions for calculation in calculations],
+            "sub_expression_results": [calculation.sub_expression_results for calculation in calculations],
+            "simplified_expressions": [calculation.simplified_expression for calculation in calculations],
+        }
 
-            def is_single_function(expr, allowed_funcs=list(self.special_func)):
+    @instrumented()
+    def build_calculations(self, expressions):
+        """
+        Parses each expression once into a `Calculation`, evaluates all sub-expressions in a single batch and simplifies the expressions.
+        """
+        matchers = self.get_matchers()
+        calculations = [Calculation(expression, matchers) for expression in expressions]
+        if instrumentation.enabled:
+            instrumentation.count("calculations", len(calculations))
+            # One parse per calculation and a function and variable search over its inner expression
+            instrumentation.count("ast_parses", len(calculations))
+            instrumentation.count("regex_passes", 2 * len(calculations))
+
+        flat_sub_express_results = iter(self.evaluation_cache.evaluate_many([sub_e for calculation in calculations for sub_e in calculation.sub_expressions]))
+        for calculation in calculations:
+            temp_express = calculation.inner_expression
+            for sub_e in calculation.sub_expressions:
+                sub_express_part_result = next(flat_sub_express_results)
+                calculation.sub_expression_results.append(sub_express_part_result)
                 try:
-                    tree = ast.parse(expr, mode='eval')
-                    node = tree.body
-
-                    if isinstance(node, ast.Call):
-                        if isinstance(node.func, ast.Name) and node.func.id in allowed_funcs:
-                            return node.func.id
-                    return None
-                except Exception:
-                    return None
-            
-            result = is_single_function(temp_express)
-            if result:
-                is_single_func[i] = result
-                has_function_calls[i] = True
-                single_func = result
-                temp_express = temp_express[len(single_func)+1:-1]
-            
-            for func in self.special_func:
-                if func in temp_express:
-                    has_function_calls[i] = True
-            for var in self.special_var:
-                if var in temp_express:
-                    has_special_vars[i] = True
-
-            def get_primary_subexpressions(expr):
-                root = ast.parse(expr, mode="eval").body
-                subs = []
-
-                if isinstance(root, ast.BinOp):
-                    for side in (root.left, root.right):
-                        subs.extend(extract_operand(side))
-
-                elif isinstance(root, ast.Call):
-                    subs.extend(root.args)
-
-                return [ast.unparse(s) for s in subs]
-
-            def extract_operand(node):
-                if isinstance(node, ast.Call):
-                    return node.args
-
-                if isinstance(node, (ast.BinOp, ast.UnaryOp)):
-                    return [node]
-
-                return []
-
-            found_sub_expressions = get_primary_subexpressions(temp_express)
-            sub_express[i] = [re.sub(r"\s+", "", sub_e) for sub_e in found_sub_expressions]
-            if sub_express[i]:
-                has_sub_express[i] = True
-                for j in range(len(sub_express[i])):
-                    sub_express_part_result = str(sympy.sympify(sub_express[i][j]).evalf())
-                    sub_express_results[i].append(sub_express_part_result)
-                    try:
-                        if float(sub_express[i][j]) == float(sub_express_part_result):
-                            continue
-                    except:
-                        temp_express = re.sub(re.escape(sub_express[i][j]), sub_express_part_result, temp_express)
+                    if float(sub_e) == float(sub_express_part_result):
+                        continue
+                except:
+                    temp_express = temp_express.replace(sub_e, sub_express_part_result)
 
-            if is_single_func[i]:
-                simplified_expressions[i] = f"{single_func}({temp_express})"
+            if calculation.single_func:
+                calculation.simplified_expression = f"{calculation.single_func}({temp_express})"
             else:
-                def correct_paren(expr):
-                    open_paren = expr.count("(")
-                    close_paren = expr.count(")")
-                    if open_paren > close_paren:
-                        expr += ")" * (open_paren-close_paren)
-                    elif open_paren < close_paren:
-                        expr = "(" * (close_paren-open_paren) + temp_express
-                    return expr
-                
-                for func in self.special_func:
-                    if func in temp_express:
-                        def replace_func(match):
-                            inner = match.group(1)
-                            res_express = correct_paren(f"{func}({inner})")
-                            return str(sympy.sympify(res_express).evalf())
-                        temp_express = re.sub(rf"{func}\((.*?)\)", replace_func, temp_express)
-                for var in self.special_var:
-                    if var in temp_express:
-                        def replace_var(match):
-                            return str(sympy.sympify(f"{var}").evalf())
-                        temp_express = re.sub(rf"{var}", replace_var, temp_express)
-                simplified_expressions[i] = temp_express
-            
-        return {
-            "has_sub_expressions": has_sub_express,
-            "has_function_calls": has_function_calls,
-            "has_special_variables": has_special_vars,
-            "single_func": is_single_func,
-            "sub_expressions": sub_express,
-            "sub_expression_results": sub_express_results,
-            "simplified_expressions": simplified_expressions,
-        }
+                calculation.simplified_expression = self.simplify_functions_variables(temp_express)
+
+        return calculations
 
+    def simplify_functions_variables(self, temp_express):
+        """
+        Replaces special function calls and special variables with their evaluated results.
+        """
+        matchers = self.get_matchers()
+
+        # Functions are replaced in vocabulary order, re-checking the called functions after every replacement
+        called_functions = matchers.called_functions(temp_express)
+        while called_functions:
+            func = called_functions[0]
+            def replace_func(match):
+                inner = match.group(1)
+                res_express = correct_paren(f"{func}({inner})", temp_express)
+                return self.evaluation_cache.evaluate(res_express)
+            temp_express = matchers.function_calls[func].sub(replace_func, temp_express)
+            if instrumentation.enabled:
+                instrumentation.count("regex_passes", 2)
+            called_functions = matchers.called_functions(temp_express, after_rank=matchers.function_ranks[func])
+
+        for var in matchers.variables:
+            if var in temp_express:
+                var_result = self.evaluation_cache.evaluate(var)
+                temp_express = matchers.variable_patterns[var].sub(lambda _: var_result, temp_express)
+                if instrumentation.enabled:
+                    instrumentation.count("regex_passes")
+        return temp_express
+
+    @instrumented()
     def find_operands_all_numbers(self, expressions, simplified_expressions, solutions):
         """
         Finds operands within the general expression, formats the primary operands, and crafts together all numbers.
@@ -219,14 +274,14 @@ class Calc_Math_QA_Processer():
         - `main_operands`: The primary 2 numbers involved in the expression
         - `all_numbers`: All numbers including the operands, sub expression results, and answers
         """
-        operand_pattern = r"-?\d*\.?\d+"
-        for var in self.special_var:
-            operand_pattern = operand_pattern + f"|{var}"
+        operand_pattern = self.get_matchers().operand_pattern
 
-        operands = [re.findall(operand_pattern, expression) for expression in expressions]
-        main_operands = [re.findall(operand_pattern, simplified_expression) for simplified_expression in simplified_expressions]
+        operands = [operand_pattern.findall(expression) for expression in expressions]
+        main_operands = [operand_pattern.findall(simplified_expression) for simplified_expression in simplified_expressions]
+        if instrumentation.enabled:
+            instrumentation.count("regex_passes", len(expressions) + len(simplified_expressions))
 
-        all_numbers = copy.deepcopy(operands)
+        all_numbers = [list(numbers) for numbers in operands]
         for i in range(len(all_numbers)):
             if all_numbers[i] != main_operands[i]:
                 for j in range(len(all_numbers[i])):
@@ -240,6 +295,7 @@ class Calc_Math_QA_Processer():
             "all_numbers": all_numbers
         }
     
+    @instrumented()
     def find_operators(self, expressions, simplified_expressions, is_single_func): 
         """
         Finds operators (1+) and main operaters (1) in the expression. 
@@ -247,35 +303,82 @@ class Calc_Math_QA_Processer():
         - `operators`: All symbols, [-+/*%**] and/or special functions, involved in the expression
         - `main_operators`: Single primary operator involved in the expression
         """
-        operator_pattern = r"\*\*|[-+/*%]"
+        operator_pattern = self.get_matchers().operator_pattern
 
-        for func in self.special_func:
-            operator_pattern = rf"{func}|" + operator_pattern
-
-        operators = [re.findall(operator_pattern, expression) for expression in expressions]
+        operators = [operator_pattern.findall(expression) for expression in expressions]
         main_operators = []
         for i in range(len(simplified_expressions)):
             if is_single_func[i]:
                 main_operators.append(is_single_func[i])
             else:
-                main_operators.append(re.findall(operator_pattern, simplified_expressions[i])[0])
+                main_operators.append(operator_pattern.findall(simplified_expressions[i])[0])
+        if instrumentation.enabled:
+            instrumentation.count("regex_passes", len(expressions) + sum(1 for func in is_single_func if not func))
 
         return {
             "operaters": operators,
             "main_operators": main_operators,
         }
     
+    @instrumented()
+    def find_value_ids(self, solutions, operands, main_operands, sub_expression_results):
+        """
+        Canonicalizes every extracted number into the sample's `ValueTable`, so equal values written differently share an ID. `combine_dicts` merges the tables of a mix.
+        Returns the following: \n
+        - `value_table`: Value ID -> value for the sample
+        - `solution_ids`: Value ID of each solution, `-1` if not a number
+        - `operand_ids`: Value IDs of the operands
+        - `main_operand_ids`: Value IDs of the main operands
+        - `sub_expression_result_ids`: Value IDs of the sub-expression results
+        """
+        value_table = ValueTable()
+        solution_ids = [value_table.intern(solution) for solution in solutions]
+        operand_ids = [[value_table.intern(operand) for operand in expression_operands] for expression_operands in operands]
+        main_operand_ids = [[value_table.intern(operand) for operand in expression_operands] for expression_operands in main_operands]
+        sub_expression_result_ids = [[value_table.intern(result) for result in results] for results in sub_expression_results]
+
+        return {
+            "value_table": value_table.values,
+            "solution_ids": solution_ids,
+            "operand_ids": operand_ids,
+            "main_operand_ids": main_operand_ids,
+            "sub_expression_result_ids": sub_expression_result_ids,
+        }
+
+    @instrumented()
     def update_special_func(self, full_equations):
         """
-        Adds new, unseen Sympy functions to `self.special_func` for dynamic calculations.
+        Adds new, unseen Sympy functions to `self.special_func` for dynamic calculations. Does nothing once the vocabulary is frozen.
+        """
+        if self.frozen_vocabulary:
+            return
+        arr = self.find_special_func(full_equations)
+        # Only replace the set when something new was found, keeping the compiled matchers valid
+        if not arr <= self.special_func:
+            self.special_func = self.special_func.union(arr)
+
+    def find_special_func(self, full_equations):
+        """
+        Returns the Sympy function names used within the equations.
         """
         arr = set()
+        if instrumentation.enabled:
+            instrumentation.count("regex_passes", len(full_equations))
         for equation in full_equations:
-            founds = re.findall(r'[a-zA-Z]+', equation)
+            founds = FUNCTION_NAME.findall(equation)
             for found in founds:
                 if found and found not in self.special_var:
                     arr.add(found)
-        self.special_func = self.special_func.union(arr)
+        return arr
+
+    def scan_special_func(self, chains):
+        """
+        Returns the Sympy function names used across a batch of raw chains, without processing them.
+        """
+        arr = set()
+        for chain in chains:
+            arr |= self.find_special_func(self.extract_formatted(chain)["full_equations"])
+        return arr
 
 '''
 print(f"Expressions: {results["expressions"]}")
@@ -294,38 +397,126 @@ print(f"Operators: {results["operators"]}")
 print(f"Main Operators: {results["main_operators"]}")
 '''
 
-def process_dataset(ds_path):
+@instrumented()
+def process_dataset(ds_path, num_proc=None, cache_path=None, shard_size=1000, evaluation_snapshot=None):
     """
     Loads the Calc Math QA dataset. This function will process the dataset if not already and save it to the specified path. Returns train and val processed dataset dictionaries.
-    
+    Processing runs in two phases so it can use multiple processes while staying deterministic:
+    1. `scan_vocabulary` finds every special function in parallel
+    2. Each split is processed in shards of `shard_size` rows by processors with that frozen vocabulary, so no row depends on the rows before it (see `process_split_shards`)
+
+    Every shard is written to `{ds_path}/shards/{split}` as soon as it finishes, so an interrupted run resumes from the finished shards, and rows failing to process are quarantined to `{ds_path}/{split}_errors.arrow` instead of aborting the run.
+    The processed splits are only loaded as they are when they were completed by the current processor code, otherwise the shards whose fingerprint changed are processed again.
+
     :param ds_path: Path to the intended or residing dataset shards
+    :param num_proc: Number of processes used for processing, defaults to the CPU count
+    :param cache_path: Optional `ResultCache` file, chains processed by an earlier run with the same code and vocabulary are read from it instead
+    :param shard_size: Number of rows per shard
+    :param evaluation_snapshot: Optional `EvaluationCache` JSON snapshot, e.g. `./data/evaluations.json`, loaded by every process and saved with their new evaluations after each split
     """
-    if Path(ds_path).is_dir():
-        train = load_from_disk(f"{ds_path}/train")
-        val = load_from_disk(f"{ds_path}/val")
+    # `datasets` is only imported once the dataset is actually needed, it takes seconds to load
+    from datasets import load_dataset, load_from_disk, Dataset
+    from .feature_store import write_feature_store
+    from .result_cache import code_version, PROCESSOR_MODULES
+    from .dataset_shards import ShardManifest, process_split_shards, assemble_split, shard_schema, write_table
 
-        return train, val
-    else:
-        ds = load_dataset("MU-NLPC/Calc-math_qa", "original-splits") # https://huggingface.co/datasets/MU-NLPC/Calc-math_qa
-        processor = Calc_Math_QA_Processer()
+    split_names = ("train", "val")
+    processor_version = code_version(PROCESSOR_MODULES)
+    # A directory alone may hold a partial run or the output of older processor code
+    if all(ShardManifest(f"{ds_path}/shards/{name}").complete == processor_version and Path(f"{ds_path}/{name}").is_dir() for name in split_names):
+        return tuple(load_from_disk(f"{ds_path}/{name}") for name in split_names)
 
-        unused_columns = ["question", "result", "result_float", "question_without_options", "options", "linear_formula", "rationale", "category"]
+    ds = load_dataset("MU-NLPC/Calc-math_qa", "original-splits") # https://huggingface.co/datasets/MU-NLPC/Calc-math_qa
+    num_proc = num_proc if num_proc is not None else os.cpu_count()
 
-        train = ds["train"].remove_columns(unused_columns)
-        val = ds["validation"].remove_columns(unused_columns)
+    unused_columns = ["question", "result", "result_float", "question_without_options", "options", "linear_formula", "rationale", "category"]
 
-        train = train.map(processor.process_chain)
-        val = val.map(processor.process_chain)
+    train = ds["train"].remove_columns(unused_columns)
+    val = ds["validation"].remove_columns(unused_columns)
 
-        unused_columns = ["chain", "annotated_formula"]
-        train = train.remove_columns(unused_columns)
-        val = val.remove_columns(unused_columns)
+    # The validation split continues with the vocabulary of the training split, as when processed sequentially
+    train_special_func = scan_vocabulary(train["chain"], num_proc=num_proc)
+    val_special_func = train_special_func | scan_vocabulary(val["chain"], num_proc=num_proc)
 
-        train.save_to_disk(f"{ds_path}/train")
-        val.save_to_disk(f"{ds_path}/val")
+    processed = []
+    for name, split, special_func in zip(split_names, (train, val), (train_special_func, val_special_func)):
+        manifest = process_split_shards(split, special_func, f"{ds_path}/shards/{name}", num_proc=num_proc, shard_size=shard_size, cache_path=cache_path, evaluation_snapshot=evaluation_snapshot)
+        rows, errors = assemble_split(manifest, shard_schema(split))
+
+        Dataset(rows).save_to_disk(f"{ds_path}/{name}")
+        write_feature_store(rows, f"{ds_path}/{name}.arrow")
+        write_table(errors, Path(f"{ds_path}/{name}_errors.arrow"))
+        manifest.complete = processor_version
+        manifest.save()
+        processed.append(load_from_disk(f"{ds_path}/{name}"))
+
+    return tuple(processed)
+
+def load_feature_stores(ds_path, num_proc=None, evaluation_snapshot=None):
+    """
+    Returns the memory-mapped train and val `FeatureStore`s of the processed dataset, processing it or writing the stores first when missing.
+
+    :param ds_path: Path to the intended or residing dataset shards
+    :param num_proc: Number of processes used if the dataset still needs processing
+    :param evaluation_snapshot: Optional `EvaluationCache` snapshot used if the dataset still needs processing
+    """
+    from .feature_store import FeatureStore, write_feature_store
+
+    paths = [Path(f"{ds_path}/train.arrow"), Path(f"{ds_path}/val.arrow")]
+    if not all(path.is_file() for path in paths):
+        for split, path in zip(process_dataset(ds_path, num_proc=num_proc, evaluation_snapshot=evaluation_snapshot), paths):
+            if not path.is_file():
+                write_feature_store(split, path)
+    return tuple(FeatureStore(path) for path in paths)
+
+def scan_vocabulary(chains, num_proc=1, batch_size=1000):
+    """
+    Finds every special function used across the chains, scanning batches in parallel. Returns the set of function names.
+
+    :param chains: The raw gadget formatted chains
+    :param num_proc: Number of processes to scan with
+    :param batch_size: Number of chains scanned per task
+    """
+    processor = Calc_Math_QA_Processer(special_func=set(), special_var=set())
+    batches = [chains[i:i+batch_size] for i in range(0, len(chains), batch_size)]
+
+    if num_proc > 1 and len(batches) > 1:
+        from multiprocess import Pool
+        with Pool(min(num_proc, len(batches))) as pool:
+            found = pool.map(processor.scan_special_func, batches)
+    else:
+        found = [processor.scan_special_func(batch) for batch in batches]
+
+    return set().union(*found)
+
+def chain_from_text(text):
+    """
+    Returns calculations written as `expr=result` lines (e.g. `100/2=50`) in the gadget format of the dataset's chains, text already in the gadget format is returned as is.
+    """
+    if "<gadget" in text:
+        return text
+    calculations = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if "=" not in line:
+            raise ValueError(f"Line {line_number} is not a calculation of the form expr=result: {line!r}")
+        expression, solution = line.rsplit("=", 1)
+        calculations.append(f'<gadget id="calculator">{expression.strip()}</gadget>\n<output>{solution.strip()}</output>\n\n')
+    return "".join(calculations)
+
+def process_text(text, processor=None):
+    """
+    Processes raw calculation text, gadget formatted or `expr=result` lines, into a single sample for `create_graph` without loading the dataset.
+
+    :param text: The calculations to group
+    :param processor: A `Calc_Math_QA_Processer` to reuse, a new one learning the special functions from the text by default
+    """
+    if processor is None:
+        processor = Calc_Math_QA_Processer(special_func=set(), special_var=set())
+    return processor.process_chain({"chain": chain_from_text(text)})
 
-        return train, val
-    
 def combine_dicts(samples):
     """
     Combines the dictionaries of selected samples and randomizes the order. Intended for randomizing data when training the GNN. Returns a single dictionary of the combined samples. 
@@ -347,15 +538,26 @@ def combine_dicts(samples):
             "all_numbers": [],
             "operators": [],
             "main_operators": [],}
+    # Value IDs are local to each sample, they are rewritten to IDs of a single table for the mix
+    value_table = ValueTable()
     for sample in samples:
+        mapping = value_table.remap(sample["value_table"]) if "value_table" in sample else None
         for key in sample.keys():
-            if key == "id":
+            if key == "id" or key == "value_table":
                 continue
-            combined_dict[key].extend(sample[key])
+            if mapping is not None and key in VALUE_ID_COLUMNS:
+                combined_dict.setdefault(key, []).extend(remap_ids(sample[key], mapping))
+                continue
+            # Extra columns, e.g. the numeric values of a `FeatureStore`, are combined the same way
+            combined_dict.setdefault(key, []).extend(sample[key])
 
     indices = list(range(len(combined_dict["expressions"])))
     random.shuffle(indices)
     for key in combined_dict.keys():
-        combined_dict[key] = [combined_dict[key][i] for i in indices]
+        # Columns left out of the samples (e.g. by `FeatureStore.samples`) stay empty
+        combined_dict[key] = [combined_dict[key][i] for i in indices] if combined_dict[key] else []
+
+    if len(value_table):
+        combined_dict["value_table"] = value_table.values
     
     return combined_dict
\ No newline at end of file
@@ -0,0 +1,108 @@
+import ast
+
+class Calculation():
+    """
+    Intermediate representation of a single calculation, built from one parse of its expression.
+    Every field `Calc_Math_QA_Processer.process_chain` returns for the calculation is derived from it.
+    - `expression`: The compressed expression (e.g. `lcm(12,18)`)
+    - `single_func`: The function name if the expression primarily consists of a single func, else `None`
+    - `inner_expression`: The expression with the single func stripped (e.g. `12,18`)
+    - `has_function_calls`: Whether or not the expression required the Sympy module for advanced calculations
+    - `has_special_variables`: Whether or not the expression required parsing mathematical symbols (e.g. pi)
+    - `sub_expressions`: The primary sub-expressions found in `inner_expression`
+    - `sub_expression_results`: The evaluated `sub_expressions`, filled in by the processor
+    - `simplified_expression`: The simplified expression, filled in by the processor
+    """
+    __slots__ = ("expression", "single_func", "inner_expression", "has_function_calls", "has_special_variables", "sub_expressions", "sub_expression_results", "simplified_expression")
+
+    def __init__(self, expression, matchers):
+        self.expression = expression
+        self.single_func = None
+        self.inner_expression = expression
+        self.has_function_calls = False
+        self.has_special_variables = False
+        self.sub_expression_results = []
+        self.simplified_expression = expression
+
+        try:
+            root = ast.parse(expression, mode="eval").body
+        except Exception:
+            root = None
+        source = expression
+
+        if isinstance(root, ast.Call) and isinstance(root.func, ast.Name) and root.func.id in matchers.function_ranks:
+            self.single_func = root.func.id
+            self.has_function_calls = True
+            self.inner_expression = expression[len(self.single_func)+1:-1]
+            root = inner_node(root, expression)
+
+        if matchers.has_function(self.inner_expression):
+            self.has_function_calls = True
+        self.has_special_variables = matchers.has_variable(self.inner_expression)
+
+        if root is None:
+            # Unparseable expressions raise the same SyntaxError as before
+            root = ast.parse(self.inner_expression, mode="eval").body
+            source = self.inner_expression
+        self.sub_expressions = [compressed_unparse(sub, source) for sub in primary_subexpressions(root)]
+
+    def __repr__(self):
+        return f"Calculation({self.expression!r} -> {self.simplified_expression!r})"
+
+def inner_node(call, expression):
+    """
+    Returns the already parsed argument of a single function call when it spans exactly the stripped inner expression, otherwise `None` so the inner expression is parsed on its own (e.g. `f(x,)` strips to the tuple `x,`).
+    """
+    if len(call.args) == 1 and not call.keywords:
+        arg = call.args[0]
+        if arg.lineno == arg.end_lineno == 1 and arg.col_offset == len(call.func.id) + 1 and arg.end_col_offset == len(expression) - 1:
+            return arg
+    return None
+
+# Whitespace-stripped `ast.unparse` results keyed by the source they were parsed from
+compressed_sources = {}
+COMPRESSED_SOURCES_LIMIT = 65536
+
+def compressed_unparse(node, source):
+    """
+    Returns the whitespace-stripped `ast.unparse` of a node, reusing the result for repeated sources (e.g. `100/2`).
+    """
+    if not (source.isascii() and node.lineno == node.end_lineno == 1):
+        return "".join(ast.unparse(node).split())
+
+    segment = source[node.col_offset:node.end_col_offset]
+    compressed = compressed_sources.get(segment)
+    if compressed is None:
+        if len(compressed_sources) >= COMPRESSED_SOURCES_LIMIT:
+            compressed_sources.clear()
+        compressed = "".join(ast.unparse(node).split())
+        compressed_sources[segment] = compressed
+    return compressed
+
+def primary_subexpressions(root):
+    subs = []
+    if isinstance(root, ast.BinOp):
+        for side in (root.left, root.right):
+            subs.extend(extract_operand(side))
+    elif isinstance(root, ast.Call):
+        subs.extend(root.args)
+    return subs
+
+def extract_operand(node):
+    if isinstance(node, ast.Call):
+        return node.args
+    if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+        return [node]
+    return []
+
+def correct_paren(expr, enclosing_expr):
+    """
+    Balances the parentheses of a matched function call. A call with extra closing parentheses is prefixed onto `enclosing_expr` instead.
+    """
+    open_paren = expr.count("(")
+    close_paren = expr.count(")")
+    if open_paren > close_paren:
+        expr += ")" * (open_paren-close_paren)
+    elif open_paren < close_paren:
+        expr = "(" * (close_paren-open_paren) + enclosing_expr
+    return expr
@@ -0,0 +1,153 @@
+import re
+import codecs
+from instrumentation import instrumentation
+from .calc_math_qa_parser import Calc_Math_QA_Processer, EXPRESSION_CLEANUP, SOLUTION_CLEANUP
+
+def read_chunks(file, chunk_size=65536):
+    """
+    Generates the chunks of an open file as they are read, e.g. `sys.stdin` or `socket.makefile("rb")`.
+    """
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+class ChainStream():
+    """
+    Incremental tokenizer of gadget tagged chain text (`<gadget id="calculator">100/2</gadget><output>50</output>`) arriving in chunks, e.g. a long calculator session log read from a file or socket.
+    Each calculation is yielded as soon as its `</output>` closes and only the text after the last complete tag is kept, so the session never has to sit in memory at once.
+    Unlike the two `findall` passes of `extract_formatted`, every output is paired with the gadget right before it, so a missing tag drops one calculation instead of shifting every later solution. Such problems are collected in `malformed`:
+    - `missing_output`: A gadget followed by another gadget, or by the end of the stream, without an output
+    - `missing_gadget`: An output without a gadget before it
+    - `unclosed_tag`: A tag whose closing tag does not follow on the same line
+    - `unprocessable`: A calculation `process_calculation` failed on (e.g. unbalanced parentheses or a Sympy error), skipped like the rows quarantined by `process_dataset`
+
+    :param processor: `Calc_Math_QA_Processer` processing the calculations, a new one learning the special functions from the stream by default
+    :param on_malformed: Optional callable receiving each malformed report as soon as it is found
+    """
+    def __init__(self, processor=None, on_malformed=None):
+        self.processor = processor if processor is not None else Calc_Math_QA_Processer(special_func=set(), special_var=set())
+        self.on_malformed = on_malformed
+        self.malformed = []
+
+        self.calc_start, self.calc_end = self.processor.calc_start, self.processor.calc_end
+        self.out_start, self.out_end = self.processor.out_start, self.processor.out_end
+        self.opening = re.compile(f"{re.escape(self.calc_start)}|{re.escape(self.out_start)}")
+        # Longest text that could be the beginning of an opening tag cut off by the end of a chunk
+        self.partial_tag = max(len(self.calc_start), len(self.out_start)) - 1
+
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.offset = 0 # Stream position of `buffer[0]`
+        self.expression = None # Gadget still waiting for its output, with its stream position
+        self.expression_offset = None
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of text (or UTF-8 bytes) and generates every calculation record it completes, `{"expression": "100/2", "solution": "50", "offset": 0}`.
+        """
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = self.decoder.decode(chunk)
+        self.buffer += chunk
+        yield from self.scan()
+
+    def close(self):
+        """
+        Ends the stream, reporting a tag left open or a gadget still waiting for its output.
+        """
+        self.buffer += self.decoder.decode(b"", final=True)
+        for _ in self.scan():
+            pass
+        opening = self.opening.search(self.buffer)
+        if opening is not None:
+            self.report("unclosed_tag", self.offset + opening.start(), self.buffer[opening.start():opening.start()+80])
+        if self.expression is not None:
+            self.report("missing_output", self.expression_offset, self.expression)
+            self.expression = None
+        self.discard(len(self.buffer))
+
+    def records(self, chunks):
+        """
+        Generates the calculation records of an iterable of chunks, closing the stream at the end.
+        """
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        self.close()
+
+    def calculations(self, chunks):
+        """
+        Generates each processed calculation of an iterable of chunks as soon as it is complete, ready for `IncrementalGrouper.add_calculation`. A calculation failing to process is reported and skipped, so it never ends the stream.
+        """
+        for record in self.records(chunks):
+            try:
+                calculation = self.processor.process_calculation(record["expression"], record["solution"])
+            except Exception as error:
+                self.report("unprocessable", record["offset"], f"{record['expression']}={record['solution']} ({type(error).__name__}: {error})")
+                continue
+            yield calculation
+
+    def scan(self):
+        # Consumed text is cut off the buffer once per chunk instead of after every tag, also when the consumer stops early
+        cursor = 0
+        try:
+            while True:
+                opening = self.opening.search(self.buffer, cursor)
+                if opening is None:
+                    cursor = max(cursor, len(self.buffer) - self.partial_tag)
+                    return
+
+                tag, start = opening.group(), opening.start()
+                end_tag = self.calc_end if tag == self.calc_start else self.out_end
+                content_start = opening.end()
+                # Like the `.*?` of the tag patterns, a tag's content never spans lines or another tag, so no search runs past the line
+                line_end = self.buffer.find("\n", content_start)
+                limit = line_end if line_end != -1 else len(self.buffer)
+                end = self.buffer.find(end_tag, content_start, limit)
+                if self.opening.search(self.buffer, content_start, end if end != -1 else limit) is not None or (end == -1 and line_end != -1):
+                    self.report("unclosed_tag", self.offset + start, self.buffer[start:end if end != -1 else limit])
+                    cursor = content_start
+                    continue
+                if end == -1:
+                    # The closing tag has not arrived yet
+                    cursor = start
+                    return
+
+                record = self.pair(tag, self.buffer[content_start:end], self.offset + start)
+                cursor = end + len(end_tag)
+                if record is not None:
+                    yield record
+        finally:
+            self.discard(cursor)
+
+    def pair(self, tag, content, offset):
+        if tag == self.calc_start:
+            if self.expression is not None:
+                self.report("missing_output", self.expression_offset, self.expression)
+            self.expression = EXPRESSION_CLEANUP.sub("", content)
+            self.expression_offset = offset
+            return None
+
+        solution = SOLUTION_CLEANUP.sub("", content)
+        if self.expression is None:
+            self.report("missing_gadget", offset, solution)
+            return None
+        record = {"expression": self.expression, "solution": solution, "offset": self.expression_offset}
+        self.expression = None
+        self.expression_offset = None
+        return record
+
+    def discard(self, end):
+        self.buffer = self.buffer[end:]
+        self.offset += end
+
+    def report(self, kind, offset, text):
+        report = {"kind": kind, "offset": offset, "text": text}
+        self.malformed.append(report)
+        if instrumentation.enabled:
+            instrumentation.count(f"chain_stream.{kind}")
+        if self.on_malformed is not None:
+            self.on_malformed(report)
+
+    def __repr__(self):
+        return f"ChainStream(offset={self.offset}, malformed={len(self.malformed)})"
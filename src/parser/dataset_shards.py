@@ -0,0 +1,215 @@
+import os
+import json
+import time
+from pathlib import Path
+import xxhash
+import pyarrow as pa
+from instrumentation import instrumentation, instrumented
+from .calc_math_qa_parser import Calc_Math_QA_Processer
+from .result_cache import code_version, PROCESSOR_MODULES
+
+# Rows that failed to process, kept with their chain so they can be inspected and fixed
+ERROR_SCHEMA = pa.schema([
+    ("row", pa.int64()),
+    ("id", pa.string()),
+    ("error", pa.string()),
+    ("message", pa.string()),
+    ("chain", pa.string()),
+])
+
+def shard_fingerprint(processor_version, special_func, rows):
+    """
+    Returns an xxhash of everything a shard's output depends on: the processor's code, the special functions occurring in its chains (functions a chain does not mention cannot change how it is processed) and the rows themselves.
+    A grown vocabulary thereby only changes the shards that use one of the new functions.
+    """
+    text = "\0".join(rows["chain"])
+    digest = xxhash.xxh3_128()
+    digest.update(processor_version.encode())
+    digest.update("\0".join(sorted(func for func in special_func if func in text)).encode())
+    for column in sorted(rows):
+        digest.update(f"\0{column}\0".encode())
+        digest.update(json.dumps(rows[column], default=str).encode())
+    return digest.hexdigest()
+
+def shard_schema(split):
+    """
+    Returns the Arrow schema of a split's processed rows: its columns other than the raw chain and formula, followed by `processed_features`.
+    """
+    from datasets import Features
+    from .calc_math_qa_parser import processed_features
+    unused_columns = ["chain", "annotated_formula"]
+    return Features({**{key: feature for key, feature in split.features.items() if key not in unused_columns}, **processed_features()}).arrow_schema
+
+def write_table(table, path):
+    # Written next to the shard and renamed, so an interrupted write never leaves a shard that looks complete
+    temporary = path.with_name(f"{path.name}.tmp")
+    with pa.OSFile(str(temporary), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary, path)
+
+def read_table(path):
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+# Processor, split and output settings of a pool worker, set once by `start_worker`. A split loaded from disk is memory-mapped, so it is sent to the workers as a reference to its files
+worker = {}
+
+def start_worker(split, shard_size, special_func, schema, shard_dir, cache_path=None, evaluation_snapshot=None):
+    result_cache = None
+    if cache_path is not None:
+        from .result_cache import ResultCache
+        result_cache = ResultCache(cache_path)
+    worker["processor"] = Calc_Math_QA_Processer(special_func=set(special_func), special_var=set(), frozen_vocabulary=True, result_cache=result_cache, evaluation_snapshot=evaluation_snapshot)
+    if evaluation_snapshot is not None:
+        worker["processor"].evaluation_cache.take_computed()
+    worker["split"] = split
+    worker["shard_size"] = shard_size
+    worker["schema"] = schema
+    worker["shard_dir"] = Path(shard_dir)
+
+def process_shard(task):
+    """
+    Reads the rows of one shard from the split and processes them, writing the processed rows and the quarantined failures as Arrow files. A row that raises (e.g. unbalanced parentheses or a Sympy error) is quarantined instead of failing the shard.
+    Returns the shard's manifest entry, with the `evaluations` computed for the shard when recording them for a snapshot.
+
+    :param task: `(shard_index, first_row, fingerprint)`
+    """
+    index, first_row, fingerprint = task
+    processor, schema = worker["processor"], worker["schema"]
+    rows = worker["split"][first_row:first_row+worker["shard_size"]]
+    start = time.perf_counter()
+    processed = []
+    errors = []
+    other_columns = [column for column in rows if column in schema.names]
+    for i, chain in enumerate(rows["chain"]):
+        try:
+            sample = processor.process_chain({"chain": chain})
+        except Exception as error:
+            errors.append({"row": first_row + i, "id": str(rows["id"][i]) if "id" in rows else None, "error": type(error).__name__, "message": str(error), "chain": chain})
+            continue
+        processed.append({**{column: rows[column][i] for column in other_columns}, **sample})
+
+    shard_dir = worker["shard_dir"]
+    evaluation_cache = processor.evaluation_cache
+    evaluations = evaluation_cache.take_computed() if evaluation_cache.computed is not None else None
+    write_table(pa.Table.from_pylist(processed, schema=schema), shard_dir / f"shard-{index:05d}.arrow")
+    write_table(pa.Table.from_pylist(errors, schema=ERROR_SCHEMA), shard_dir / f"shard-{index:05d}.errors.arrow")
+    return {
+        "index": index,
+        "first_row": first_row,
+        "num_rows": len(rows["chain"]),
+        "fingerprint": fingerprint,
+        "processed": len(processed),
+        "errors": len(errors),
+        "seconds": time.perf_counter() - start,
+        "evaluations": evaluations,
+    }
+
+class ShardManifest():
+    """
+    Record of a split's finished shards, `{shard_dir}/manifest.json`, rewritten atomically after every shard so an interrupted run resumes from the shards already written.
+    - `shards`: Shard index -> manifest entry of `process_shard`
+    - `complete`: The processor version the assembled outputs were written with, `None` until they are
+    """
+    def __init__(self, shard_dir):
+        self.path = Path(shard_dir) / "manifest.json"
+        self.shards = {}
+        self.complete = None
+        if self.path.is_file():
+            manifest = json.loads(self.path.read_text())
+            self.shards = {int(index): entry for index, entry in manifest["shards"].items()}
+            self.complete = manifest.get("complete")
+
+    def is_current(self, index, fingerprint):
+        shard_dir = self.path.parent
+        entry = self.shards.get(index)
+        return entry is not None and entry["fingerprint"] == fingerprint and (shard_dir / f"shard-{index:05d}.arrow").is_file() and (shard_dir / f"shard-{index:05d}.errors.arrow").is_file()
+
+    def save(self):
+        temporary = self.path.with_name(f"{self.path.name}.tmp")
+        temporary.write_text(json.dumps({"complete": self.complete, "shards": {str(index): entry for index, entry in sorted(self.shards.items())}}, indent=1))
+        os.replace(temporary, self.path)
+
+@instrumented()
+def process_split_shards(split, special_func, shard_dir, num_proc=1, shard_size=1000, cache_path=None, evaluation_snapshot=None):
+    """
+    Processes a split in shards of `shard_size` rows with a frozen vocabulary, writing every shard as soon as it finishes. Returns the split's `ShardManifest`.
+    Shards whose fingerprint (see `shard_fingerprint`) matches the manifest are kept, so rerunning after an interruption, a crash or a grown vocabulary only processes the missing or affected shards. A change to the processor's code changes every fingerprint.
+
+    :param split: Dataset split with the `chain` column
+    :param special_func: The complete vocabulary of special functions, e.g. from `scan_vocabulary`
+    :param shard_dir: Directory of the split's shards and manifest, e.g. `./data/shards/train`
+    :param num_proc: Number of processes working on shards
+    :param shard_size: Number of rows per shard
+    :param cache_path: Optional `ResultCache` file shared by the processes
+    :param evaluation_snapshot: Optional `EvaluationCache` JSON snapshot loaded by every process, saved once the split finishes with the evaluations of every process merged in
+    """
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    manifest = ShardManifest(shard_dir)
+    processor_version = code_version(PROCESSOR_MODULES)
+
+    schema = shard_schema(split)
+
+    # Only one shard's rows are held at a time, the workers read the rows of their shards again
+    num_shards = (len(split) + shard_size - 1) // shard_size
+    tasks = []
+    for index in range(num_shards):
+        first_row = index * shard_size
+        fingerprint = shard_fingerprint(processor_version, special_func, split[first_row:first_row+shard_size])
+        if not manifest.is_current(index, fingerprint):
+            tasks.append((index, first_row, fingerprint))
+
+    # Shards past the end of a split that shrank
+    for index in [index for index in manifest.shards if index >= num_shards]:
+        del manifest.shards[index]
+        for path in (shard_dir / f"shard-{index:05d}.arrow", shard_dir / f"shard-{index:05d}.errors.arrow"):
+            path.unlink(missing_ok=True)
+
+    if tasks:
+        manifest.complete = None
+        manifest.save()
+    if instrumentation.enabled:
+        instrumentation.count("process_dataset.shards_reused", num_shards - len(tasks))
+        instrumentation.count("process_dataset.shards_processed", len(tasks))
+
+    snapshot = None
+    if evaluation_snapshot is not None:
+        from .evaluation_cache import EvaluationCache
+        snapshot = EvaluationCache(snapshot_path=evaluation_snapshot)
+
+    def finish(entry):
+        evaluations = entry.pop("evaluations")
+        if snapshot is not None:
+            for key, result in evaluations:
+                snapshot.put(key, result)
+        manifest.shards[entry["index"]] = entry
+        manifest.save()
+
+    settings = (split, shard_size, special_func, schema, shard_dir, cache_path, evaluation_snapshot)
+    if num_proc > 1 and len(tasks) > 1:
+        from multiprocess import Pool
+        with Pool(min(num_proc, len(tasks)), initializer=start_worker, initargs=settings) as pool:
+            for entry in pool.imap_unordered(process_shard, tasks):
+                finish(entry)
+    else:
+        start_worker(*settings)
+        for task in tasks:
+            finish(process_shard(task))
+    if snapshot is not None and tasks:
+        snapshot.save()
+
+    if instrumentation.enabled:
+        instrumentation.count("process_dataset.quarantined_rows", sum(entry["errors"] for entry in manifest.shards.values()))
+    return manifest
+
+def assemble_split(manifest, schema):
+    """
+    Returns the processed rows and the quarantined rows of every shard of a split, in row order, as two `pyarrow.Table`s.
+    """
+    shard_dir = manifest.path.parent
+    indices = sorted(manifest.shards)
+    rows = pa.concat_tables([schema.empty_table()] + [read_table(shard_dir / f"shard-{index:05d}.arrow") for index in indices])
+    errors = pa.concat_tables([ERROR_SCHEMA.empty_table()] + [read_table(shard_dir / f"shard-{index:05d}.errors.arrow") for index in indices])
+    return rows, errors
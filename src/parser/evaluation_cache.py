@@ -0,0 +1,143 @@
+import re
+import json
+from pathlib import Path
+from collections import OrderedDict
+from instrumentation import instrumentation
+from .arithmetic_evaluator import ArithmeticEvaluator
+
+class EvaluationCache():
+    """
+    Bounded LRU cache of Sympy evaluations keyed by the whitespace-stripped expression string.
+    The Calc Math QA dataset repeats the same fragments (e.g. `100/2`, `pi`, `sqrt(2)`) across samples, so most `sympify(...).evalf()` calls can be skipped.
+    Misses are first tried on the `ArithmeticEvaluator`, Sympy is only called for expressions it cannot handle.
+
+    :param max_size: Maximum number of cached expressions before the least recently used is evicted
+    :param snapshot_path: Optional JSON file to load cached evaluations from and `save` them to
+    """
+    def __init__(self, max_size=65536, snapshot_path=None):
+        self.max_size = max_size
+        self.snapshot_path = snapshot_path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.sympy_calls = 0
+        self.arithmetic_evaluator = ArithmeticEvaluator()
+        # Evaluations computed since `take_computed` was first called, `None` while not recording
+        self.computed = None
+
+        if snapshot_path is not None and Path(snapshot_path).is_file():
+            self.load(snapshot_path)
+
+    @staticmethod
+    def normalize(expr):
+        return re.sub(r"\s+", "", expr)
+
+    def evaluate(self, expr):
+        """
+        Returns `str(sympy.sympify(expr).evalf())`, reusing the cached result when the expression was already evaluated.
+        """
+        key = self.normalize(expr)
+        if key in self.entries:
+            self.hits += 1
+            if instrumentation.enabled:
+                instrumentation.count("evaluation_cache.hits")
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        if instrumentation.enabled:
+            instrumentation.count("evaluation_cache.misses")
+        result = self.arithmetic_evaluator.evaluate(key)
+        if result is None:
+            result = self.evaluate_sympy(key)
+        self.put(key, result)
+        if self.computed is not None:
+            self.computed.append((key, result))
+        return result
+
+    def evaluate_many(self, exprs):
+        """
+        Evaluates a batch of expressions at once, each distinct uncached expression is evaluated a single time.
+        """
+        keys = [self.normalize(expr) for expr in exprs]
+        results = {}
+        missing = []
+        for key in keys:
+            if key in results:
+                continue
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                results[key] = self.entries[key]
+            else:
+                results[key] = None
+                missing.append(key)
+
+        self.misses += len(missing)
+        if instrumentation.enabled:
+            instrumentation.count("evaluation_cache.hits", len(set(keys)) - len(missing))
+            instrumentation.count("evaluation_cache.misses", len(missing))
+        for key, result in zip(missing, self.arithmetic_evaluator.evaluate_many(missing)):
+            results[key] = result if result is not None else self.evaluate_sympy(key)
+            self.put(key, results[key])
+            if self.computed is not None:
+                self.computed.append((key, results[key]))
+
+        return [results[key] for key in keys]
+
+    def evaluate_sympy(self, key):
+        # Sympy takes a noticeable time to import and most expressions never need it
+        import sympy
+        self.sympy_calls += 1
+        if instrumentation.enabled:
+            instrumentation.count("sympy.calls")
+            with instrumentation.timer("sympy"):
+                return str(sympy.sympify(key).evalf())
+        return str(sympy.sympify(key).evalf())
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "sympy_calls": self.sympy_calls,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+        }
+
+    def take_computed(self):
+        """
+        Returns the `(expression, result)` pairs evaluated since the last call and starts recording them, so processes sharing a snapshot can send their new evaluations to the one saving it.
+        """
+        computed = self.computed if self.computed is not None else []
+        self.computed = []
+        return computed
+
+    def save(self, path=None):
+        """
+        Writes the cached evaluations, oldest first, to a JSON snapshot.
+        """
+        path = path if path is not None else self.snapshot_path
+        if path is None:
+            return
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(list(self.entries.items()), f)
+
+    def load(self, path):
+        with open(path) as f:
+            for key, result in json.load(f):
+                self.put(key, result)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"EvaluationCache({self.stats()})"
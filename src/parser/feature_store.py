@@ -0,0 +1,147 @@
+import math
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+from .value_table import VALUE_ID_COLUMNS
+
+# Text columns of `process_chain` and the typed float64 column written next to each of them (unparseable values are NaN)
+NUMERIC_COLUMNS = {
+    "solutions": "solution_values",
+    "operands": "operand_values",
+    "main_operands": "main_operand_values",
+    "sub_expression_results": "sub_expression_result_values",
+}
+
+# Columns `create_graph` reads, the numeric values replace parsing the solutions and sub-expression results at graph-build time
+GRAPH_COLUMNS = ("expressions", "solutions", "full_equations", "is_single_func", "has_sub_expressions", "operands", "main_operands", "solution_values", "sub_expression_result_values", "value_table", "solution_ids", "operand_ids", "main_operand_ids", "sub_expression_result_ids")
+
+def parse_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def numeric_list(array):
+    """
+    Returns a (nested) list array of strings as the same lists of float64 values, reusing its offsets.
+    """
+    if pa.types.is_list(array.type.value_type) or pa.types.is_large_list(array.type.value_type):
+        return rebase_list(array, numeric_list(array.flatten()))
+    flat = array.flatten().to_pylist()
+    values = np.fromiter((parse_value(value) for value in flat), dtype=np.float64, count=len(flat))
+    return rebase_list(array, pa.array(values, type=pa.float64()))
+
+def rebase_list(array, values):
+    # Sliced arrays keep offsets into their parent's values, shifted to start at 0 for the flattened values
+    offsets = array.offsets
+    start = offsets[0].as_py()
+    if start:
+        offsets = pa.array(np.asarray(offsets) - start, type=offsets.type)
+    return type(array).from_arrays(offsets, values)
+
+def to_feature_table(table):
+    """
+    Adds the typed numeric columns to a table of processed samples and merges it into a single chunk per column.
+    """
+    table = table.combine_chunks()
+    for column in VALUE_ID_COLUMNS:
+        if column in table.column_names:
+            # Lists of dictionaries infer int64, the value IDs are stored as int32 like `processed_features` declares
+            field = table.schema.field(column)
+            id_type = pa.list_(pa.int32()) if column == "solution_ids" else pa.list_(pa.list_(pa.int32()))
+            if field.type != id_type:
+                table = table.set_column(table.schema.get_field_index(column), column, table.column(column).cast(id_type))
+    for column, numeric_column in NUMERIC_COLUMNS.items():
+        if column in table.column_names and numeric_column not in table.column_names:
+            chunked = table.column(column)
+            array = chunked.chunk(0) if chunked.num_chunks else pa.array([], chunked.type)
+            table = table.append_column(numeric_column, numeric_list(array))
+    return table
+
+def write_feature_store(samples, path):
+    """
+    Writes processed samples as an uncompressed Arrow IPC file that `FeatureStore` memory-maps. Returns the path.
+    Ragged lists are stored as Arrow list arrays (an offset array over flat values), the numeric fields as float64 and the flags as bit-packed booleans.
+
+    :param samples: A processed `datasets.Dataset`, a `pyarrow.Table` or a list of processed sample dictionaries
+    :param path: File to write, e.g. `./data/train.arrow`
+    """
+    if isinstance(samples, pa.Table):
+        table = samples
+    elif hasattr(samples, "with_format"):
+        # A `datasets.Dataset`, read as Arrow with any selection or shuffle applied
+        table = samples.with_format("arrow")[:]
+    else:
+        table = pa.Table.from_pylist([dict(sample) for sample in samples])
+    table = to_feature_table(table)
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+class FeatureStore():
+    """
+    Memory-mapped, column-selective reader of a file written by `write_feature_store`.
+    Columns are read straight from the mapped file, so only the pages of the requested columns are ever loaded and the NumPy views share the file's memory.
+    - `columns`: Every column name in the store
+    - `read`: A `pyarrow.Table` of selected columns
+    - `list_values`/`nested_list_values`: Zero-copy offset and value arrays of a list column (e.g. `solution_values`)
+    - `samples`: Selected samples converted to dictionaries for `combine_dicts`/`create_graph`, `create_arrow_graph` groups the Arrow columns without converting them
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.source = pa.memory_map(str(self.path), "r")
+        self.reader = pa.ipc.open_file(self.source)
+        self.schema = self.reader.schema
+        self.columns = self.schema.names
+
+    def read(self, columns=None):
+        columns = list(columns) if columns is not None else self.columns
+        batches = [self.reader.get_batch(i).select(columns) for i in range(self.reader.num_record_batches)]
+        return pa.Table.from_batches(batches, schema=pa.schema([self.schema.field(column) for column in columns]))
+
+    def column(self, column):
+        """
+        Returns a column as a single Arrow array, zero-copy when the store was written in one batch (as `write_feature_store` does).
+        """
+        chunks = self.read([column]).column(0).chunks
+        if len(chunks) == 1:
+            return chunks[0]
+        return pa.concat_arrays(chunks)
+
+    def list_values(self, column):
+        """
+        Returns `(offsets, values)` of a list column, the values of sample `i` are `values[offsets[i]:offsets[i+1]]`.
+        """
+        array = self.column(column)
+        return array.offsets.to_numpy(), self.flat_values(array.values)
+
+    def nested_list_values(self, column):
+        """
+        Returns `(offsets, inner_offsets, values)` of a list of lists column (e.g. `operand_values`), the lists of sample `i` are `inner_offsets[offsets[i]:offsets[i+1]+1]` into `values`.
+        """
+        array = self.column(column)
+        return array.offsets.to_numpy(), array.values.offsets.to_numpy(), self.flat_values(array.values.values)
+
+    @staticmethod
+    def flat_values(array):
+        # Booleans are bit-packed and get unpacked, every other primitive type is a view of the mapped file
+        return array.to_numpy(zero_copy_only=not pa.types.is_boolean(array.type))
+
+    def samples(self, indices, columns=GRAPH_COLUMNS):
+        """
+        Returns the selected samples with only `columns` converted to Python lists.
+
+        :param indices: Sample (row) indices
+        :param columns: Columns to include, defaults to what `create_graph` needs
+        """
+        table = self.read([column for column in columns if column in self.columns]).take(list(indices))
+        return table.to_pylist()
+
+    def __len__(self):
+        return sum(self.reader.get_batch(i).num_rows for i in range(self.reader.num_record_batches))
+
+    def __repr__(self):
+        return f"FeatureStore({str(self.path)!r}, rows={len(self)}, columns={self.columns})"
@@ -0,0 +1,167 @@
+import gc
+import numpy as np
+import pyarrow as pa
+from instrumentation import instrumentation, instrumented
+from .feature_store import GRAPH_COLUMNS, rebase_list
+from .value_table import ValueTable, VALUE_ID_COLUMNS
+
+class MixSampler():
+    """
+    Draws random mixes of processed samples straight from their Arrow columns, a `combine_dicts` for generating the large number of mixes needed to train the GNN.
+    A batch of mixes is gathered with one Arrow `take` of the selected rows, flattened into their calculations and shuffled within each mix by a second `take`. Only the finished mixes are converted to Python lists.
+    The value IDs of every sample are interned into one table for the whole store up front, so the ID columns of a mix are rewritten with a NumPy gather and equal values share an ID across all mixes.
+    Every mix also carries its ground truth groups:
+    - `source_rows`: Store row each calculation was taken from
+    - `source_ids`: Dataset `id` of that row, when the store has an `id` column
+    - `source_positions`: Index of the calculation within its sample's chain, the true order of each group
+
+    :param store: A `FeatureStore` or a `pyarrow.Table` of processed samples
+    :param mix_size: Number of samples combined per mix
+    :param seed: Seed of the random generator, the same seed draws the same mixes
+    :param columns: Calculation columns to include, defaults to what `create_graph` needs
+    """
+    def __init__(self, store, mix_size=2, seed=None, columns=GRAPH_COLUMNS):
+        names = store.column_names if isinstance(store, pa.Table) else store.columns
+        if mix_size > (store.num_rows if isinstance(store, pa.Table) else len(store)):
+            raise ValueError(f"Cannot mix {mix_size} samples out of a store with {len(store)} rows")
+
+        self.columns = [column for column in columns if column in names and column != "value_table"]
+        if "expressions" not in self.columns:
+            self.columns.insert(0, "expressions")
+        read = self.columns + [column for column in ("id", "value_table") if column in names]
+        table = store.select(read) if isinstance(store, pa.Table) else store.read(read)
+
+        self.table = table.combine_chunks()
+        self.num_rows = self.table.num_rows
+        self.mix_size = mix_size
+        self.rng = np.random.default_rng(seed)
+        self.has_ids = "id" in names
+        self.lengths = np.diff(self.column("expressions").offsets.to_numpy())
+
+        self.value_table = None
+        if "value_table" in names and any(column in VALUE_ID_COLUMNS for column in self.columns):
+            values = self.column("value_table")
+            self.value_table = ValueTable()
+            offsets = values.offsets.to_numpy()
+            self.value_offsets = offsets - offsets[0]
+            # Store-wide ID of every sample's local value ID, with a trailing `-1` that non-numbers are pointed at
+            self.global_ids = np.append(np.asarray(self.value_table.remap(values.flatten().to_pylist()), dtype=np.int32), np.int32(-1))
+
+    def column(self, column):
+        chunked = self.table.column(column)
+        return chunked.chunk(0) if chunked.num_chunks else pa.array([], chunked.type)
+
+    def reseed(self, seed):
+        """
+        Restarts the random generator, e.g. with `(seed, batch_index)` so a batch is drawn the same regardless of the batches before it.
+        """
+        self.rng = np.random.default_rng(seed)
+
+    def sample_rows(self, num_mixes):
+        """
+        Returns a `(num_mixes, mix_size)` array of distinct store rows per mix.
+        """
+        return np.stack([self.rng.choice(self.num_rows, self.mix_size, replace=False) for _ in range(num_mixes)])
+
+    @instrumented("sample_mixes")
+    def take_batch(self, rows):
+        """
+        Gathers the mixes of a `(num_mixes, mix_size)` array of store rows. Returns the following:
+        - `table`: A `pyarrow.Table` with one row per calculation, each mix stored contiguously in a random order
+        - `offsets`: The calculations of mix `k` are the table rows `offsets[k]` to `offsets[k+1]`
+
+        :param rows: Store rows of each mix, e.g. from `sample_rows`
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        flat_rows = rows.ravel()
+        lengths = self.lengths[flat_rows]
+        node_rows = np.repeat(flat_rows, lengths)
+        positions = np.arange(len(node_rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        mix_lengths = lengths.reshape(rows.shape).sum(axis=1)
+        offsets = np.zeros(len(rows)+1, dtype=np.int64)
+        np.cumsum(mix_lengths, out=offsets[1:])
+
+        # Sorting by mix first keeps every mix contiguous, the random key shuffles the calculations within it
+        order = np.lexsort((self.rng.random(len(node_rows)), np.repeat(np.arange(len(rows)), mix_lengths)))
+        selected = pa.array(flat_rows)
+        shuffled = pa.array(order)
+
+        columns = {}
+        for column in self.columns:
+            array = self.column(column).take(selected).flatten()
+            if column in VALUE_ID_COLUMNS and self.value_table is not None:
+                array = self.global_value_ids(array, node_rows)
+            columns[column] = array.take(shuffled)
+        columns["source_rows"] = pa.array(node_rows[order])
+        columns["source_positions"] = pa.array(positions[order])
+        if self.has_ids:
+            columns["source_ids"] = self.column("id").take(columns["source_rows"])
+
+        if instrumentation.enabled:
+            instrumentation.count("sample_mixes.mixes", len(rows))
+            instrumentation.count("sample_mixes.calculations", len(node_rows))
+        return pa.table(columns), offsets
+
+    def global_value_ids(self, array, node_rows):
+        """
+        Rewrites the value IDs of a column, local to each calculation's sample, to the store-wide IDs.
+        """
+        bases = self.value_offsets[node_rows]
+        if pa.types.is_list(array.type):
+            inner = array.flatten()
+            bases = np.repeat(bases, np.diff(array.offsets.to_numpy()))
+            return rebase_list(array, pa.array(self.lookup(inner.to_numpy(), bases)))
+        return pa.array(self.lookup(array.to_numpy(), bases))
+
+    def lookup(self, local_ids, bases):
+        return self.global_ids[np.where(local_ids >= 0, bases + local_ids, len(self.global_ids) - 1)]
+
+    def to_mixes(self, table, offsets):
+        """
+        Returns every mix of a gathered batch as a dictionary of lists, shaped like a mix of `combine_dicts`.
+        Each column is converted to Python once per batch, which is far cheaper than converting every mix's slice on its own.
+        """
+        # The converted lists hold no reference cycles, but creating millions of them would trigger a full collection over and over
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            columns = {column: table.column(column).to_pylist() for column in table.column_names}
+        finally:
+            if collecting:
+                gc.enable()
+        mixes = []
+        for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            mix = {column: values[start:stop] for column, values in columns.items()}
+            if self.value_table is not None:
+                # Shared by every mix, `create_graph` only compares the IDs
+                mix["value_table"] = self.value_table.values
+            mixes.append(mix)
+        return mixes
+
+    def mix(self, rows=None):
+        """
+        Returns a single mix of the given store rows, or of `mix_size` random rows.
+        """
+        rows = self.sample_rows(1) if rows is None else [rows]
+        return self.to_mixes(*self.take_batch(rows))[0]
+
+    def batches(self, num_mixes=None, batch_size=64, arrow=False):
+        """
+        Generates batches of random mixes, each a list of `batch_size` mix dictionaries (the last one may be smaller).
+
+        :param num_mixes: Total number of mixes to draw, endless when `None`
+        :param batch_size: Number of mixes gathered at once
+        :param arrow: Yields the `(table, offsets)` of `take_batch` instead, skipping the conversion to Python lists
+        """
+        drawn = 0
+        while num_mixes is None or drawn < num_mixes:
+            count = batch_size if num_mixes is None else min(batch_size, num_mixes - drawn)
+            batch = self.take_batch(self.sample_rows(count))
+            yield batch if arrow else self.to_mixes(*batch)
+            drawn += count
+
+    def __len__(self):
+        return self.num_rows
+
+    def __repr__(self):
+        return f"MixSampler(rows={self.num_rows}, mix_size={self.mix_size}, columns={self.columns})"
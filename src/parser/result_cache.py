@@ -0,0 +1,226 @@
+import time
+import pickle
+import random
+import sqlite3
+import importlib
+from pathlib import Path
+import xxhash
+from instrumentation import instrumentation
+
+# Modules whose source decides the output of `process_chain`, and additionally of grouping a mix (including this module, which assembles the grouped result)
+PROCESSOR_MODULES = ("parser.calc_math_qa_parser", "parser.calculation", "parser.vocabulary", "parser.evaluation_cache", "parser.arithmetic_evaluator", "parser.value_table")
+RULE_MODULES = ("structures.graph_structures", "logic.graph_rules", "logic.chain_renderer", "parser.result_cache")
+LEVELS = ("chain", "mix")
+
+def code_version(modules):
+    """
+    Returns an xxhash of the source files of `modules`, so any edit to the processing or grouping code changes the version of its cached results.
+    """
+    digest = xxhash.xxh3_64()
+    for name in modules:
+        digest.update(name.encode())
+        digest.update(Path(importlib.import_module(name).__file__).read_bytes())
+    return digest.hexdigest()
+
+class ResultCache():
+    """
+    Persistent content-addressed cache of processed chains and grouped mixes in a single SQLite file, shared by every process and run using the same path.
+    - `chain`: `process_chain` output keyed by an xxhash of the chain text and the processor's vocabulary (see `Calc_Math_QA_Processer.vocabulary_key`)
+    - `mix`: `group_mix` output keyed by the sorted sample IDs, the shuffle seed and the graph options, or `group_sampled_mix` output keyed by the sample ID and position of every calculation
+
+    Each level is versioned by the source of the code producing it (`PROCESSOR_MODULES`, plus `RULE_MODULES` for mixes) and `version`. Results of any other version are never returned and are deleted when the cache is opened.
+    Once the stored results exceed `max_bytes`, the least recently used are evicted down to `evict_to` of the limit.
+
+    :param path: SQLite file, e.g. `./data/results.sqlite`
+    :param max_bytes: Size limit of the pickled results
+    :param version: Extra version string, changing it invalidates every cached result
+    :param evict_to: Fraction of `max_bytes` kept after an eviction, so evictions are not repeated on every write
+    """
+    def __init__(self, path, max_bytes=2**30, version="", evict_to=0.9):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.version = version
+        self.evict_to = evict_to
+        self.versions = {
+            "chain": f"{code_version(PROCESSOR_MODULES)}:{version}",
+            "mix": f"{code_version(PROCESSOR_MODULES + RULE_MODULES)}:{version}",
+        }
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connection = None
+        self.written = 0 # Bytes written since the size was last checked
+        self.connect()
+        self.connection.execute("DELETE FROM results WHERE " + " OR ".join("(level = ? AND version != ?)" for _ in LEVELS), [value for level in LEVELS for value in (level, self.versions[level])])
+
+    def connect(self):
+        if self.connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Autocommit with write-ahead logging, so pool workers read while another one writes
+            self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, level TEXT NOT NULL, version TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        return self.connection
+
+    def key(self, level, *parts):
+        digest = xxhash.xxh3_128()
+        digest.update(f"{level}\0{self.versions[level]}".encode())
+        for part in parts:
+            digest.update(b"\0")
+            digest.update(part.encode() if isinstance(part, str) else part)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached result of `key`, or `None` when it is not cached.
+        """
+        row = self.connect().execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            if instrumentation.enabled:
+                instrumentation.count("result_cache.misses")
+            return None
+        self.hits += 1
+        if instrumentation.enabled:
+            instrumentation.count("result_cache.hits")
+        self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, level, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.connect().execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", (key, level, self.versions[level], data, len(data), time.time()))
+        self.written += len(data)
+        # Summing the sizes scans the table, so it is only checked after writing a slice of the limit
+        if self.written > self.max_bytes * (1 - self.evict_to) / 4:
+            self.enforce_limit()
+
+    def enforce_limit(self):
+        """
+        Evicts the least recently used results until they fit `evict_to` of `max_bytes`, when they exceed `max_bytes`.
+        """
+        self.written = 0
+        connection = self.connect()
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * self.evict_to
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+        if instrumentation.enabled:
+            instrumentation.count("result_cache.evictions", len(evicted))
+
+    def process_chain(self, processor, chain):
+        """
+        Returns `processor.process_chain({"chain": chain})`, processing the chain only when it is not cached for the processor's vocabulary.
+        On a hit the vocabulary still learns the chain's special functions, so later chains are processed (and keyed) as without the cache.
+        """
+        key = self.key("chain", processor.vocabulary_key(), chain)
+        sample = self.get(key)
+        if sample is not None:
+            processor.update_special_func(sample["full_equations"])
+            return sample
+        sample = processor.process_calculations(**processor.extract_formatted(chain))
+        self.put("chain", key, sample)
+        return sample
+
+    def group_mix(self, samples, seed=0, match_values=False):
+        """
+        Combines processed samples with `combine_dicts` shuffled by `seed` and groups them, reusing the result of any earlier run on the same samples and seed. The samples are combined in the order of their `id`, so the order they are given in does not matter.
+        Returns the following:
+        - `sample_ids`: The sorted sample IDs
+        - `full_equations`: Each calculation of the shuffled mix, by node indice
+        - `num_edges`: Number of edges of `create_graph`
+        - `groups`, `orderings`: Output of `classify_groups` and `sort_groups`
+        - `reverse_adjacency`: The producers of each node, by node indice
+        - `chains`: Each chain of `chain_groups` as a `chain_record`
+        """
+        from .calc_math_qa_parser import combine_dicts
+
+        samples = sorted(samples, key=lambda sample: str(sample["id"]))
+        sample_ids = [str(sample["id"]) for sample in samples]
+        key = self.key("mix", "\0".join(sample_ids), str(seed), str(bool(match_values)))
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        # The shuffle draws from its own generator, leaving the global one untouched
+        state = random.getstate()
+        random.seed(seed)
+        try:
+            combined_dict = combine_dicts(samples)
+        finally:
+            random.setstate(state)
+        result = group_combined(combined_dict, sample_ids, match_values)
+        self.put("mix", key, result)
+        return result
+
+    def group_sampled_mix(self, mix, match_values=False):
+        """
+        Groups a mix already combined and shuffled, e.g. by `MixSampler.to_mixes`, reusing the result of any earlier run on the same calculations in the same order.
+        The mix is keyed by the `source_ids` and `source_positions` of its calculations, so the store it was sampled from needs an `id` column.
+        Returns the fields of `group_mix`, with the sample IDs in order of first appearance.
+        """
+        calculations = "\0".join(f"{sample_id}:{position}" for sample_id, position in zip(mix["source_ids"], mix["source_positions"]))
+        key = self.key("mix", "sampled", calculations, str(bool(match_values)))
+        result = self.get(key)
+        if result is not None:
+            return result
+        result = group_combined(mix, [str(sample_id) for sample_id in dict.fromkeys(mix["source_ids"])], match_values)
+        self.put("mix", key, result)
+        return result
+
+    def stats(self):
+        rows = self.connect().execute("SELECT level, COUNT(*), COALESCE(SUM(size), 0) FROM results GROUP BY level").fetchall()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "entries": {level: count for level, count, _ in rows},
+            "bytes": sum(size for _, _, size in rows),
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __getstate__(self):
+        # An open connection cannot be sent to pool workers, each reconnects on first use
+        state = self.__dict__.copy()
+        state["connection"] = None
+        return state
+
+    def __repr__(self):
+        return f"ResultCache({str(self.path)!r}, max_bytes={self.max_bytes})"
+
+def group_combined(combined_dict, sample_ids, match_values=False):
+    """
+    Runs `create_graph` -> `classify_groups` -> `sort_groups` -> `chain_groups` on a combined mix. Returns the cached fields of `ResultCache.group_mix`.
+    """
+    from structures import create_graph
+    from logic import classify_groups, sort_groups, chain_groups, chain_record
+
+    adjacency_list = create_graph(combined_dict, match_values=match_values)
+    all_groups, reverse_adjacency = classify_groups(adjacency_list)
+    orderings = sort_groups(all_groups, adjacency_list, reverse_adjacency)
+    chains = chain_groups(all_groups, adjacency_list, reverse_adjacency)
+    return {
+        "sample_ids": sample_ids,
+        "full_equations": combined_dict["full_equations"],
+        "num_edges": sum(len(node.get_neighbors_indices()) for node in adjacency_list.get_nodes()),
+        "groups": all_groups,
+        "orderings": orderings,
+        "reverse_adjacency": [reverse_adjacency[node] for node in range(len(adjacency_list))],
+        "chains": [chain_record(chain, adjacency_list) for chain in chains],
+    }
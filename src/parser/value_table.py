@@ -0,0 +1,96 @@
+import math
+
+# The dataset reports irrational results rounded to 6 decimals (e.g. `16*pi = around 50.265482`)
+DECIMALS = 6
+# Above this magnitude values are keyed by their leading significant digits instead
+LARGE_VALUE = 1e9
+SIGNIFICANT_DIGITS = 12
+
+# Columns holding IDs into a sample's `value_table`, rewritten to the mix's table by `combine_dicts` (`-1` for non-numbers)
+VALUE_ID_COLUMNS = ("solution_ids", "operand_ids", "main_operand_ids", "sub_expression_result_ids")
+
+class ValueTable():
+    """
+    Interns numbers into integer value IDs by a tolerance-aware quantized key, so equal values written differently (`5` vs `5.0`, `0.03` vs `0.0300000000000000`, `25.132741` vs `25.1327412287183`) share one ID.
+    Values are quantized to `decimals` decimal places, and a value falling just across a bucket boundary reuses the neighboring bucket's ID when within `tolerance`.
+    - `values`: Value ID -> the first value interned under it
+    - `ids`: Key of `key` -> value ID
+    Text that is not a number (e.g. `pi`) gets the ID `-1`.
+    """
+    def __init__(self, decimals=DECIMALS):
+        self.scale = 10 ** decimals
+        self.tolerance = 1 / self.scale
+        self.values = []
+        self.ids = {}
+
+    def key(self, value):
+        # Tagged, as a quantized integer and a large value's float can be equal (`1000` quantizes to `1e9`)
+        if abs(value) < LARGE_VALUE:
+            return ("quantized", round(value * self.scale))
+        return ("significant", float(f"{value:.{SIGNIFICANT_DIGITS}g}"))
+
+    def intern(self, text):
+        """
+        Returns the value ID of a number's text, adding it to the table when new.
+        """
+        try:
+            value = float(text)
+        except (TypeError, ValueError):
+            return -1
+        return self.intern_value(value)
+
+    def intern_value(self, value):
+        if not math.isfinite(value):
+            return -1
+        key, value_id = self.find(value)
+        if value_id is not None:
+            # Remember the neighboring bucket's ID under this key too
+            self.ids[key] = value_id
+            return value_id
+
+        value_id = len(self.values)
+        self.values.append(value)
+        self.ids[key] = value_id
+        return value_id
+
+    def lookup(self, text):
+        """
+        Returns the value ID of a number's text without adding it, `-1` when the value is not in the table.
+        """
+        try:
+            value = float(text)
+        except (TypeError, ValueError):
+            return -1
+        if not math.isfinite(value):
+            return -1
+        value_id = self.find(value)[1]
+        return value_id if value_id is not None else -1
+
+    def find(self, value):
+        key = self.key(value)
+        value_id = self.ids.get(key)
+        kind, bucket = key
+        if value_id is None and kind == "quantized":
+            for neighbor in (bucket-1, bucket+1):
+                neighbor_id = self.ids.get((kind, neighbor))
+                if neighbor_id is not None and abs(self.values[neighbor_id] - value) <= self.tolerance:
+                    return key, neighbor_id
+        return key, value_id
+
+    def remap(self, sample_values):
+        """
+        Interns the values of another table (e.g. a sample's `value_table`) and returns the ID each of its IDs maps to.
+        """
+        return [self.intern_value(value) for value in sample_values]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f"ValueTable(size={len(self.values)})"
+
+def remap_ids(ids, mapping):
+    """
+    Rewrites a (nested) list of value IDs through `mapping`, keeping `-1` for non-numbers.
+    """
+    return [remap_ids(value_id, mapping) if isinstance(value_id, list) else (mapping[value_id] if value_id >= 0 else -1) for value_id in ids]
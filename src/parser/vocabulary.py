@@ -0,0 +1,82 @@
+import re
+
+NUMBER_PATTERN = r"-?\d*\.?\d+"
+SYMBOL_OPERATOR_PATTERN = r"\*\*|[-+/*%]"
+CALLED_NAME_PATTERN = re.compile(r"[a-zA-Z]+(?=\()")
+
+def trie_pattern(words):
+    """
+    Builds a single regex alternation of `words` ordered as a trie so that shared prefixes are matched once and the longest word wins (e.g. `exp` over `e`).
+    """
+    trie = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if "" in node:
+            return f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+def vocabulary_order(words):
+    # Longest first so a name is handled before the names it contains, then alphabetical for a deterministic order
+    return tuple(sorted(words, key=lambda word: (-len(word), word)))
+
+class VocabularyMatchers():
+    """
+    Compiled matchers for a snapshot of the special functions and variables. `Calc_Math_QA_Processer` rebuilds them only when its vocabulary version changes, so the per-row cost stays flat as the vocabulary grows.
+    - `functions`/`variables`: The vocabulary in its deterministic processing order
+    - `operand_pattern`: Numbers and special variables (e.g. `-3.5`, `pi`)
+    - `operator_pattern`: Special functions and the symbol operators `[-+/*%**]`
+    - `function_search`/`variable_search`: Whether any function/variable occurs within a string
+    - `function_calls`: Per-function pattern matching a call, e.g. `sqrt\\((.*?)\\)`
+    - `variable_patterns`: Per-variable pattern for substituting its value
+    """
+    def __init__(self, special_func, special_var, version=0):
+        self.version = version
+        self.functions = vocabulary_order(special_func)
+        self.variables = vocabulary_order(special_var)
+        self.function_ranks = {func: rank for rank, func in enumerate(self.functions)}
+        # Names found by `update_special_func` are letters only, allowing candidates to be read off the called names
+        self.alphabetic_functions = all(func.isalpha() and func.isascii() for func in self.functions)
+
+        function_alternation = trie_pattern(self.functions)
+        variable_alternation = trie_pattern(self.variables)
+
+        self.operand_pattern = re.compile(f"{NUMBER_PATTERN}|{variable_alternation}" if variable_alternation else NUMBER_PATTERN)
+        self.operator_pattern = re.compile(f"{function_alternation}|{SYMBOL_OPERATOR_PATTERN}" if function_alternation else SYMBOL_OPERATOR_PATTERN)
+        self.function_search = re.compile(function_alternation) if function_alternation else None
+        self.variable_search = re.compile(variable_alternation) if variable_alternation else None
+
+        self.function_calls = {func: re.compile(rf"{re.escape(func)}\((.*?)\)") for func in self.functions}
+        self.variable_patterns = {var: re.compile(re.escape(var)) for var in self.variables}
+
+    def has_function(self, expr):
+        return self.function_search is not None and self.function_search.search(expr) is not None
+
+    def has_variable(self, expr):
+        return self.variable_search is not None and self.variable_search.search(expr) is not None
+
+    def called_functions(self, expr, after_rank=-1):
+        """
+        Returns the functions called within `expr` (including names ending a longer name, e.g. `t` in `sqrt(`) ranked after `after_rank`, in processing order.
+        """
+        if self.alphabetic_functions:
+            candidates = set()
+            for name in CALLED_NAME_PATTERN.findall(expr):
+                for start in range(len(name)):
+                    rank = self.function_ranks.get(name[start:])
+                    if rank is not None and rank > after_rank:
+                        candidates.add(rank)
+            return [self.functions[rank] for rank in sorted(candidates)]
+        return [func for func in self.functions[after_rank+1:] if f"{func}(" in expr]
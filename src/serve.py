@@ -0,0 +1,31 @@
+import os
+import asyncio
+import argparse
+from service import GroupingService
+
+async def serve(args):
+    service = GroupingService(num_workers=args.workers, max_bytes=int(args.max_memory * 2**20), spill_dir=args.spill_dir, idle_timeout=args.idle_timeout)
+    await service.start(socket_path=args.socket, port=args.port, http_port=args.http_port, host=args.host)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Serves incremental grouping sessions over JSON Lines and HTTP")
+    arg_parser.add_argument("--socket", help="Unix socket path for JSON Lines requests")
+    arg_parser.add_argument("--port", type=int, help="TCP port for JSON Lines requests")
+    arg_parser.add_argument("--http-port", type=int, help="TCP port for HTTP requests")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of parsing processes, 0 parses on a background thread")
+    arg_parser.add_argument("--max-memory", type=float, default=512, help="Estimated memory in MiB allowed for all sessions")
+    arg_parser.add_argument("--spill-dir", help="Directory for sessions evicted over the memory limit, dropped when not given")
+    arg_parser.add_argument("--idle-timeout", type=float, help="Seconds without requests after which a session is evicted")
+    args = arg_parser.parse_args()
+    if args.socket is None and args.port is None and args.http_port is None:
+        arg_parser.error("Give at least one of --socket, --port and --http-port")
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
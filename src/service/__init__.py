@@ -0,0 +1 @@
+from .grouping_service import GroupingService, Session, parse_calculations, calculation_bytes
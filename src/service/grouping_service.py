@@ -0,0 +1,390 @@
+import os
+import json
+import time
+import pickle
+import asyncio
+import hashlib
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from parser import process_text
+from parser.calc_math_qa_parser import Calc_Math_QA_Processer
+from logic import IncrementalGrouper, chain_groups, chain_record
+
+# Estimated memory of a calculation in an `IncrementalGrouper`, fitted with tracemalloc on synthetic and fixture chains. The index of the expression's short substrings grows with its length
+CALCULATION_BYTES = 4096
+GRAM_BYTES = 48
+
+def calculation_bytes(calculation):
+    return CALCULATION_BYTES + GRAM_BYTES * len(calculation["expressions"])
+
+# Processor of a parsing worker, kept across requests so its evaluation cache is reused. The special functions are the requesting session's
+worker = {}
+
+def start_worker(cache_size=65536):
+    worker["processor"] = Calc_Math_QA_Processer(special_func=set(), special_var=set(), cache_size=cache_size)
+
+def parse_calculations(text, special_func=frozenset()):
+    """
+    Processes raw calculation text, gadget formatted or `expr=result` lines, in a parsing worker with a session's vocabulary, so the output never depends on other sessions' text or on which worker runs it.
+    Returns the following:
+    - `calculations`: One dictionary per calculation for `IncrementalGrouper.add_calculation`
+    - `special_func`: The session's special functions grown by those of the text
+
+    :param text: The calculations to parse
+    :param special_func: The special functions learned from the session's earlier text
+    """
+    if "processor" not in worker:
+        start_worker()
+    processor = worker["processor"]
+    # Only replaced when it differs, as a new vocabulary recompiles the matchers
+    if processor.special_func != special_func:
+        processor.special_func = set(special_func)
+    sample = process_text(text, processor)
+    keys = [key for key in sample.keys() if key != "value_table"]
+    return {
+        "calculations": [{key: sample[key][i] for key in keys} for i in range(len(sample["full_equations"]))],
+        "special_func": frozenset(processor.special_func),
+    }
+
+class Session():
+    """
+    Grouping state of one user. Requests to a session run one at a time under its `lock`, in the order they arrive.
+    - `grouper`: The session's `IncrementalGrouper`
+    - `nbytes`: Estimated memory of the grouper (see `calculation_bytes`)
+    - `special_func`: Special functions learned from the session's text, the vocabulary its calculations are parsed with
+    """
+    def __init__(self, session_id, grouper=None, nbytes=0, special_func=frozenset()):
+        self.session_id = session_id
+        self.grouper = grouper if grouper is not None else IncrementalGrouper()
+        self.nbytes = nbytes
+        self.special_func = special_func
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def state(self):
+        """
+        Returns the groups, their calculation orders and chains of the session.
+        """
+        grouper = self.grouper
+        all_groups = grouper.get_groups()
+        chains = chain_groups(all_groups, grouper.adjacency_list, grouper.reverse_adjacency)
+        return {
+            "session": self.session_id,
+            "calculations": len(grouper),
+            "groups": all_groups,
+            "orderings": grouper.get_orderings(),
+            "chains": [chain_record(chain, grouper.adjacency_list) for chain in chains],
+        }
+
+class GroupingService():
+    """
+    Asyncio service keeping one incremental grouping session per user. Parsing runs in a pool of worker processes, so the event loop never waits on Sympy, while linking a parsed calculation into its session runs on the loop.
+    The estimated memory of all sessions is capped by `max_bytes`. Once over the cap, the least recently used idle sessions are spilled to `spill_dir` (about 10 times smaller pickled) and loaded back on their next request, or dropped when there is no `spill_dir`.
+    Sessions idle for longer than `idle_timeout` seconds are spilled the same way.
+    Requests are dictionaries, over the JSON Lines socket or the HTTP endpoint alike:
+    - `{"op": "add", "session": "user-1", "text": "100/2=50"}`: Adds calculations, gadget formatted or `expr=result` lines, and returns their node indices and groups
+    - `{"op": "groups", "session": "user-1"}`: Returns the session's groups, orderings and chains
+    - `{"op": "delete", "session": "user-1"}`: Removes the session
+    - `{"op": "stats"}`: Returns the session counts, estimated memory and eviction counters
+
+    :param num_workers: Number of parsing processes, `0` parses on a single background thread instead
+    :param max_bytes: Estimated memory allowed for all sessions together
+    :param spill_dir: Directory for spilled sessions, `None` drops evicted sessions
+    :param idle_timeout: Seconds without requests after which a session is spilled, `None` keeps idle sessions until the memory cap is reached
+    """
+    def __init__(self, num_workers=os.cpu_count(), max_bytes=512 * 2**20, spill_dir=None, idle_timeout=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.idle_timeout = idle_timeout
+        self.executor = ProcessPoolExecutor(num_workers, initializer=start_worker) if num_workers else ThreadPoolExecutor(1, initializer=start_worker)
+
+        self.sessions = OrderedDict() # Session ID -> `Session`, least recently used first
+        self.spilled = {} # Session ID -> spill file
+        self.loading = {} # Session ID -> future of a session being loaded back or spilled
+        self.nbytes = 0
+        self.counters = {"requests": 0, "calculations": 0, "evictions": 0, "spills": 0, "reloads": 0}
+        self.servers = []
+        self.connections = {} # Open connection writer -> its handler task
+        self.idle_task = None
+
+    async def session(self, session_id, create=True):
+        """
+        Returns the session in memory, loading it back from its spill file or creating it when needed. Returns `None` for an unknown session when `create` is false.
+        """
+        while session_id in self.loading:
+            await asyncio.shield(self.loading[session_id])
+
+        session = self.sessions.get(session_id)
+        if session is None:
+            if session_id in self.spilled:
+                future = asyncio.get_running_loop().create_future()
+                self.loading[session_id] = future
+                try:
+                    session = await asyncio.to_thread(self.read_spill, session_id)
+                    self.counters["reloads"] += 1
+                finally:
+                    del self.loading[session_id]
+                    future.set_result(None)
+            elif create:
+                session = Session(session_id)
+            else:
+                return None
+            self.sessions[session_id] = session
+            self.nbytes += session.nbytes
+
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    async def locked_session(self, session_id, create=True):
+        """
+        Returns the session like `session` with its lock held, so the caller must release it. A session deleted or evicted while waiting for the lock is looked up again.
+        """
+        while True:
+            session = await self.session(session_id, create)
+            if session is None:
+                return None
+            await session.lock.acquire()
+            if self.sessions.get(session_id) is session:
+                return session
+            session.lock.release()
+
+    async def add(self, session_id, text):
+        session = await self.locked_session(session_id)
+        try:
+            parsed = await asyncio.get_running_loop().run_in_executor(self.executor, parse_calculations, text, session.special_func)
+            calculations = parsed["calculations"]
+            session.special_func = parsed["special_func"]
+            nodes = [session.grouper.add_calculation(calculation) for calculation in calculations]
+            added = sum(calculation_bytes(calculation) for calculation in calculations)
+            session.nbytes += added
+            self.nbytes += added
+            groups = [session.grouper.get_group(node) for node in nodes]
+            session.last_used = time.monotonic()
+        finally:
+            session.lock.release()
+        self.counters["calculations"] += len(calculations)
+        await self.enforce_limit()
+        return {"session": session_id, "nodes": nodes, "groups": groups}
+
+    async def groups(self, session_id):
+        session = await self.locked_session(session_id, create=False)
+        if session is None:
+            return {"session": session_id, "calculations": 0, "groups": [], "orderings": [], "chains": []}
+        try:
+            state = session.state()
+        finally:
+            session.lock.release()
+        # Loading a spilled session back can exceed the cap as much as adding to one
+        await self.enforce_limit()
+        return state
+
+    async def delete(self, session_id):
+        while session_id in self.loading:
+            await asyncio.shield(self.loading[session_id])
+        # Waits for the requests in progress, an `add` finishing after the session is removed would count its memory for good
+        session = await self.locked_session(session_id, create=False) if session_id in self.sessions else None
+        if session is not None:
+            del self.sessions[session_id]
+            self.nbytes -= session.nbytes
+            session.lock.release()
+        path = self.spilled.pop(session_id, None)
+        if path is not None:
+            path.unlink(missing_ok=True)
+        return {"session": session_id, "deleted": session is not None or path is not None}
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "spilled_sessions": len(self.spilled),
+            "estimated_bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            **self.counters,
+        }
+
+    async def enforce_limit(self):
+        """
+        Evicts the least recently used idle sessions until the estimated memory is within `max_bytes`. Sessions with a request in progress are never evicted, so the cap can be exceeded while every session is busy.
+        """
+        while self.nbytes > self.max_bytes:
+            session = next((session for session in self.sessions.values() if not session.lock.locked()), None)
+            if session is None:
+                return
+            await self.evict(session)
+
+    async def evict(self, session):
+        """
+        Removes an idle session from memory, spilling it to `spill_dir` when there is one. The session's lock is held until the file is written, so a request that looked the session up before it was removed never changes the grouper while it is pickled.
+        """
+        session_id = session.session_id
+        await session.lock.acquire()
+        try:
+            del self.sessions[session_id]
+            self.nbytes -= session.nbytes
+            if self.spill_dir is None:
+                self.counters["evictions"] += 1
+                return
+
+            # Requests arriving while the file is written wait for it before loading the session back
+            future = asyncio.get_running_loop().create_future()
+            self.loading[session_id] = future
+            try:
+                self.spilled[session_id] = await asyncio.to_thread(self.write_spill, session)
+                self.counters["spills"] += 1
+            finally:
+                del self.loading[session_id]
+                future.set_result(None)
+        finally:
+            session.lock.release()
+
+    def spill_path(self, session_id):
+        # Session IDs come from users, the file is named by their hash
+        return self.spill_dir / f"{hashlib.sha1(session_id.encode()).hexdigest()}.pickle"
+
+    def write_spill(self, session):
+        path = self.spill_path(session.session_id)
+        temporary = path.with_suffix(".tmp")
+        with open(temporary, "wb") as f:
+            pickle.dump((session.grouper, session.nbytes, session.special_func), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        return path
+
+    def read_spill(self, session_id):
+        path = self.spilled.pop(session_id)
+        with open(path, "rb") as f:
+            grouper, nbytes, special_func = pickle.load(f)
+        path.unlink(missing_ok=True)
+        return Session(session_id, grouper, nbytes, special_func)
+
+    async def evict_idle(self):
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            for session in list(self.sessions.values()):
+                # Checked again before every eviction, a session can get a request while an earlier one is spilled
+                if self.sessions.get(session.session_id) is session and not session.lock.locked() and time.monotonic() - session.last_used > self.idle_timeout:
+                    await self.evict(session)
+
+    async def dispatch(self, request):
+        """
+        Runs one request dictionary (see the class docstring) and returns the response dictionary, `{"error": "..."}` when it fails.
+        """
+        self.counters["requests"] += 1
+        try:
+            op = request.get("op")
+            if op == "stats":
+                return self.stats()
+            session_id = request.get("session")
+            if not isinstance(session_id, str) or not session_id:
+                return {"error": "Missing the session of the request"}
+            if op == "add":
+                if not isinstance(request.get("text"), str):
+                    return {"error": "Missing the calculation text of the request"}
+                return await self.add(session_id, request["text"])
+            if op == "groups":
+                return await self.groups(session_id)
+            if op == "delete":
+                return await self.delete(session_id)
+            return {"error": f"Unknown op {op!r}, expected one of add, groups, delete, stats"}
+        except Exception as error:
+            # A calculation failing to parse only fails its own request
+            return {"error": f"{type(error).__name__}: {error}"}
+
+    async def handle_json_lines(self, reader, writer):
+        """
+        Serves one connection speaking JSON Lines, a request object per line answered by a response object per line.
+        """
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as error:
+                    response = {"error": f"Invalid JSON: {error}"}
+                else:
+                    response = await self.dispatch(request) if isinstance(request, dict) else {"error": "Requests must be JSON objects"}
+                writer.write(f"{json.dumps(response)}\n".encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        """
+        Serves one HTTP/1.1 connection:
+        - `POST /sessions/<id>/calculations` with the calculation text as the body: `add`
+        - `GET /sessions/<id>`: `groups`
+        - `DELETE /sessions/<id>`: `delete`
+        - `GET /stats`: `stats`
+        """
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while request_line := await reader.readline():
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                headers = {}
+                while (header := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                path = [part for part in target.split("?")[0].split("/") if part]
+                if method == "GET" and path == ["stats"]:
+                    request = {"op": "stats"}
+                elif len(path) == 2 and path[0] == "sessions" and method in ("GET", "DELETE"):
+                    request = {"op": "groups" if method == "GET" else "delete", "session": path[1]}
+                elif len(path) == 3 and path[0] == "sessions" and path[2] == "calculations" and method == "POST":
+                    request = {"op": "add", "session": path[1], "text": body.decode()}
+                else:
+                    request = None
+
+                response = await self.dispatch(request) if request is not None else {"error": f"No route for {method} {target}"}
+                status = "404 Not Found" if request is None else "400 Bad Request" if "error" in response else "200 OK"
+                payload = json.dumps(response).encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def start(self, socket_path=None, port=None, http_port=None, host="127.0.0.1"):
+        """
+        Starts listening for JSON Lines on a Unix socket and/or TCP `port`, and for HTTP on `http_port`. Returns the servers.
+        """
+        if socket_path is not None:
+            self.servers.append(await asyncio.start_unix_server(self.handle_json_lines, path=socket_path))
+        if port is not None:
+            self.servers.append(await asyncio.start_server(self.handle_json_lines, host, port))
+        if http_port is not None:
+            self.servers.append(await asyncio.start_server(self.handle_http, host, http_port))
+        if self.idle_timeout is not None and self.idle_task is None:
+            self.idle_task = asyncio.create_task(self.evict_idle())
+        return self.servers
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+        # Closing a connection ends its handler at the next read, after the request in progress is answered
+        connections = list(self.connections.items())
+        for writer, _ in connections:
+            writer.close()
+        await asyncio.gather(*[task for _, task in connections], return_exceptions=True)
+        if self.idle_task is not None:
+            self.idle_task.cancel()
+            self.idle_task = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
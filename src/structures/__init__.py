@@ -1 +1,14 @@
-from .graph_structures import create_graph
\ No newline at end of file
+import importlib
+from .graph_structures import create_graph
+
+# The array-backed graph needs NumPy, imported on first use so grouping a handful of calculations starts without it
+LAZY_EXPORTS = {
+    "create_csr_graph": ".csr_graph",
+    "CSRGraph": ".csr_graph",
+    "create_arrow_graph": ".arrow_graph",
+}
+
+def __getattr__(name):
+    if name in LAZY_EXPORTS:
+        return getattr(importlib.import_module(LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
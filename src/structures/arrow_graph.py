@@ -0,0 +1,117 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from instrumentation import instrumentation, instrumented
+from .graph_structures import ExpressionText
+from .csr_graph import CSRGraph
+
+def column(table, name):
+    chunked = table.column(name)
+    return chunked.combine_chunks() if chunked.num_chunks != 1 else chunked.chunk(0)
+
+def list_nodes(array):
+    """
+    Returns the node of every value of a list column and the values themselves, zero-copy for numeric lists.
+    """
+    lengths = np.diff(array.offsets.to_numpy())
+    return np.repeat(np.arange(len(array)), lengths), array.flatten()
+
+def truthy(array):
+    # `is_single_func` holds the function name (or null) in processed samples, a boolean elsewhere
+    if pa.types.is_boolean(array.type):
+        return array.fill_null(False).to_numpy(zero_copy_only=False)
+    return pc.fill_null(pc.greater(pc.utf8_length(array), 0), False).to_numpy(zero_copy_only=False)
+
+def text_keys(*arrays):
+    """
+    Returns integer keys of string arrays, equal keys for equal strings across all of them.
+    """
+    encoded = pc.dictionary_encode(pa.concat_arrays([array.cast(pa.string()) for array in arrays])).indices.to_numpy(zero_copy_only=False)
+    splits = np.cumsum([len(array) for array in arrays])[:-1]
+    return np.split(encoded.astype(np.int64), splits)
+
+def value_keys(*arrays):
+    """
+    Returns integer keys of float arrays, equal keys for equal numbers and `-1` for NaN.
+    """
+    values = np.concatenate(arrays)
+    keys = np.full(len(values), -1, dtype=np.int64)
+    numbers = ~np.isnan(values)
+    keys[numbers] = np.unique(values[numbers], return_inverse=True)[1]
+    return np.split(keys, np.cumsum([len(array) for array in arrays])[:-1])
+
+def join_pairs(left_nodes, left_keys, right_nodes, right_keys, num_nodes):
+    """
+    Returns the sorted, distinct pairs `i * num_nodes + j` of every left node `i` and right node `j` sharing a key, ignoring negative keys.
+    """
+    left = left_keys >= 0
+    left_nodes, left_keys = left_nodes[left], left_keys[left]
+    order = np.argsort(right_keys, kind="stable")
+    sorted_keys, sorted_nodes = right_keys[order], right_nodes[order]
+    starts = np.searchsorted(sorted_keys, left_keys, side="left")
+    counts = np.searchsorted(sorted_keys, left_keys, side="right") - starts
+    total = int(counts.sum())
+    matched = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+    return np.unique(np.repeat(left_nodes, counts).astype(np.int64) * num_nodes + sorted_nodes[matched])
+
+@instrumented()
+def create_arrow_graph(table, match_values=False):
+    """
+    Builds the same graph as `create_graph` from a `pyarrow.Table` with one row per calculation (e.g. a mix of `MixSampler.take_batch`), joining the list columns with NumPy sorts instead of converting the rows to Python.
+    Only `expressions` (for the substring rule of single function nodes) and `full_equations` (the node values) are converted to Python strings.
+    Value IDs must be shared by the whole table, as `MixSampler` rewrites them, since the IDs of a `FeatureStore` row are local to its sample.
+
+    :param table: Calculations with the columns of `create_graph`, `solution_values` and `sub_expression_result_values` for the string rules
+    :param match_values: Joins on the value IDs (`ValueIndex`) instead of the solution strings (`SolutionIndex`)
+    """
+    num_nodes = table.num_rows
+    nodes = np.arange(num_nodes)
+    expressions = column(table, "expressions").to_pylist()
+    is_single_func = truthy(column(table, "is_single_func"))
+    has_sub_expressions = column(table, "has_sub_expressions").fill_null(False).to_numpy(zero_copy_only=False)
+    solutions = column(table, "solutions")
+
+    if match_values:
+        operand_nodes, operand_ids = list_nodes(column(table, "operand_ids"))
+        main_nodes, main_ids = list_nodes(column(table, "main_operand_ids"))
+        sub_nodes, sub_ids = list_nodes(column(table, "sub_expression_result_ids"))
+        solution_ids = column(table, "solution_ids").to_numpy(zero_copy_only=False).astype(np.int64)
+        operand_ids, main_ids, sub_ids = (ids.to_numpy(zero_copy_only=False).astype(np.int64) for ids in (operand_ids, main_ids, sub_ids))
+        solution_keys = value_solution_keys = solution_ids
+        # Solutions that are not numbers are still compared by their text
+        text = text_keys(solutions)[0] + int(solution_ids.max(initial=-1)) + 1
+        redefined_keys = np.where(solution_ids >= 0, solution_ids, text)
+        needles = [[expressions[i]] for i in range(num_nodes)]
+    else:
+        operand_nodes, operands = list_nodes(column(table, "operands"))
+        main_nodes, main_operands = list_nodes(column(table, "main_operands"))
+        solution_keys, operand_ids, main_ids = text_keys(solutions, operands, main_operands)
+        sub_nodes, sub_values = list_nodes(column(table, "sub_expression_result_values"))
+        solution_values = column(table, "solution_values").to_numpy(zero_copy_only=False).astype(np.float64)
+        value_solution_keys, sub_ids = value_keys(solution_values, sub_values.to_numpy(zero_copy_only=False).astype(np.float64))
+        redefined_keys = solution_keys
+        solution_texts = solutions.to_pylist()
+        needles = [[expressions[i], solution_texts[i]] for i in range(num_nodes)]
+
+    # 1. The solution is an operand of `j`: linked only if it is also a main operand
+    as_operand = join_pairs(nodes, solution_keys, operand_nodes, operand_ids, num_nodes)
+    edges = np.intersect1d(as_operand, join_pairs(nodes, solution_keys, main_nodes, main_ids, num_nodes), assume_unique=True)
+
+    # 2. Otherwise, a single function is linked to the expressions containing its expression (or solution)
+    single_funcs = np.flatnonzero(is_single_func).tolist()
+    expression_text = ExpressionText(expressions, [needle for i in single_funcs for needle in needles[i]])
+    in_expression = [i * num_nodes + j for i in single_funcs for j in set().union(*(expression_text.containing(needle) for needle in needles[i]))]
+    edges = np.union1d(edges, np.setdiff1d(np.asarray(in_expression, dtype=np.int64), as_operand, assume_unique=True))
+
+    # 3. Otherwise, linked if the solution equals one of the sub-expression results of `j`
+    value_nodes = np.flatnonzero(~is_single_func)
+    with_sub_expressions = has_sub_expressions[sub_nodes]
+    in_sub_expressions = join_pairs(value_nodes, value_solution_keys[value_nodes], sub_nodes[with_sub_expressions], sub_ids[with_sub_expressions], num_nodes)
+    edges = np.union1d(edges, np.setdiff1d(in_sub_expressions, as_operand, assume_unique=True))
+
+    # If a number is redefined, ignore the case
+    edges = np.setdiff1d(edges, join_pairs(nodes, redefined_keys, nodes, redefined_keys, num_nodes), assume_unique=True)
+    sources, targets = np.divmod(edges, max(num_nodes, 1))
+    if instrumentation.enabled:
+        instrumentation.count("create_graph.edges", len(edges))
+    return CSRGraph(num_nodes, sources, targets, vals=column(table, "full_equations").to_pylist())
@@ -0,0 +1,171 @@
+import numpy as np
+from instrumentation import instrumentation, instrumented
+from .graph_structures import AdjacencyList, SolutionIndex, ValueIndex
+
+class CSRGraph():
+    """
+    Compressed sparse row graph for large mixes. Forward and reverse edges are stored as NumPy offset/indice arrays (~8 bytes per edge plus 16 per node) instead of a `Node` object and neighbor dict per calculation.
+    Supports the read side of the `AdjacencyList` API (`get_node`, `get_nodes`, `len`, `repr`) through lightweight `NodeView`s, so the `logic` functions work on it unchanged.
+    - `indptr`/`indices`: Neighbors of node `i` are `indices[indptr[i]:indptr[i+1]]`
+    - `rev_indptr`/`rev_indices`: Parents of node `i` are `rev_indices[rev_indptr[i]:rev_indptr[i+1]]`
+    - `weights`: Edge weights aligned with `indices`, `None` when every edge weighs 1.0
+    - `vals`: Node values (e.g. the full equations)
+    """
+    def __init__(self, num_nodes, sources, targets, weights=None, vals=None):
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        weights = None if weights is None else np.asarray(weights, dtype=np.float32)
+        indice_type = np.int32 if num_nodes < 2**31 else np.int64
+
+        # Stable sorts keep the insertion order of each node's neighbors
+        order = np.argsort(sources, kind="stable")
+        self.indptr = offsets(sources, num_nodes)
+        self.indices = targets[order].astype(indice_type)
+        # Unweighted graphs (all `create_graph` edges weigh 1.0) skip storing the weights
+        self.weights = None if weights is None or np.all(weights == 1.0) else weights[order]
+
+        reverse_order = np.argsort(targets, kind="stable")
+        self.rev_indptr = offsets(targets, num_nodes)
+        self.rev_indices = sources[reverse_order].astype(indice_type)
+
+        self.vals = vals if vals is not None else [None] * num_nodes
+
+    @classmethod
+    def from_edges(cls, num_nodes, edges, vals=None):
+        """
+        Bulk constructs the graph from an iterable of `(source, target)` or `(source, target, weight)` edges.
+        """
+        edges = list(edges)
+        sources = [edge[0] for edge in edges]
+        targets = [edge[1] for edge in edges]
+        weights = [edge[2] if len(edge) > 2 else 1.0 for edge in edges]
+        return cls(num_nodes, sources, targets, weights, vals)
+
+    @classmethod
+    def from_adjacency_list(cls, adjacency_list):
+        edges = []
+        for i, node in enumerate(adjacency_list.get_nodes()):
+            for neighbor_indice, edge_weight in node.get_neighbors().items():
+                edges.append((i, neighbor_indice, edge_weight))
+        return cls.from_edges(len(adjacency_list), edges, [node.get_val() for node in adjacency_list.get_nodes()])
+
+    def to_adjacency_list(self):
+        adjacency_list = AdjacencyList()
+        for i in range(len(self)):
+            adjacency_list.add_node(self.vals[i])
+            for neighbor_indice, edge_weight in zip(self.neighbors(i).tolist(), self.edge_weights(i).tolist()):
+                adjacency_list.get_node(i).add_neighbor(neighbor_indice, edge_weight)
+        return adjacency_list
+
+    def neighbors(self, indice):
+        return self.indices[self.indptr[indice]:self.indptr[indice+1]]
+
+    def parents(self, indice):
+        return self.rev_indices[self.rev_indptr[indice]:self.rev_indptr[indice+1]]
+
+    def edge_weights(self, indice):
+        if self.weights is None:
+            return np.ones(self.indptr[indice+1] - self.indptr[indice], dtype=np.float32)
+        return self.weights[self.indptr[indice]:self.indptr[indice+1]]
+
+    def out_degrees(self):
+        return np.diff(self.indptr)
+
+    def in_degrees(self):
+        return np.diff(self.rev_indptr)
+
+    def edge_sources(self):
+        return np.repeat(np.arange(len(self), dtype=self.indices.dtype), self.out_degrees())
+
+    def reverse_adjacency(self):
+        """
+        Returns a read-only mapping of node -> parents, usable wherever the `reverse_adjacency` of `classify_groups` is.
+        """
+        return ReverseAdjacencyView(self)
+
+    def get_node(self, indice):
+        return NodeView(self, indice)
+
+    def get_nodes(self):
+        return [NodeView(self, i) for i in range(len(self))]
+
+    def num_edges(self):
+        return len(self.indices)
+
+    def nbytes(self):
+        weights_nbytes = self.weights.nbytes if self.weights is not None else 0
+        return self.indptr.nbytes + self.indices.nbytes + weights_nbytes + self.rev_indptr.nbytes + self.rev_indices.nbytes
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __repr__(self):
+        return f"{ {i: self.neighbors(i).tolist() for i in range(len(self))} }"
+
+class NodeView():
+    """
+    Read-only `Node` over a row of a `CSRGraph`.
+    """
+    __slots__ = ("graph", "node_indice")
+
+    def __init__(self, graph, indice):
+        self.graph = graph
+        self.node_indice = indice
+
+    def get_node_indice(self):
+        return self.node_indice
+
+    def get_val(self):
+        return self.graph.vals[self.node_indice]
+
+    def get_neighbors(self):
+        return dict(zip(self.graph.neighbors(self.node_indice).tolist(), self.graph.edge_weights(self.node_indice).tolist()))
+
+    def get_neighbors_indices(self):
+        return self.graph.neighbors(self.node_indice).tolist()
+
+    def __repr__(self):
+        return f"{self.get_val()}: {self.get_neighbors()}"
+
+class ReverseAdjacencyView():
+    """
+    Read-only node -> parents mapping over a `CSRGraph`, indexed like a `defaultdict(list)`.
+    """
+    __slots__ = ("graph",)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, indice):
+        return self.graph.parents(indice).tolist()
+
+    def __len__(self):
+        return len(self.graph)
+
+    def items(self):
+        return ((i, self[i]) for i in range(len(self.graph)))
+
+def offsets(keys, num_nodes):
+    """
+    Returns the CSR offsets of the edges grouped by `keys`.
+    """
+    indptr = np.zeros(num_nodes+1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=num_nodes), out=indptr[1:])
+    return indptr
+
+@instrumented()
+def create_csr_graph(sample, match_values=False):
+    """
+    Builds the same graph as `create_graph` directly into a `CSRGraph`, without creating a `Node` per calculation.
+    """
+    sources, targets = [], []
+    with instrumentation.timer("solution_index"):
+        solution_index = ValueIndex(sample) if match_values else SolutionIndex(sample)
+    for i in range(len(sample["full_equations"])):
+        consumers = solution_index.consumers(sample, i)
+        sources.extend([i] * len(consumers))
+        targets.extend(consumers)
+
+    if instrumentation.enabled:
+        instrumentation.count("create_graph.edges", len(targets))
+    return CSRGraph(len(sample["full_equations"]), sources, targets, vals=list(sample["full_equations"]))
@@ -1,3 +1,6 @@
+from collections import defaultdict, deque
+from instrumentation import instrumentation, instrumented
+
 # Based on adjacency list as adjacency matrix would introduce unhelpful overhead
 class Node():
     def __init__(self, indice, val, neighbors=None):
@@ -56,7 +59,215 @@ class AdjacencyList():
             repr[i] = self.get_node(i).get_neighbors_indices()
         return f"{repr}"
             
-def create_graph(sample):
+class ExpressionText():
+    """
+    Finds every expression containing each of a set of needles (e.g. the expressions and solutions of single function nodes) with one Aho-Corasick scan over all expressions, instead of one scan of every expression per needle.
+    Building the automaton is linear in the needles' length and the scan in the expressions' length, so the lookups scale linearly with the number of calculations.
+    - `found`: Needle -> indices of the expressions containing it as a substring
+    """
+    def __init__(self, expressions, needles):
+        self.num_expressions = len(expressions)
+        patterns = sorted({needle for needle in needles if needle})
+        self.found = {needle: set() for needle in patterns}
+        if not patterns:
+            return
+
+        # Trie of the needles: the transitions of each state, and the needles ending at it
+        transitions = [{}]
+        outputs = [[]]
+        for needle in patterns:
+            state = 0
+            for character in needle:
+                next_state = transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(transitions)
+                    transitions[state][character] = next_state
+                    transitions.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(needle)
+
+        # Failure links in breadth-first order, each state also reporting the needles ending at its longest proper suffix
+        failure = [0] * len(transitions)
+        queue = deque(transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in transitions[state].items():
+                queue.append(next_state)
+                fallback = failure[state]
+                while fallback and character not in transitions[fallback]:
+                    fallback = failure[fallback]
+                failure[next_state] = transitions[fallback].get(character, 0)
+                outputs[next_state] = outputs[next_state] + outputs[failure[next_state]]
+
+        for j, expression in enumerate(expressions):
+            state = 0
+            for character in expression:
+                while state and character not in transitions[state]:
+                    state = failure[state]
+                state = transitions[state].get(character, 0)
+                for needle in outputs[state]:
+                    self.found[needle].add(j)
+        if instrumentation.enabled:
+            instrumentation.count("expression_text.states", len(transitions))
+
+    def containing(self, value):
+        """
+        Returns the indices of every expression that contains `value` as a substring, `value` being one of the needles or empty.
+        """
+        if not value:
+            return set(range(self.num_expressions))
+        return self.found[value]
+
+class SolutionIndex():
+    """
+    Maps each value of a processed sample to the nodes that consume it so `create_graph` only matches a solution against its candidate nodes.
+    - `operands`: Value -> nodes with the value in `operands`
+    - `main_operands`: Value -> nodes with the value in `main_operands`
+    - `sub_expression_results`: Float value -> nodes with the value as a sub-expression result
+    - `solutions`: Value -> nodes producing the value, used to skip redefined numbers
+    - `expression_text`: Substring lookup over `expressions` of the expressions and solutions of single function nodes
+    """
+    def __init__(self, sample):
+        self.operands = defaultdict(set)
+        self.main_operands = defaultdict(set)
+        self.sub_expression_results = defaultdict(set)
+        self.solutions = defaultdict(set)
+
+        # Samples from a `FeatureStore` carry the sub-expression results already parsed, NaN where not a number
+        sub_expression_values = sample.get("sub_expression_result_values")
+
+        for j, solution in enumerate(sample["solutions"]):
+            self.solutions[solution].add(j)
+            for operand in sample["operands"][j]:
+                self.operands[operand].add(j)
+            for main_operand in sample["main_operands"][j]:
+                self.main_operands[main_operand].add(j)
+            if sample["has_sub_expressions"][j]:
+                if sub_expression_values is not None:
+                    for value in sub_expression_values[j]:
+                        if value == value:
+                            self.sub_expression_results[value].add(j)
+                    continue
+                for sub_express_result in sample["sub_expression_results"][j]:
+                    value = to_float(sub_express_result)
+                    if value is not None:
+                        self.sub_expression_results[value].add(j)
+
+        single_funcs = [j for j, is_single_func in enumerate(sample["is_single_func"]) if is_single_func]
+        self.expression_text = ExpressionText(sample["expressions"], [sample["expressions"][j] for j in single_funcs] + [sample["solutions"][j] for j in single_funcs])
+
+    def consumers(self, sample, i):
+        """
+        Returns the sorted indices of nodes that consume the solution of node `i`, following the same rules as the pairwise comparison:
+        1. The solution is an operand of `j`: linked only if it is also a main operand
+        2. Otherwise, `i` is a single function: linked if its expression or solution appears within the expression of `j`
+        3. Otherwise, linked if the solution equals one of the sub-expression results of `j`
+        """
+        solution = sample["solutions"][i]
+        as_operand = self.operands.get(solution, set())
+        consumers = as_operand & self.main_operands.get(solution, set())
+        examined = len(as_operand)
+
+        if sample["is_single_func"][i]:
+            in_expression = self.expression_text.containing(sample["expressions"][i]) | self.expression_text.containing(solution)
+            examined += len(in_expression)
+            consumers |= in_expression - as_operand
+        else:
+            value = solution_value(sample, i)
+            if value is not None:
+                in_sub_expressions = self.sub_expression_results.get(value, set())
+                examined += len(in_sub_expressions)
+                consumers |= in_sub_expressions - as_operand
+
+        if instrumentation.enabled:
+            instrumentation.count("create_graph.candidate_pairs", examined)
+        consumers -= self.solutions[solution] # If a number is redefined, ignore the case
+        consumers.discard(i)
+        return sorted(consumers)
+
+class ValueIndex():
+    """
+    Maps the integer value IDs of a combined sample (see `combine_dicts`) to the nodes that consume them, so `create_graph(..., match_values=True)` joins on IDs with hash lookups instead of comparing strings.
+    Equal values written differently (`5` vs `5.0`) or rounded sub-expression results share an ID, and a solution is no longer matched as a substring of unrelated numbers (e.g. `5` within `15`).
+    - `operands`/`main_operands`/`sub_expression_results`: Value ID -> nodes with the value in that field
+    - `solutions`: Value ID -> nodes producing the value, used to skip redefined numbers
+    - `expression_text`: Substring lookup over `expressions` of the expressions of single function nodes
+    """
+    def __init__(self, sample):
+        self.operands = defaultdict(set)
+        self.main_operands = defaultdict(set)
+        self.sub_expression_results = defaultdict(set)
+        self.solutions = defaultdict(set)
+        # Solutions that are not numbers (ID `-1`) are still compared by their text
+        self.solution_texts = defaultdict(set)
+
+        for j, solution_id in enumerate(sample["solution_ids"]):
+            if solution_id >= 0:
+                self.solutions[solution_id].add(j)
+            else:
+                self.solution_texts[sample["solutions"][j]].add(j)
+            for operand_id in sample["operand_ids"][j]:
+                self.operands[operand_id].add(j)
+            for operand_id in sample["main_operand_ids"][j]:
+                self.main_operands[operand_id].add(j)
+            if sample["has_sub_expressions"][j]:
+                for result_id in sample["sub_expression_result_ids"][j]:
+                    self.sub_expression_results[result_id].add(j)
+
+        self.expression_text = ExpressionText(sample["expressions"], [expression for expression, is_single_func in zip(sample["expressions"], sample["is_single_func"]) if is_single_func])
+
+    def consumers(self, sample, i):
+        """
+        Returns the sorted indices of nodes that consume the solution of node `i`, with the rules of `SolutionIndex.consumers` applied to value IDs:
+        1. The value is an operand of `j`: linked only if it is also a main operand
+        2. Otherwise, `i` is a single function: linked if its expression appears within the expression of `j`
+        3. Otherwise, linked if the value equals one of the sub-expression results of `j`
+        """
+        solution_id = sample["solution_ids"][i]
+        as_operand = self.operands.get(solution_id, set()) if solution_id >= 0 else set()
+        consumers = as_operand & self.main_operands.get(solution_id, set())
+        examined = len(as_operand)
+
+        if sample["is_single_func"][i]:
+            in_expression = self.expression_text.containing(sample["expressions"][i])
+            examined += len(in_expression)
+            consumers |= in_expression - as_operand
+        elif solution_id >= 0:
+            in_sub_expressions = self.sub_expression_results.get(solution_id, set())
+            examined += len(in_sub_expressions)
+            consumers |= in_sub_expressions - as_operand
+
+        if instrumentation.enabled:
+            instrumentation.count("create_graph.candidate_pairs", examined)
+
+        consumers -= self.solutions[solution_id] if solution_id >= 0 else self.solution_texts[sample["solutions"][i]] # If a number is redefined, ignore the case
+        consumers.discard(i)
+        return sorted(consumers)
+
+def solution_value(sample, i):
+    """
+    Returns the numeric solution of node `i`, taken from the parsed `solution_values` when the sample has them.
+    """
+    if "solution_values" in sample:
+        value = sample["solution_values"][i]
+        return value if value == value else None
+    return to_float(sample["solutions"][i])
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+@instrumented()
+def create_graph(sample, match_values=False):
+    """
+    Builds the calculation graph of a (combined) sample, with an edge from each calculation to every calculation consuming its solution.
+
+    :param sample: A processed sample, or a mix from `combine_dicts`
+    :param match_values: Joins on the integer value IDs of `combine_dicts` (`ValueIndex`) instead of the solution strings (`SolutionIndex`)
+    """
     adjacency_list = AdjacencyList()
     for equation in sample["full_equations"]:
         adjacency_list.add_node(equation)
@@ -65,22 +276,19 @@ def create_graph(sample):
     # for samp, val in sample.items():
     #     print(samp, val)
     # print()
-    
+
+    with instrumentation.timer("solution_index"):
+        solution_index = ValueIndex(sample) if match_values else SolutionIndex(sample)
+    num_edges = 0
     for i in range(len(adjacency_list)):
-        for j in range(len(adjacency_list)):
-            neighbors = set(adjacency_list.get_node(i).get_neighbors_indices())
-            if i == j or sample["solutions"][i] == sample["solutions"][j] or j in neighbors: # If a number is redefined, ignore the case
-                continue
-
-            if sample["solutions"][i] in sample["operands"][j]:
-                if sample["solutions"][i] in sample["main_operands"][j]:
-                    adjacency_list.get_node(i).add_neighbor(j, 1.0)
-            elif sample["is_single_func"][i]:
-                if sample["expressions"][i] in sample["expressions"][j] or sample["solutions"][i] in sample["expressions"][j]:
-                    adjacency_list.get_node(i).add_neighbor(j, 1.0)
-            elif sample["has_sub_expressions"][j]:
-                for sub_express_result in sample["sub_expression_results"][j]:
-                    if float(sample["solutions"][i]) == float(sub_express_result):
-                        adjacency_list.get_node(i).add_neighbor(j, 1.0)
+        consumers = solution_index.consumers(sample, i)
+        num_edges += len(consumers)
+        for j in consumers:
+            adjacency_list.get_node(i).add_neighbor(j, 1.0)
+
+    if instrumentation.enabled:
+        # Pairs the all-pairs comparison would have examined, against the index candidates actually checked
+        instrumentation.count("create_graph.all_pairs", len(adjacency_list) * (len(adjacency_list) - 1))
+        instrumentation.count("create_graph.edges", num_edges)
     
-    return adjacency_list
\ No newline at end of file
+    return adjacency_list
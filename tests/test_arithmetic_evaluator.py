@@ -0,0 +1,66 @@
+import re
+import sys
+import json
+import random
+from pathlib import Path
+import sympy
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+from parser.arithmetic_evaluator import ArithmeticEvaluator
+from synthetic_chains import generate_rows
+
+GADGET_EXPRESSION = re.compile(r'<gadget id="calculator">(.*?)</gadget>', re.DOTALL)
+
+def random_literal(rng):
+    kind = rng.random()
+    if kind < 0.4:
+        return str(rng.randint(0, 200))
+    if kind < 0.7:
+        return f"{rng.randint(0, 999)}.{rng.randint(0, 99999)}"
+    if kind < 0.8:
+        return rng.choice(["0.1", "0.2", "0.3", "1e-5", "2.5e3", "0.0", "100.0", "3.33333", "1234567.891"])
+    if kind < 0.9:
+        second = f", {random_literal(rng)}" if rng.random() < 0.5 else ""
+        return f"{rng.choice(['sqrt', 'factorial', 'gcd', 'lcm', 'floor', 'ceiling', 'Abs'])}({random_literal(rng)}{second})"
+    return f"-{rng.randint(1, 50)}"
+
+def random_expression(rng, depth=0):
+    if depth > 3 or rng.random() < 0.3:
+        return random_literal(rng)
+    operator = rng.choice(["+", "-", "*", "/", "%", "**", "*", "/"])
+    if operator == "**":
+        return f"({random_expression(rng, depth + 1)})**{rng.choice(['2', '3', '-1', '0.5', '2.0', '-2', '1', '0'])}"
+    return f"({random_expression(rng, depth + 1)}){operator}({random_expression(rng, depth + 1)})"
+
+def sympy_result(expr):
+    try:
+        return str(sympy.sympify(expr).evalf())
+    except Exception:
+        return None
+
+def assert_matches_sympy(exprs):
+    evaluator = ArithmeticEvaluator()
+    checked = 0
+    for expr in exprs:
+        result = evaluator.evaluate(expr)
+        # `None` falls back on Sympy, which is always correct
+        if result is not None:
+            assert result == sympy_result(expr), expr
+            checked += 1
+    return checked
+
+def test_fuzzed_expressions_match_sympy():
+    rng = random.Random(0)
+    assert assert_matches_sympy([random_expression(rng) for _ in range(1500)]) > 500
+
+def test_chain_expressions_match_sympy():
+    rows = json.loads((ROOT / "benchmarks" / "fixtures" / "calc_math_qa_rows.json").read_text())
+    rows += generate_rows(1000, function_rate=0.3, small_result_rate=0.3, seed=2)
+    exprs = [expr for row in rows for expr in GADGET_EXPRESSION.findall(row["chain"])]
+    assert assert_matches_sympy(exprs) > len(exprs) // 2
+
+def test_unsupported_expressions_fall_back():
+    evaluator = ArithmeticEvaluator()
+    for expr in ("pi * 2", "log(8)", "sqrt(2)", "1/0", "x + 1", "(-8)**0.5"):
+        assert evaluator.evaluate(expr) is None
@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from parser import ChainStream
+
+def test_calculations_failing_to_process_are_reported_and_skipped():
+    chunks = ['<gadget id="calculator">2+3</gadget><output>5</output>\n<gadget id="calculator">(2+3</gadget>', '<output>5</output>\n<gadget id="calculator">5*2</gadget><output>10</output>\n']
+    reports = []
+    stream = ChainStream(on_malformed=reports.append)
+    calculations = list(stream.calculations(chunks))
+    assert [calculation["full_equations"] for calculation in calculations] == ["2+3=5", "5*2=10"]
+    assert [(report["kind"], report["offset"]) for report in reports] == [("unprocessable", 55)]
+    assert stream.malformed == reports
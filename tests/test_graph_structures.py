@@ -0,0 +1,84 @@
+import sys
+import json
+import random
+from functools import lru_cache
+from pathlib import Path
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+from parser.calc_math_qa_parser import Calc_Math_QA_Processer, combine_dicts
+from structures import create_graph
+from structures.graph_structures import ExpressionText, to_float
+from synthetic_chains import generate_rows
+
+@lru_cache(maxsize=None)
+def processed_samples():
+    # Fixture rows, and synthetic rows with many single functions whose small results collide with other expressions
+    rows = json.loads((ROOT / "benchmarks" / "fixtures" / "calc_math_qa_rows.json").read_text())
+    rows += generate_rows(300, function_rate=0.3, collision_rate=0.2, small_result_rate=0.3, seed=1)
+    processor = Calc_Math_QA_Processer(special_func=set(), special_var=set())
+    return [processor.process_chain(row) for row in rows]
+
+def random_mixes(num_mixes, seed=0):
+    samples = processed_samples()
+    rng = random.Random(seed)
+    for _ in range(num_mixes):
+        random.seed(rng.random())
+        yield combine_dicts(rng.sample(samples, rng.randint(1, 20)))
+
+def pairwise_edges(sample):
+    # The all-pairs comparison `create_graph` replaced
+    solutions = sample["solutions"]
+    edges = set()
+    for i in range(len(solutions)):
+        for j in range(len(solutions)):
+            if i == j or solutions[i] == solutions[j]: # If a number is redefined, ignore the case
+                continue
+            if solutions[i] in sample["operands"][j]:
+                if solutions[i] in sample["main_operands"][j]:
+                    edges.add((i, j))
+            elif sample["is_single_func"][i]:
+                if sample["expressions"][i] in sample["expressions"][j] or solutions[i] in sample["expressions"][j]:
+                    edges.add((i, j))
+            elif sample["has_sub_expressions"][j]:
+                value = to_float(solutions[i])
+                if value is not None and any(value == to_float(result) for result in sample["sub_expression_results"][j]):
+                    edges.add((i, j))
+    return edges
+
+def pairwise_value_edges(sample):
+    # The all-pairs comparison on the value IDs of `combine_dicts`, solutions that are not numbers compared by their text
+    ids = sample["solution_ids"]
+    edges = set()
+    for i in range(len(ids)):
+        for j in range(len(ids)):
+            if i == j or (ids[i] == ids[j] and (ids[i] >= 0 or sample["solutions"][i] == sample["solutions"][j])):
+                continue
+            if ids[i] >= 0 and ids[i] in sample["operand_ids"][j]:
+                if ids[i] in sample["main_operand_ids"][j]:
+                    edges.add((i, j))
+            elif sample["is_single_func"][i]:
+                if sample["expressions"][i] in sample["expressions"][j]:
+                    edges.add((i, j))
+            elif ids[i] >= 0 and sample["has_sub_expressions"][j] and ids[i] in sample["sub_expression_result_ids"][j]:
+                edges.add((i, j))
+    return edges
+
+def graph_edges(adjacency_list):
+    return {(i, j) for i, node in enumerate(adjacency_list.get_nodes()) for j in node.get_neighbors_indices()}
+
+def test_expression_text_matches_substring_search():
+    expressions = ["gcd(12, 18)", "6 * 12", "612 - 1", "lcm(4, 6) + 6", "", "aaab"]
+    needles = ["6", "12", "gcd(12, 18)", "612", "aab", "ab", "missing"]
+    expression_text = ExpressionText(expressions, needles)
+    for needle in needles:
+        assert expression_text.containing(needle) == {j for j, expression in enumerate(expressions) if needle in expression}
+    assert expression_text.containing("") == set(range(len(expressions)))
+
+def test_create_graph_matches_pairwise_scan():
+    for mix in random_mixes(60):
+        assert graph_edges(create_graph(mix)) == pairwise_edges(mix)
+
+def test_create_graph_on_value_ids_matches_pairwise_scan():
+    for mix in random_mixes(60, seed=1):
+        assert graph_edges(create_graph(mix, match_values=True)) == pairwise_value_edges(mix)
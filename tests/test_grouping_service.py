@@ -0,0 +1,46 @@
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from service import grouping_service
+from service import GroupingService
+
+def test_idle_eviction_skips_sessions_with_a_request_in_progress(tmp_path, monkeypatch):
+    # While one idle session is spilled, another gets a request that is still parsing when the loop reaches it
+    spilling = threading.Event()
+    write_spill = GroupingService.write_spill
+    parse_calculations = grouping_service.parse_calculations
+
+    def slow_write_spill(self, session):
+        if session.session_id == "a":
+            spilling.set()
+            time.sleep(0.3)
+        return write_spill(self, session)
+
+    def slow_parse_calculations(text, special_func=frozenset()):
+        time.sleep(0.6)
+        return parse_calculations(text, special_func)
+
+    async def run():
+        service = GroupingService(num_workers=0, spill_dir=tmp_path, idle_timeout=0.1)
+        await service.add("a", "2+3=5")
+        await service.add("b", "4*5=20")
+        for session in service.sessions.values():
+            session.last_used -= 10
+        monkeypatch.setattr(GroupingService, "write_spill", slow_write_spill)
+        monkeypatch.setattr(grouping_service, "parse_calculations", slow_parse_calculations)
+
+        service.idle_task = asyncio.create_task(service.evict_idle())
+        await asyncio.to_thread(spilling.wait)
+        await service.add("b", "20-5=15")
+        service.idle_task.cancel()
+        monkeypatch.setattr(GroupingService, "write_spill", write_spill)
+
+        assert service.nbytes == sum(session.nbytes for session in service.sessions.values())
+        assert (await service.groups("b"))["calculations"] == 2
+        assert (await service.groups("a"))["calculations"] == 1
+        await service.close()
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+import sys
+import json
+import random
+from pathlib import Path
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+from parser.calc_math_qa_parser import Calc_Math_QA_Processer, combine_dicts
+from structures import create_graph
+from logic import classify_groups, IncrementalGrouper
+from synthetic_chains import generate_rows
+
+def random_mixes(num_mixes, seed=0):
+    rows = json.loads((ROOT / "benchmarks" / "fixtures" / "calc_math_qa_rows.json").read_text())
+    rows += generate_rows(300, function_rate=0.3, collision_rate=0.2, small_result_rate=0.3, seed=4)
+    processor = Calc_Math_QA_Processer(special_func=set(), special_var=set())
+    samples = [processor.process_chain(row) for row in rows]
+    rng = random.Random(seed)
+    for _ in range(num_mixes):
+        random.seed(rng.random())
+        yield combine_dicts(rng.sample(samples, rng.randint(1, 20)))
+
+def test_incremental_grouping_matches_batch_grouping():
+    for mix in random_mixes(60):
+        adjacency_list = create_graph(mix)
+        all_groups, reverse_adjacency = classify_groups(adjacency_list)
+        grouper = IncrementalGrouper()
+        grouper.add_sample(mix)
+
+        assert repr(grouper.adjacency_list) == repr(adjacency_list)
+        assert sorted(map(sorted, grouper.get_groups())) == sorted(map(sorted, all_groups))
+        assert {node: sorted(nodes) for node, nodes in grouper.reverse_adjacency.items() if nodes} == {node: sorted(nodes) for node, nodes in reverse_adjacency.items() if nodes}
+
+        # Every group is ordered with each calculation before its consumers, apart from the edges closing a cycle
+        orderings = grouper.get_orderings()
+        assert sorted(map(sorted, orderings)) == sorted(map(sorted, all_groups))
+        for ordering in orderings:
+            position = {node: i for i, node in enumerate(ordering)}
+            for node in ordering:
+                for consumer in adjacency_list.get_node(node).get_neighbors_indices():
+                    assert (node, consumer) in grouper.cycle_edges or position[node] < position[consumer]
@@ -0,0 +1,37 @@
+import sys
+import json
+from pathlib import Path
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+from parser.calc_math_qa_parser import Calc_Math_QA_Processer
+from parser import write_feature_store, ResultCache
+from evaluation import batch_runner, run_batches
+from synthetic_chains import generate_rows
+
+def feature_store(path):
+    rows = json.loads((ROOT / "benchmarks" / "fixtures" / "calc_math_qa_rows.json").read_text())
+    rows += generate_rows(200, function_rate=0.2, collision_rate=0.2, seed=5)
+    processor = Calc_Math_QA_Processer(special_func=set(), special_var=set())
+    return write_feature_store([{"id": row["id"], **processor.process_chain(row)} for row in rows], path)
+
+def scores(output):
+    with open(output) as f:
+        return sorted(({key: value for key, value in json.loads(line).items() if key != "seconds"} for line in f), key=lambda record: record["mix"])
+
+def test_batch_runner_reuses_cached_groupings(tmp_path, monkeypatch):
+    store_path = feature_store(tmp_path / "store.arrow")
+    cache_path = tmp_path / "results.sqlite"
+    run_batches(store_path, tmp_path / "plain.jsonl", 40, mix_size=3, batch_size=8)
+    run_batches(store_path, tmp_path / "cached.jsonl", 40, mix_size=3, batch_size=8, cache_path=cache_path)
+    assert ResultCache(cache_path).stats()["entries"]["mix"] == 40
+
+    # A second run over the same mixes only reads the cache
+    def create_graph(*args, **kwargs):
+        raise AssertionError("Grouped a cached mix again")
+    monkeypatch.setattr(batch_runner, "create_graph", create_graph)
+    monkeypatch.setattr("parser.result_cache.group_combined", create_graph)
+    run_batches(store_path, tmp_path / "reused.jsonl", 40, mix_size=3, batch_size=8, cache_path=cache_path)
+
+    assert scores(tmp_path / "cached.jsonl") == scores(tmp_path / "plain.jsonl")
+    assert scores(tmp_path / "reused.jsonl") == scores(tmp_path / "plain.jsonl")
@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from parser import ValueTable
+
+def test_large_values_do_not_share_quantized_ids():
+    # `1000` quantizes to the same number a value of `1e9` is keyed by
+    for small, large in (("1000", "1000000000"), ("2500", "2500000000")):
+        table = ValueTable()
+        assert table.intern(small) != table.intern(large)
+        assert table.lookup(small) == 0
+        assert table.lookup(large) == 1
+
+def test_equal_values_share_an_id():
+    table = ValueTable()
+    assert table.intern("5") == table.intern("5.0")
+    assert table.intern("25.132741") == table.intern("25.1327412287183")
+    assert table.intern("1000000000") == table.intern("1e9")
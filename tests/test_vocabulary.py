@@ -0,0 +1,27 @@
+import re
+import sys
+import random
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from parser.vocabulary import VocabularyMatchers, trie_pattern, vocabulary_order
+
+FUNCTIONS = {"sqrt", "t", "log", "lcm", "gcd", "e", "exp", "expm", "floor", "factorial", "fact", "choose", "permutation", "speed"}
+VARIABLES = {"pi", "e", "phi", "piano"}
+
+def random_expressions(words, num_expressions=500, seed=0):
+    rng = random.Random(seed)
+    pieces = sorted(words) + ["(", ")", "2", "-3.5", " + ", "*", "**", "x", "q"]
+    return ["".join(rng.choice(pieces) for _ in range(rng.randint(1, 12))) for _ in range(num_expressions)]
+
+def test_trie_pattern_matches_longest_first_alternation():
+    for words in (FUNCTIONS, VARIABLES):
+        alternation = re.compile("|".join(re.escape(word) for word in vocabulary_order(words)))
+        trie = re.compile(trie_pattern(words))
+        for expr in random_expressions(words):
+            assert trie.findall(expr) == alternation.findall(expr), expr
+
+def test_called_functions_match_a_scan_of_the_vocabulary():
+    matchers = VocabularyMatchers(FUNCTIONS, VARIABLES)
+    for expr in random_expressions(FUNCTIONS, seed=1):
+        for after_rank in (-1, 3):
+            assert matchers.called_functions(expr, after_rank) == [func for func in matchers.functions[after_rank+1:] if f"{func}(" in expr], expr